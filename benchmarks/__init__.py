@@ -0,0 +1,9 @@
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+'''
+Performance benchmarks of the LIMS workflows.
+
+The benchmarks run against the database used by the test suite (the
+TRYTOND_DATABASE_URI and DB_NAME environment variables), seeded with
+synthetic data. Run `python -m benchmarks --help` for the commands.
+'''
@@ -0,0 +1,151 @@
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import argparse
+import datetime
+import json
+import multiprocessing
+import platform
+import statistics
+import sys
+
+from benchmarks.scenarios import SCENARIOS
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+        description='Benchmarks of the LIMS workflows')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    setup = subparsers.add_parser('setup',
+        help='create the benchmark database')
+    setup.add_argument('--analyses', type=int, default=20,
+        help='number of typified analysis to create (default: %(default)s)')
+
+    run = subparsers.add_parser('run', help='run the scenarios')
+    run.add_argument('-s', '--scenario', action='append',
+        choices=list(SCENARIOS.keys()), dest='scenarios',
+        help='scenario to run, may be repeated (default: all)')
+    run.add_argument('--entries', type=int, default=10,
+        help='entries per run (default: %(default)s)')
+    run.add_argument('--samples', type=int, default=5,
+        help='samples per entry (default: %(default)s)')
+    run.add_argument('--analyses', type=int, default=5,
+        help='services per sample (default: %(default)s)')
+    run.add_argument('--seed', type=int, default=0,
+        help='seed of the synthetic data (default: %(default)s)')
+    run.add_argument('--repeat', type=int, default=3,
+        help='timed runs per scenario (default: %(default)s)')
+    run.add_argument('-o', '--output', default='-',
+        help='file of the JSON results (default: stdout)')
+    return parser.parse_args(args)
+
+
+def setup(options):
+    from benchmarks.data import setup_database
+    modules = set()
+    for values in SCENARIOS.values():
+        modules.update(values['modules'])
+    setup_database(sorted(modules), analysis_count=options.analyses)
+
+
+def _run_scenario(name, options, queue):
+    'Run the scenario in a fresh process and put its results in queue'
+    from trytond.tests.test_tryton import DB_NAME
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+    from benchmarks.data import SyntheticData
+    from benchmarks.measure import Measure
+
+    values = SCENARIOS[name]
+    Pool.start()
+    pool = Pool(DB_NAME)
+    pool.init()
+
+    def measure(count_statements):
+        with Transaction().start(DB_NAME, 0):
+            User = pool.get('res.user')
+            context = User.get_preferences(context_only=True)
+        with Transaction().start(DB_NAME, 1, context=context) as transaction:
+            data = SyntheticData(seed=options.seed, entries=options.entries,
+                samples=options.samples, analyses=options.analyses)
+            operation = values['prepare'](data)
+            with Measure(count_statements=count_statements) as result:
+                operation()
+            transaction.rollback()
+        return result
+
+    with Transaction().start(DB_NAME, 0):
+        Module = pool.get('ir.module')
+        activated = Module.search([
+            ('name', 'in', values['modules']),
+            ('state', '=', 'activated'),
+            ])
+    if len(activated) != len(values['modules']):
+        queue.put({'skipped': 'modules not activated: %s'
+            % ', '.join(values['modules'])})
+        return
+
+    times = [measure(False).wall_time for _ in range(options.repeat)]
+    counted = measure(True)
+    queue.put({
+        'wall_time': {
+            'min': min(times),
+            'median': statistics.median(times),
+            'max': max(times),
+            'runs': times,
+            },
+        'sql_statements': counted.statements,
+        'peak_rss_kb': counted.peak_rss,
+        })
+
+
+def run(options):
+    from trytond.tests.test_tryton import DB_NAME
+
+    context = multiprocessing.get_context('spawn')
+    results = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'database': DB_NAME,
+        'parameters': {
+            'entries': options.entries,
+            'samples': options.samples,
+            'analyses': options.analyses,
+            'seed': options.seed,
+            'repeat': options.repeat,
+            },
+        'scenarios': {},
+        }
+    for name in options.scenarios or SCENARIOS.keys():
+        queue = context.Queue()
+        process = context.Process(target=_run_scenario,
+            args=(name, options, queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            result = {'error': 'exit code %s' % process.exitcode}
+        else:
+            result = queue.get()
+        results['scenarios'][name] = result
+        print('%s: %s' % (name, result.get('skipped') or result.get('error')
+                or '%.3fs' % result['wall_time']['median']), file=sys.stderr)
+
+    if options.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+def main(args=None):
+    options = parse_arguments(args)
+    if options.command == 'setup':
+        setup(options)
+    else:
+        run(options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import datetime
+import random
+
+__all__ = ['setup_database', 'SyntheticData']
+
+ANALYSIS_PREFIX = 'BENCH'
+CUSTOMER_NAME = 'Benchmark Customer'
+
+
+def setup_database(modules, analysis_count=20):
+    '''
+    Activate the modules in the test database and create the reference
+    data of the LIMS scenario, the benchmark customer and analysis_count
+    typified analysis
+    '''
+    from proteus import Model
+    from trytond.tests.tools import activate_modules
+    from trytond.modules.company.tests.tools import create_company, \
+        get_company
+    from trytond.modules.lims.tests.tools import set_lims_configuration, \
+        create_workyear, create_base_tables
+
+    today = datetime.date.today()
+    config = activate_modules(modules)
+
+    create_company()
+    company = get_company()
+    set_lims_configuration(company)
+    create_workyear(company, today)
+    create_base_tables()
+
+    Party = Model.get('party.party')
+    customer = Party(name=CUSTOMER_NAME)
+    address = customer.addresses.new()
+    address.invoice_contact = True
+    address.invoice_contact_default = True
+    address.report_contact = True
+    address.report_contact_default = True
+    address.acknowledgment_contact = True
+    address.acknowledgment_contact_default = True
+    address.email = 'benchmark@domain.com'
+    customer.save()
+
+    Analysis = Model.get('lims.analysis')
+    Typification = Model.get('lims.typification')
+    product_type, = Model.get('lims.product.type').find([
+        ('code', '=', 'WINE')])
+    matrix, = Model.get('lims.matrix').find([('code', '=', 'GRAPE')])
+    method, = Model.get('lims.lab.method').find([('code', '=', '002')])
+    laboratory, = Model.get('lims.laboratory').find([('code', '=', 'SQ')])
+    device, = Model.get('lims.lab.device').find([('code', '=', 'PH01')])
+    for i in range(analysis_count):
+        analysis = Analysis(
+            code='%s%04d' % (ANALYSIS_PREFIX, i),
+            description='Benchmark analysis %s' % i,
+            type='analysis',
+            behavior='normal')
+        analysis.laboratories.new(laboratory=laboratory)
+        analysis.methods.append(method)
+        analysis.devices.new(laboratory=laboratory, device=device)
+        analysis.save()
+        analysis.click('activate')
+        Typification(
+            product_type=product_type,
+            matrix=matrix,
+            analysis=analysis,
+            method=method).save()
+    return config
+
+
+class SyntheticData(object):
+    '''
+    Generator of the volume data of a benchmark run.
+
+    It must be used inside a transaction of the benchmark database. The
+    same seed and scale give the same entries, samples, services and
+    results.
+    '''
+
+    def __init__(self, seed=0, entries=10, samples=5, analyses=5):
+        self.random = random.Random(seed)
+        self.entries = entries
+        self.samples = samples
+        self.analyses = analyses
+        self._reference = None
+
+    @property
+    def reference(self):
+        'The ids of the reference data created by setup_database'
+        if self._reference is None:
+            self._reference = self._get_reference()
+        return self._reference
+
+    def _get_reference(self):
+        from trytond.pool import Pool
+        pool = Pool()
+        Party = pool.get('party.party')
+        Analysis = pool.get('lims.analysis')
+        Config = pool.get('lims.configuration')
+
+        def get(model, code):
+            record, = pool.get(model).search([('code', '=', code)])
+            return record.id
+
+        customer, = Party.search([('name', '=', CUSTOMER_NAME)])
+        analysis = Analysis.search([
+            ('code', 'like', ANALYSIS_PREFIX + '%'),
+            ], order=[('code', 'ASC')])
+        if len(analysis) < self.analyses:
+            raise ValueError('The database has %s benchmark analysis, '
+                'setup it with at least %s' % (len(analysis), self.analyses))
+        return {
+            'customer': customer.id,
+            'address': customer.addresses[0].id,
+            'language': Config(1).results_report_language.id,
+            'product_type': get('lims.product.type', 'WINE'),
+            'matrix': get('lims.matrix', 'GRAPE'),
+            'zone': get('lims.zone', 'N'),
+            'fraction_type': get('lims.fraction.type', 'MCL'),
+            'storage_location': get('stock.location', 'STO'),
+            'package_type': get('lims.packaging.type', '01'),
+            'package_state': get('lims.packaging.integrity', 'OK'),
+            'laboratory': get('lims.laboratory', 'SQ'),
+            'method': get('lims.lab.method', '002'),
+            'device': get('lims.lab.device', 'PH01'),
+            'analysis': [a.id for a in analysis],
+            }
+
+    def create_entries(self):
+        'Create the draft entries with their samples and services'
+        from trytond.pool import Pool
+        from trytond.transaction import Transaction
+        pool = Pool()
+        Entry = pool.get('lims.entry')
+        Sample = pool.get('lims.sample')
+
+        ref = self.reference
+        now = datetime.datetime.now()
+        contacts = [('create', [{'contact': ref['address']}])]
+        entries = Entry.create([{
+                    'party': ref['customer'],
+                    'invoice_party': ref['customer'],
+                    'date': now,
+                    'report_language': ref['language'],
+                    'invoice_contacts': contacts,
+                    'report_contacts': contacts,
+                    'acknowledgment_contacts': contacts,
+                    'no_acknowledgment_of_receipt': True,
+                    } for _ in range(self.entries)])
+
+        samples = []
+        for entry in entries:
+            for i in range(self.samples):
+                analysis = self.random.sample(ref['analysis'], self.analyses)
+                services = [{
+                        'analysis': a,
+                        'laboratory': ref['laboratory'],
+                        'method': ref['method'],
+                        'device': ref['device'],
+                        'urgent': self.random.random() < 0.1,
+                        'priority': 0,
+                        'divide': False,
+                        } for a in analysis]
+                samples.append({
+                    'entry': entry.id,
+                    'party': ref['customer'],
+                    'date': now,
+                    'sample_client_description': 'Benchmark sample',
+                    'product_type': ref['product_type'],
+                    'matrix': ref['matrix'],
+                    'zone': ref['zone'],
+                    'label': 'BENCH-%s-%s' % (entry.id, i),
+                    'packages': [('create', [{
+                        'quantity': 1,
+                        'type': ref['package_type'],
+                        'state': ref['package_state'],
+                        }])],
+                    'fractions': [('create', [{
+                        'type': ref['fraction_type'],
+                        'storage_location': ref['storage_location'],
+                        'storage_time': 3,
+                        'shared': False,
+                        'services': [('create', services)],
+                        }])],
+                    })
+        with Transaction().set_context(create_sample=True):
+            Sample.create(samples)
+        return entries
+
+    def create_confirmed_entries(self):
+        Entry = self._get_model('lims.entry')
+        entries = self.create_entries()
+        Entry.confirm(entries)
+        return entries
+
+    def get_notebooks(self, entries):
+        Notebook = self._get_model('lims.notebook')
+        return Notebook.search([
+            ('fraction.sample.entry', 'in', [e.id for e in entries]),
+            ])
+
+    def set_results(self, entries):
+        '''
+        Write a random result and an end date on the notebook lines of the
+        entries, as the laboratory would
+        '''
+        from trytond.transaction import Transaction
+        NotebookLine = self._get_model('lims.notebook.line')
+
+        cursor = Transaction().connection.cursor()
+        today = datetime.date.today()
+        lines = NotebookLine.search([
+            ('notebook', 'in', [n.id for n in self.get_notebooks(entries)]),
+            ], order=[('id', 'ASC')])
+        for line in lines:
+            cursor.execute('UPDATE "' + NotebookLine._table + '" '
+                'SET result = %s, start_date = %s, end_date = %s '
+                'WHERE id = %s',
+                ('%.2f' % self.random.uniform(0, 14), today, today, line.id))
+        return lines
+
+    def create_accepted_entries(self):
+        Accept = self._get_model('lims.notebook.accept_lines', type='wizard')
+        from trytond.transaction import Transaction
+
+        entries = self.create_confirmed_entries()
+        self.set_results(entries)
+        notebooks = self.get_notebooks(entries)
+        session_id, _, _ = Accept.create()
+        with Transaction().set_context(active_ids=[n.id for n in notebooks]):
+            Accept(session_id).transition_ok()
+        return entries
+
+    def create_interface(self):
+        '''
+        Create and activate a CSV interface that reads a fraction number,
+        an analysis code and a result per row
+        '''
+        Interface = self._get_model('lims.interface')
+        interface, = Interface.create([{
+                    'name': 'Benchmark',
+                    'kind': 'template',
+                    'template_type': 'csv',
+                    'first_row': 1,
+                    'field_separator': 'comma',
+                    'charset': 'utf-8',
+                    'columns': [('create', [{
+                        'name': 'Fraction',
+                        'alias': 'fraction_number',
+                        'type_': 'char',
+                        'source_column': 1,
+                        'evaluation_order': 1,
+                        }, {
+                        'name': 'Analysis',
+                        'alias': 'analysis_code',
+                        'type_': 'char',
+                        'source_column': 2,
+                        'evaluation_order': 2,
+                        }, {
+                        'name': 'Value',
+                        'alias': 'value',
+                        'type_': 'float',
+                        'source_column': 3,
+                        'evaluation_order': 3,
+                        }])],
+                    }])
+        Interface.activate([interface])
+        return interface
+
+    def interface_file(self, entries):
+        'Return a CSV file with a result for each notebook line of entries'
+        NotebookLine = self._get_model('lims.notebook.line')
+        lines = NotebookLine.search([
+            ('notebook', 'in', [n.id for n in self.get_notebooks(entries)]),
+            ], order=[('id', 'ASC')])
+        rows = ['%s,%s,%.2f' % (l.fraction.number, l.analysis.code,
+                self.random.uniform(0, 14)) for l in lines]
+        return ('\n'.join(rows) + '\n').encode('utf-8')
+
+    @staticmethod
+    def _get_model(name, type='model'):
+        from trytond.pool import Pool
+        return Pool().get(name, type=type)
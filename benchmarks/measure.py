@@ -0,0 +1,65 @@
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import logging
+import resource
+import time
+
+__all__ = ['Measure', 'peak_rss']
+
+SQL_LOGGER = 'trytond.backend.postgresql.database'
+
+
+def peak_rss():
+    'Return the peak resident set size of the process in kilobytes'
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class _StatementCounter(logging.Handler):
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class Measure(object):
+    '''
+    Measure the wall time, the SQL statements and the peak resident
+    memory of the code run inside the context.
+
+    Statements are counted from the debug log of the PostgreSQL cursor,
+    which formats every query, so the wall time of a counted run is
+    not comparable with the one of a run without counting.
+    '''
+
+    def __init__(self, count_statements=False):
+        self.count_statements = count_statements
+        self.wall_time = None
+        self.statements = None
+        self.peak_rss = None
+        self._counter = _StatementCounter()
+        self._logger = logging.getLogger(SQL_LOGGER)
+        self._level = None
+        self._propagate = None
+        self._start = None
+
+    def __enter__(self):
+        if self.count_statements:
+            self._level = self._logger.level
+            self._propagate = self._logger.propagate
+            self._logger.addHandler(self._counter)
+            self._logger.setLevel(logging.DEBUG)
+            self._logger.propagate = False
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.wall_time = time.perf_counter() - self._start
+        if self.count_statements:
+            self._logger.removeHandler(self._counter)
+            self._logger.setLevel(self._level)
+            self._logger.propagate = self._propagate
+            self.statements = self._counter.count
+        self.peak_rss = peak_rss()
@@ -0,0 +1,110 @@
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+from collections import OrderedDict
+
+__all__ = ['SCENARIOS', 'scenario']
+
+SCENARIOS = OrderedDict()
+
+
+def scenario(name, modules=('lims',)):
+    '''
+    Register a benchmark scenario.
+
+    The decorated function receives a SyntheticData, seeds the data the
+    operation needs and returns the operation to be measured. It is only
+    run when all the modules are activated.
+    '''
+    def decorator(func):
+        SCENARIOS[name] = {
+            'prepare': func,
+            'modules': tuple(modules),
+            'doc': (func.__doc__ or '').strip(),
+            }
+        return func
+    return decorator
+
+
+def _get_model(name, type='model'):
+    from trytond.pool import Pool
+    return Pool().get(name, type=type)
+
+
+def _run_wizard(name, transition, context=None, **start):
+    from trytond.transaction import Transaction
+    Wizard = _get_model(name, type='wizard')
+    session_id, _, _ = Wizard.create()
+    wizard = Wizard(session_id)
+    for field, value in start.items():
+        setattr(wizard.start, field, value)
+    with Transaction().set_context(**(context or {})):
+        return getattr(wizard, 'transition_%s' % transition)()
+
+
+@scenario('entry_confirm')
+def entry_confirm(data):
+    'Confirm entries, creating their notebooks and notebook lines'
+    Entry = _get_model('lims.entry')
+    entries = data.create_entries()
+    return lambda: Entry.confirm(entries)
+
+
+@scenario('update_samples_state')
+def update_samples_state(data):
+    'Recompute the state of the samples of confirmed entries'
+    Sample = _get_model('lims.sample')
+    entries = data.create_confirmed_entries()
+    samples = Sample.search([('entry', 'in', [e.id for e in entries])])
+    return lambda: Sample.update_samples_state([s.id for s in samples])
+
+
+@scenario('result_acceptance')
+def result_acceptance(data):
+    'Accept the results of the notebooks of confirmed entries'
+    entries = data.create_confirmed_entries()
+    data.set_results(entries)
+    notebooks = data.get_notebooks(entries)
+    return lambda: _run_wizard('lims.notebook.accept_lines', 'ok',
+        context={'active_ids': [n.id for n in notebooks]})
+
+
+@scenario('results_report')
+def results_report(data):
+    'Generate the results report details of accepted notebooks'
+    entries = data.create_accepted_entries()
+    notebooks = data.get_notebooks(entries)
+    return lambda: _run_wizard('lims.notebook.generate_results_report',
+        'generate',
+        context={
+            'samples_pending_reporting_laboratory': (
+                data.reference['laboratory']),
+            },
+        notebooks=notebooks, report=None, type='final', preliminary=False,
+        corrective=False, group_samples=False, append_samples=False)
+
+
+@scenario('interface_collection', modules=('lims_interface',))
+def interface_collection(data):
+    'Collect a CSV file with a result per notebook line in a compilation'
+    Compilation = _get_model('lims.interface.compilation')
+    entries = data.create_confirmed_entries()
+    interface = data.create_interface()
+    compilation, = Compilation.create([{
+                'interface': interface.id,
+                'table': interface.table.id,
+                'revision': interface.revision,
+                'origins': [('create', [{
+                    'origin_file': data.interface_file(entries),
+                    'file_name': 'benchmark.csv',
+                    }])],
+                }])
+    Compilation.activate([compilation])
+    return lambda: Compilation.collect([compilation])
+
+
+@scenario('board_refresh', modules=('lims_board',))
+def board_refresh(data):
+    'Rebuild the dashboard samples summary'
+    SampleSummary = _get_model('lims.board.sample_summary')
+    data.create_confirmed_entries()
+    return SampleSummary.refresh
@@ -18,9 +18,11 @@ from . import results_report
 from . import stock
 from . import uom
 from . import party
+from . import perf
 
 
 def register():
+    perf.install()
     Pool.register(
         formula_parser.FormulaParser,
         department.Headquarters,
@@ -68,6 +70,7 @@ def register():
         analysis.CalculatedTypificationReadOnly,
         sample.PackagingType,
         analysis.AnalysisIncluded,
+        analysis.AnalysisIncludedClosure,
         analysis.AnalysisDevice,
         certification.CertificationType,
         certification.TechnicalScope,
@@ -206,6 +209,8 @@ def register():
         control_tendency.TrendChartAnalysis2,
         control_tendency.OpenTrendChartStart,
         control_tendency.TrendChartData,
+        perf.PerfSample,
+        perf.Cron,
         module='lims', type_='model')
     Pool.register(
         results_report.DivideReportsStart,
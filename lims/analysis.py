@@ -10,6 +10,7 @@ from datetime import datetime, date
 from decimal import Decimal
 from sql import Literal
 
+from trytond import backend
 from trytond.model import Workflow, ModelView, ModelSQL, DeactivableMixin, \
     fields, Unique
 from trytond.wizard import Wizard, StateTransition, StateView, StateAction, \
@@ -20,6 +21,7 @@ from trytond.transaction import Transaction
 from trytond.pyson import PYSONEncoder, Eval, Equal, Bool, Not, Or, And
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
+from trytond.tools import grouped_slice
 
 
 class Typification(ModelSQL, ModelView):
@@ -1162,75 +1164,110 @@ class Analysis(Workflow, ModelSQL, ModelView):
     def get_included_analysis(cls, analysis_id):
         cursor = Transaction().connection.cursor()
         pool = Pool()
-        AnalysisIncluded = pool.get('lims.analysis.included')
+        AnalysisIncludedClosure = pool.get('lims.analysis.included.closure')
 
-        childs = []
-        cursor.execute('SELECT included_analysis '
-            'FROM "' + AnalysisIncluded._table + '" '
-            'WHERE analysis = %s', (analysis_id,))
-        included_analysis_ids = [x[0] for x in cursor.fetchall()]
-        for analysis_id in included_analysis_ids:
-            if analysis_id not in childs:
-                childs.append(analysis_id)
-                childs.extend(cls.get_included_analysis(analysis_id))
-        return childs
+        cursor.execute('SELECT descendant '
+            'FROM "' + AnalysisIncludedClosure._table + '" '
+            'WHERE ancestor = %s '
+            'ORDER BY descendant', (analysis_id,))
+        return [x[0] for x in cursor.fetchall()]
 
     @classmethod
     def get_included_analysis_analysis(cls, analysis_id):
         cursor = Transaction().connection.cursor()
         pool = Pool()
-        AnalysisIncluded = pool.get('lims.analysis.included')
+        AnalysisIncludedClosure = pool.get('lims.analysis.included.closure')
         Analysis = pool.get('lims.analysis')
 
-        childs = []
-        cursor.execute('SELECT ia.included_analysis, a.type '
-            'FROM "' + AnalysisIncluded._table + '" ia '
+        cursor.execute('SELECT c.descendant '
+            'FROM "' + AnalysisIncludedClosure._table + '" c '
                 'INNER JOIN "' + Analysis._table + '" a '
-                'ON a.id = ia.included_analysis '
-            'WHERE analysis = %s', (analysis_id,))
-        included_analysis = cursor.fetchall()
-        for analysis in included_analysis:
-            if analysis[1] == 'analysis' and analysis[0] not in childs:
-                childs.append(analysis[0])
-            childs.extend(cls.get_included_analysis_analysis(analysis[0]))
-        return childs
+                'ON a.id = c.descendant '
+            'WHERE c.ancestor = %s '
+                'AND a.type = \'analysis\' '
+            'ORDER BY c.descendant', (analysis_id,))
+        return [x[0] for x in cursor.fetchall()]
+
+    @classmethod
+    def get_included_analysis_query(cls, analysis_ids):
+        '''
+        Return the query, and its parameters, of the analysis included in
+        each of analysis_ids (themselves included) with the columns
+        position (of the analysis in analysis_ids), analysis and
+        included_analysis
+        '''
+        pool = Pool()
+        AnalysisIncludedClosure = pool.get('lims.analysis.included.closure')
+        Analysis = pool.get('lims.analysis')
+
+        params = []
+        for position, analysis_id in enumerate(analysis_ids):
+            params.extend([position, analysis_id])
+        planned = ('SELECT * FROM (VALUES ' +
+            ', '.join(['(%s, %s)'] * len(analysis_ids)) +
+            ') AS p (position, analysis)')
+        query = ('SELECT p.position, p.analysis, '
+                'p.analysis AS included_analysis '
+            'FROM (' + planned + ') p '
+            'UNION '
+            'SELECT p.position, p.analysis, c.descendant '
+            'FROM (' + planned + ') p '
+                'INNER JOIN "' + AnalysisIncludedClosure._table + '" c '
+                'ON c.ancestor = p.analysis '
+                'INNER JOIN "' + Analysis._table + '" a '
+                'ON a.id = c.descendant '
+            'WHERE a.type = \'analysis\'')
+        return query, params + params
 
     @classmethod
     def get_included_analysis_method(cls, analysis_id):
         cursor = Transaction().connection.cursor()
         pool = Pool()
         AnalysisIncluded = pool.get('lims.analysis.included')
+        AnalysisIncludedClosure = pool.get('lims.analysis.included.closure')
 
-        childs = []
-        cursor.execute('SELECT included_analysis, method '
+        cursor.execute('SELECT DISTINCT included_analysis, method '
             'FROM "' + AnalysisIncluded._table + '" '
-            'WHERE analysis = %s', (analysis_id,))
-        included_analysis = cursor.fetchall()
-        for analysis in included_analysis:
-            if analysis not in childs:
-                childs.append(analysis)
-            childs.extend(cls.get_included_analysis_method(analysis[0]))
-        return childs
+            'WHERE analysis = %s '
+                'OR analysis IN ('
+                    'SELECT descendant '
+                    'FROM "' + AnalysisIncludedClosure._table + '" '
+                    'WHERE ancestor = %s)',
+            (analysis_id, analysis_id))
+        return cursor.fetchall()
 
     @classmethod
     def get_parents_analysis(cls, analysis_id):
         cursor = Transaction().connection.cursor()
         pool = Pool()
         AnalysisIncluded = pool.get('lims.analysis.included')
+        AnalysisIncludedClosure = pool.get('lims.analysis.included.closure')
         Analysis = pool.get('lims.analysis')
 
-        parents = []
-        cursor.execute('SELECT ia.analysis '
+        # Only the paths made of active sets and groups are followed
+        cursor.execute('SELECT ia.included_analysis, ia.analysis '
             'FROM "' + AnalysisIncluded._table + '" ia '
                 'INNER JOIN "' + Analysis._table + '" a '
                 'ON a.id = ia.analysis '
-            'WHERE ia.included_analysis = %s '
-                'AND a.state = \'active\'', (analysis_id,))
-        parents_analysis_ids = [x[0] for x in cursor.fetchall()]
-        for analysis_id in parents_analysis_ids:
-            if analysis_id not in parents:
-                parents.append(analysis_id)
-                parents.extend(cls.get_parents_analysis(analysis_id))
+            'WHERE a.state = \'active\' '
+                'AND (ia.included_analysis = %s '
+                'OR ia.included_analysis IN ('
+                    'SELECT ancestor '
+                    'FROM "' + AnalysisIncludedClosure._table + '" '
+                    'WHERE descendant = %s))',
+            (analysis_id, analysis_id))
+        parents_by_child = {}
+        for child_id, parent_id in cursor.fetchall():
+            parents_by_child.setdefault(child_id, []).append(parent_id)
+
+        parents = []
+        to_visit = [analysis_id]
+        while to_visit:
+            child_id = to_visit.pop()
+            for parent_id in parents_by_child.get(child_id, []):
+                if parent_id not in parents:
+                    parents.append(parent_id)
+                    to_visit.append(parent_id)
         return parents
 
     def get_rec_name(self, name):
@@ -1470,6 +1507,24 @@ class Analysis(Workflow, ModelSQL, ModelView):
 
         return analysis
 
+    @classmethod
+    def delete(cls, analysis):
+        cursor = Transaction().connection.cursor()
+        pool = Pool()
+        AnalysisIncludedClosure = pool.get('lims.analysis.included.closure')
+
+        ancestor_ids = []
+        for sub_analysis in grouped_slice(analysis):
+            cursor.execute('SELECT DISTINCT ancestor '
+                'FROM "' + AnalysisIncludedClosure._table + '" '
+                'WHERE descendant IN %s',
+                (tuple(a.id for a in sub_analysis),))
+            ancestor_ids.extend(x[0] for x in cursor.fetchall())
+        super().delete(analysis)
+        deleted_ids = set(a.id for a in analysis)
+        AnalysisIncludedClosure.update_ancestors(
+            [a for a in ancestor_ids if a not in deleted_ids])
+
     @classmethod
     def create_product(cls, analysis):
         CreateProduct = Pool().get('lims.create_analysis_product',
@@ -1680,7 +1735,13 @@ class Analysis(Workflow, ModelSQL, ModelView):
         return [('id', 'in', record_ids)]
 
     @classmethod
-    def analysis_pending_fractions(cls, analysis_ids=None):
+    def analysis_pending_fractions(cls, analysis_ids=None, date_from=None,
+            date_to=None, laboratory=None):
+        '''
+        Return the number of confirmed services pending planification per
+        analysis, optionally restricted to a confirmation date window (by
+        default the date_from/date_to of the context) and a laboratory
+        '''
         cursor = Transaction().connection.cursor()
         context = Transaction().context
         pool = Pool()
@@ -1694,69 +1755,59 @@ class Analysis(Workflow, ModelSQL, ModelView):
         Service = pool.get('lims.service')
         Fraction = pool.get('lims.fraction')
 
-        date_from = context.get('date_from') or str(date.min)
-        date_to = context.get('date_to') or str(date.max)
-
-        dates_where = ''
-        dates_where += ('AND srv.confirmation_date::date >= \'%s\'::date ' %
-            date_from)
-        dates_where += ('AND srv.confirmation_date::date <= \'%s\'::date ' %
-            date_to)
-
-        cursor.execute('SELECT DISTINCT(nl.service) '
-            'FROM "' + NotebookLine._table + '" nl '
-                'INNER JOIN "' + PlanificationServiceDetail._table +
-                '" psd ON psd.notebook_line = nl.id '
-                'INNER JOIN "' + PlanificationDetail._table + '" pd '
-                'ON psd.detail = pd.id '
-                'INNER JOIN "' + Planification._table + '" p '
-                'ON pd.planification = p.id '
-            'WHERE p.state = \'preplanned\'')
-        planned_services = [s[0] for s in cursor.fetchall()]
-        planned_services_ids = ', '.join(
-            str(s) for s in [0] + planned_services)
-        preplanned_clause = 'AND srv.id NOT IN (%s) ' % planned_services_ids
-
-        cursor.execute('SELECT DISTINCT(d.service) '
-            'FROM "' + EntryDetailAnalysis._table + '" d '
-                'INNER JOIN "' + Analysis._table + '" a '
-                'ON a.id = d.analysis '
-            'WHERE d.plannable = TRUE '
-                'AND d.state IN (\'draft\', \'unplanned\') '
-                'AND a.behavior != \'internal_relation\'')
-        not_planned_services = [s[0] for s in cursor.fetchall()]
-        not_planned_services_ids = ', '.join(
-            str(s) for s in [0] + not_planned_services)
-        not_planned_services_clause = ('AND id IN (%s) ' %
-            not_planned_services_ids)
+        date_from = date_from or context.get('date_from') or date.min
+        date_to = date_to or context.get('date_to') or date.max
+
+        query = ('WITH preplanned AS ('
+                'SELECT DISTINCT nl.service '
+                'FROM "' + NotebookLine._table + '" nl '
+                    'INNER JOIN "' + PlanificationServiceDetail._table +
+                    '" psd ON psd.notebook_line = nl.id '
+                    'INNER JOIN "' + PlanificationDetail._table + '" pd '
+                    'ON psd.detail = pd.id '
+                    'INNER JOIN "' + Planification._table + '" p '
+                    'ON pd.planification = p.id '
+                'WHERE p.state = \'preplanned\'), '
+            'not_planned AS ('
+                'SELECT DISTINCT d.service '
+                'FROM "' + EntryDetailAnalysis._table + '" d '
+                    'INNER JOIN "' + Analysis._table + '" a '
+                    'ON a.id = d.analysis '
+                'WHERE d.plannable = TRUE '
+                    'AND d.state IN (\'draft\', \'unplanned\') '
+                    'AND a.behavior != \'internal_relation\') '
+            'SELECT srv.analysis, COUNT(*) '
+            'FROM "' + Service._table + '" srv '
+                'INNER JOIN "' + Fraction._table + '" frc '
+                'ON frc.id = srv.fraction '
+                'INNER JOIN not_planned np '
+                'ON np.service = srv.id '
+                'LEFT JOIN preplanned pp '
+                'ON pp.service = srv.id '
+            'WHERE frc.confirmed = TRUE '
+                'AND pp.service IS NULL '
+                'AND srv.confirmation_date::date >= %s::date '
+                'AND srv.confirmation_date::date <= %s::date ')
+        params = [str(date_from), str(date_to)]
+        if laboratory:
+            query += 'AND srv.laboratory = %s '
+            params.append(int(laboratory))
 
         if analysis_ids:
-            all_analysis_ids = analysis_ids
+            all_analysis_ids = list(analysis_ids)
         else:
             cursor.execute('SELECT id FROM "' + cls._table + '"')
             all_analysis_ids = [a[0] for a in cursor.fetchall()]
 
-        res = {}
-        for analysis_id in all_analysis_ids:
-            count = 0
-            cursor.execute('SELECT srv.id '
-                'FROM "' + Service._table + '" srv '
-                    'INNER JOIN "' + Fraction._table + '" frc '
-                    'ON frc.id = srv.fraction '
-                'WHERE srv.analysis = %s '
-                    'AND frc.confirmed = TRUE ' +
-                    dates_where + preplanned_clause,
-                (analysis_id,))
-            pending_services = [s[0] for s in cursor.fetchall()]
-            if pending_services:
-                pending_services_ids = ', '.join(str(s) for s in
-                    pending_services)
-                cursor.execute('SELECT COUNT(*) '
-                    'FROM "' + Service._table + '" '
-                    'WHERE id IN (' + pending_services_ids + ') ' +
-                        not_planned_services_clause)
-                count = cursor.fetchone()[0]
-            res[analysis_id] = count
+        res = dict.fromkeys(all_analysis_ids, 0)
+        if not analysis_ids:
+            cursor.execute(query + 'GROUP BY srv.analysis', params)
+            res.update((a, c) for a, c in cursor.fetchall() if a in res)
+            return res
+        for sub_ids in grouped_slice(all_analysis_ids):
+            cursor.execute(query + 'AND srv.analysis IN %s '
+                'GROUP BY srv.analysis', params + [tuple(sub_ids)])
+            res.update(cursor.fetchall())
         return res
 
     @staticmethod
@@ -1882,10 +1933,28 @@ class AnalysisIncluded(ModelSQL, ModelView):
 
     @classmethod
     def create(cls, vlist):
+        pool = Pool()
+        AnalysisIncludedClosure = pool.get('lims.analysis.included.closure')
         included_analysis = super().create(vlist)
+        AnalysisIncludedClosure.update_ancestors(
+            [i.analysis.id for i in included_analysis])
         cls.create_typification_calculated(included_analysis)
         return included_analysis
 
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        AnalysisIncludedClosure = pool.get('lims.analysis.included.closure')
+        actions = iter(args)
+        analysis_ids = set()
+        for included_analysis, vals in zip(actions, actions):
+            if 'analysis' in vals or 'included_analysis' in vals:
+                analysis_ids.update(i.analysis.id for i in included_analysis)
+                if vals.get('analysis'):
+                    analysis_ids.add(vals['analysis'])
+        super().write(*args)
+        AnalysisIncludedClosure.update_ancestors(analysis_ids)
+
     @classmethod
     def create_typification_calculated(cls, included_analysis):
         cursor = Transaction().connection.cursor()
@@ -1980,8 +2049,12 @@ class AnalysisIncluded(ModelSQL, ModelView):
 
     @classmethod
     def delete(cls, included_analysis):
+        pool = Pool()
+        AnalysisIncludedClosure = pool.get('lims.analysis.included.closure')
+        analysis_ids = [i.analysis.id for i in included_analysis]
         cls.delete_typification_calculated(included_analysis)
         super().delete(included_analysis)
+        AnalysisIncludedClosure.update_ancestors(analysis_ids)
 
     @classmethod
     def delete_typification_calculated(cls, included_analysis):
@@ -2092,6 +2165,98 @@ class AnalysisIncluded(ModelSQL, ModelView):
             ]
 
 
+class AnalysisIncludedClosure(ModelSQL):
+    'Included Analysis Closure'
+    __name__ = 'lims.analysis.included.closure'
+
+    ancestor = fields.Many2One('lims.analysis', 'Ancestor', required=True,
+        ondelete='CASCADE', select=True)
+    descendant = fields.Many2One('lims.analysis', 'Descendant',
+        required=True, ondelete='CASCADE', select=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('ancestor_descendant_uniq', Unique(t, t.ancestor, t.descendant),
+                'lims.msg_analysis_included_closure_unique'),
+            ]
+
+    @classmethod
+    def __register__(cls, module_name):
+        cursor = Transaction().connection.cursor()
+        TableHandler = backend.TableHandler
+
+        # The closure is rebuilt on each update, clean it before the unique
+        # constraint is added
+        if TableHandler.table_exist(cls._table):
+            cursor.execute('DELETE FROM "' + cls._table + '"')
+        super().__register__(module_name)
+        cls.populate_closure()
+
+    @classmethod
+    def populate_closure(cls):
+        cursor = Transaction().connection.cursor()
+        AnalysisIncluded = Pool().get('lims.analysis.included')
+
+        cursor.execute('DELETE FROM "' + cls._table + '"')
+        cursor.execute('SELECT DISTINCT analysis '
+            'FROM "' + AnalysisIncluded._table + '"')
+        analysis_ids = [x[0] for x in cursor.fetchall()]
+        for sub_ids in grouped_slice(analysis_ids):
+            cls._insert_descendants(list(sub_ids))
+
+    @classmethod
+    def update_ancestors(cls, analysis_ids):
+        '''
+        Recompute the descendants of analysis_ids and of all their
+        ancestors, whose included analysis have changed
+        '''
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        analysis_ids = set(analysis_ids)
+        if not analysis_ids:
+            return
+        # Concurrent updates could recompute from a closure that misses the
+        # other one's changes
+        transaction.database.lock(transaction.connection, cls._table)
+        for sub_ids in grouped_slice(list(analysis_ids)):
+            cursor.execute('SELECT DISTINCT ancestor '
+                'FROM "' + cls._table + '" '
+                'WHERE descendant IN %s', (tuple(sub_ids),))
+            analysis_ids.update(x[0] for x in cursor.fetchall())
+
+        analysis_ids = list(analysis_ids)
+        for sub_ids in grouped_slice(analysis_ids):
+            cursor.execute('DELETE FROM "' + cls._table + '" '
+                'WHERE ancestor IN %s', (tuple(sub_ids),))
+        for sub_ids in grouped_slice(analysis_ids):
+            cls._insert_descendants(list(sub_ids))
+
+    @classmethod
+    def _insert_descendants(cls, analysis_ids):
+        cursor = Transaction().connection.cursor()
+        AnalysisIncluded = Pool().get('lims.analysis.included')
+
+        cursor.execute('WITH RECURSIVE tree(ancestor, descendant) AS ('
+                'SELECT analysis, included_analysis '
+                'FROM "' + AnalysisIncluded._table + '" '
+                'WHERE analysis IN %s '
+                'UNION '
+                'SELECT t.ancestor, ia.included_analysis '
+                'FROM tree t '
+                    'INNER JOIN "' + AnalysisIncluded._table + '" ia '
+                    'ON ia.analysis = t.descendant) '
+            'INSERT INTO "' + cls._table + '" '
+                '(ancestor, descendant, create_uid, create_date) '
+            'SELECT ancestor, descendant, %s, %s '
+            'FROM tree '
+            'WHERE ancestor != descendant',
+            (tuple(analysis_ids), Transaction().user, datetime.now()))
+
+
 class AnalysisLaboratory(ModelSQL, ModelView):
     'Analysis - Laboratory'
     __name__ = 'lims.analysis-laboratory'
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# This file is part of lims module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import os
+import json
+import logging
+import tempfile
+import threading
+from hashlib import sha256
+from concurrent.futures import ThreadPoolExecutor
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from trytond.config import config
+
+__all__ = ['get_chart']
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+CACHE_DIRECTORY = config.get('lims', 'chart_cache_directory',
+    default=os.path.join(config.get('database', 'path'), 'lims_charts'))
+# Maximum size of the cached images in megabytes
+CACHE_SIZE = config.getint('lims', 'chart_cache_size', default=200)
+
+_cache_lock = threading.Lock()
+# Size of the cached images, estimated from the writes of this process
+_cache_size = None
+
+# pyplot keeps global state, so charts are drawn one at a time
+_executor = ThreadPoolExecutor(max_workers=1,
+    thread_name_prefix='lims_chart')
+
+
+def _draw(draw):
+    try:
+        return draw()
+    finally:
+        plt.close('all')
+
+
+def get_chart(options, draw):
+    '''
+    Return the PNG image drawn by draw, a function without arguments that
+    must not use the transaction.
+
+    Images are stored on disk under the digest of options, which must
+    hold the plotted series and every option that changes the drawing.
+    '''
+    key = json.dumps([CACHE_VERSION, options], sort_keys=True, default=str)
+    digest = sha256(key.encode('utf-8')).hexdigest()
+    path = os.path.join(CACHE_DIRECTORY, digest[:2], digest + '.png')
+    try:
+        with open(path, 'rb') as f:
+            image = f.read()
+        # The modification time orders the eviction
+        os.utime(path)
+        return image
+    except OSError:
+        pass
+
+    image = _executor.submit(_draw, draw).result()
+    if not image:
+        return image
+    try:
+        os.makedirs(CACHE_DIRECTORY, mode=0o700, exist_ok=True)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning('Unable to store chart in cache: %s', e)
+    else:
+        _evict(len(image))
+    return image
+
+
+def _scan():
+    'Return (mtime, size, path) of the cached images'
+    files = []
+    for root, _, names in os.walk(CACHE_DIRECTORY):
+        for name in names:
+            if not name.endswith('.png'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+
+def _evict(added):
+    '''
+    Remove the least recently used images when the cache exceeds
+    CACHE_SIZE, down to nine tenths of it so it is not scanned at every
+    write
+    '''
+    global _cache_size
+    limit = CACHE_SIZE * 1024 * 1024
+    with _cache_lock:
+        if _cache_size is None:
+            _cache_size = sum(f[1] for f in _scan())
+        else:
+            _cache_size += added
+        if _cache_size <= limit:
+            return
+        files = sorted(_scan())
+        _cache_size = sum(f[1] for f in files)
+        for mtime, size, path in files:
+            if _cache_size <= limit * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            _cache_size -= size
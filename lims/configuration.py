@@ -30,6 +30,21 @@ def get_print_date():
     return date
 
 
+def clean_transaction_cache(Model, ids):
+    '''
+    Remove the records of Model from the transaction cache, as
+    ModelSQL.write does. To be called after updating their rows with SQL.
+    '''
+    transaction = Transaction()
+    for cache in transaction.cache.values():
+        if Model.__name__ in cache:
+            cache_cls = cache[Model.__name__]
+            for id_ in ids:
+                cache_cls.pop(id_, None)
+    # Invalidate the records read in this transaction
+    transaction.counter += 1
+
+
 class NotebookView(ModelSQL, ModelView):
     'Laboratory Notebook View'
     __name__ = 'lims.notebook.view'
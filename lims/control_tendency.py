@@ -4,9 +4,8 @@
 # the full copyright notices and license terms.
 import pandas as pd
 from io import BytesIO
-from math import sqrt
-import matplotlib.pyplot as plt
-import gc
+from functools import partial
+from collections import deque
 
 from trytond.model import ModelView, ModelSQL, fields
 from trytond.wizard import (Wizard, StateTransition, StateView, StateAction,
@@ -17,6 +16,91 @@ from trytond.transaction import Transaction
 from trytond.report import Report
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
+from .chart import get_chart
+
+
+def check_rule(results, upper_parameter, lower_parameter, occurrences,
+        total):
+    '''
+    Check a control rule over the last values of results: `occurrences`
+    of the last `total` values above upper_parameter or below
+    lower_parameter
+    '''
+    if len(results) < total:
+        return False
+
+    total_counter = 0
+    upper_counter = 0
+    lower_counter = 0
+    for result in reversed(results):
+
+        total_counter += 1
+        if result > upper_parameter:
+            upper_counter += 1
+            if total_counter == total:
+                if (upper_counter >= occurrences or
+                        lower_counter >= occurrences):
+                    return True
+                return False
+            lower_counter = 0
+        elif result < lower_parameter:
+            lower_counter += 1
+            if total_counter == total:
+                if (lower_counter >= occurrences or
+                        upper_counter >= occurrences):
+                    return True
+                return False
+            upper_counter = 0
+        else:
+            if total_counter == total:
+                if (upper_counter >= occurrences or
+                        lower_counter >= occurrences):
+                    return True
+                return False
+            upper_counter = 0
+            lower_counter = 0
+    return False
+
+
+class WestgardEvaluator(object):
+    '''
+    Streaming evaluator of the control rules of a tendency. It keeps only
+    the window of values the rules look at, so adding a result costs the
+    same whatever the length of the history.
+    '''
+    WINDOW = 8
+
+    def __init__(self, tendency):
+        mean = tendency.mean
+        # (rule, upper parameter, lower parameter, occurrences, total)
+        self.rules = [
+            # 1 value above or below the mean +/- 3 SD
+            ('4', mean + tendency.three_sd_adj,
+                mean - tendency.three_sd_adj, 1, 1),
+            # 2 of 3 consecutive values above or below the mean +/- 2 SD
+            ('3', mean + tendency.two_sd_adj,
+                mean - tendency.two_sd_adj, 2, 3),
+            # 4 of 5 consecutive values above or below the mean +/- 1 SD
+            ('2', mean + tendency.one_sd_adj,
+                mean - tendency.one_sd_adj, 4, 5),
+            # 8 consecutive values above or below the mean
+            ('1', mean, mean, 8, 8),
+            ]
+        self.window = deque(maxlen=self.WINDOW)
+
+    def get_parameters(self):
+        return repr([r[1:3] for r in self.rules])
+
+    def add_result(self, result):
+        'Add a result and return the rules it breaks'
+        self.window.append(result)
+        rules = [rule for rule, upper_parameter, lower_parameter,
+            occurrences, total in self.rules
+            if check_rule(self.window, upper_parameter, lower_parameter,
+                occurrences, total)]
+        if not rules:
+            rules.append('')
+        return rules
 
 
 class RangeType(ModelSQL, ModelView):
@@ -289,6 +373,12 @@ class ControlTendency(ModelSQL, ModelView):
     range_max = fields.Float('Range Maximum', digits=(16, 3), readonly=True)
     rules_description = fields.Function(fields.Text('Rules description'),
         'get_rules_description')
+    # Last Tendencies Analysis
+    analysis_laboratory = fields.Many2One('lims.laboratory',
+        'Analysis Laboratory', readonly=True)
+    analysis_date_from = fields.Date('Analysis Date from', readonly=True)
+    analysis_date_to = fields.Date('Analysis Date to', readonly=True)
+    analysis_parameters = fields.Char('Analysis Parameters', readonly=True)
 
     del _states
 
@@ -787,285 +877,194 @@ class MeansDeviationsCalc(Wizard):
         return 'empty'
 
     def _create_lines(self):
-        cursor = Transaction().connection.cursor()
+        return self._create_result_lines(grouped=False)
+
+    def _create_grouped_lines(self):
+        return self._create_result_lines(grouped=True)
+
+    def _get_results_query(self, grouped):
+        '''
+        Return the query of the numeric results to compute, with the
+        mobile range of each result, its parameters and the name of the
+        columns that group them
+        '''
         pool = Pool()
-        ControlResultLine = pool.get('lims.control.result_line')
+        NotebookLine = pool.get('lims.notebook.line')
+        Notebook = pool.get('lims.notebook')
+        Fraction = pool.get('lims.fraction')
+        Sample = pool.get('lims.sample')
+        Analysis = pool.get('lims.analysis')
+        AnalysisFamily = pool.get('lims.analysis.family')
         AnalysisFamilyCertificant = pool.get(
             'lims.analysis.family.certificant')
-        NotebookLine = pool.get('lims.notebook.line')
 
-        clause = [
-            ('laboratory', '=', self.start.laboratory.id),
-            ('end_date', '>=', self.start.date_from),
-            ('end_date', '<=', self.start.date_to),
-            ('notebook.fraction.type', '=', self.start.fraction_type.id),
-            ('analysis.behavior', '=', 'normal'),
-            ('concentration_level', '!=', None),
-            ('result', 'not in', [None, '']),
-            ('annulled', '=', False),
-            ]
-        if self.start.product_type:
-            clause.append(('notebook.product_type', '=',
-                self.start.product_type.id))
-        if self.start.matrix:
-            clause.append(('notebook.matrix', '=', self.start.matrix.id))
+        number = ('nl.result ~ \'^\\s*[-+]?([0-9]+\\.?[0-9]*|\\.[0-9]+)'
+            '([eE][-+]?[0-9]+)?\\s*$\'')
+        where = ('WHERE nl.laboratory = %s '
+                'AND nl.end_date >= %s '
+                'AND nl.end_date <= %s '
+                'AND f.type = %s '
+                'AND a.behavior = \'normal\' '
+                'AND nl.concentration_level IS NOT NULL '
+                'AND nl.annulled = FALSE '
+                'AND ' + number + ' ')
+        params = [self.start.laboratory.id, self.start.date_from,
+            self.start.date_to, self.start.fraction_type.id]
         if self.start.concentration_level:
-            clause.append(('concentration_level', '=',
-                self.start.concentration_level.id))
+            where += 'AND nl.concentration_level = %s '
+            params.append(self.start.concentration_level.id)
+
+        join = ''
+        if grouped:
+            keys = ['family', 'analysis', 'concentration_level']
+            select = 'DISTINCT c.family, '
+            join = ('INNER JOIN "' + AnalysisFamilyCertificant._table +
+                '" c ON c.product_type = s.product_type '
+                'AND c.matrix = s.matrix ')
+            if self.start.family:
+                where += 'AND c.family = %s '
+                params.append(self.start.family.id)
+            else:
+                where += ('AND c.family IN (SELECT id FROM "' +
+                    AnalysisFamily._table + '") ')
+        else:
+            keys = ['product_type', 'matrix', 'analysis',
+                'concentration_level']
+            select = 's.product_type, s.matrix, '
+            if self.start.product_type:
+                where += 'AND s.product_type = %s '
+                params.append(self.start.product_type.id)
+            if self.start.matrix:
+                where += 'AND s.matrix = %s '
+                params.append(self.start.matrix.id)
+            if self.start.family:
+                where += ('AND EXISTS (SELECT 1 FROM "' +
+                    AnalysisFamilyCertificant._table + '" c '
+                    'WHERE c.family = %s '
+                        'AND c.product_type = s.product_type '
+                        'AND c.matrix = s.matrix) ')
+                params.append(self.start.family.id)
+
+        # The cast is guarded in the expression itself because the range
+        # filters below may be evaluated before the WHERE clause
+        results = ('SELECT ' + select +
+                'nl.analysis, nl.concentration_level, nl.id, nl.end_date, '
+                'n.fraction, nl.device, '
+                'CASE WHEN ' + number + ' '
+                    'THEN CAST(nl.result AS FLOAT) END AS result '
+            'FROM "' + NotebookLine._table + '" nl '
+                'INNER JOIN "' + Notebook._table + '" n '
+                'ON n.id = nl.notebook '
+                'INNER JOIN "' + Fraction._table + '" f '
+                'ON f.id = n.fraction '
+                'INNER JOIN "' + Sample._table + '" s '
+                'ON s.id = f.sample '
+                'INNER JOIN "' + Analysis._table + '" a '
+                'ON a.id = nl.analysis ' +
+                join + where)
+        if self.start.range_min:
+            results = ('SELECT * FROM (' + results + ') r '
+                'WHERE result >= %s')
+            params.append(self.start.range_min)
+        if self.start.range_max:
+            results = ('SELECT * FROM (' + results + ') r '
+                'WHERE result <= %s')
+            params.append(self.start.range_max)
+
+        # A previous result of 0 gives no mobile range, as it did before
+        partition = ', '.join(keys)
+        query = ('WITH results AS (' + results + '), '
+            'lines AS ('
+                'SELECT *, '
+                    'CASE WHEN previous IS NULL OR previous = 0 '
+                        'THEN 0.0 '
+                        'ELSE ABS(result - previous) END AS mr '
+                'FROM ('
+                    'SELECT *, LAG(result) OVER ('
+                        'PARTITION BY ' + partition + ' '
+                        'ORDER BY end_date, id) AS previous '
+                    'FROM results) r) ')
+        return query, params, keys
+
+    def _create_result_lines(self, grouped):
+        cursor = Transaction().connection.cursor()
+        pool = Pool()
+        ControlResultLine = pool.get('lims.control.result_line')
 
-        lines = NotebookLine.search(clause,
-            order=[('end_date', 'ASC'), ('id', 'ASC')])
-        if not lines:
+        query, params, keys = self._get_results_query(grouped)
+        columns = ', '.join(keys)
+
+        # The deviation is taken around the rounded mean, which adds
+        # n/(n-1)*(avg - mean)^2 to the sample variance
+        cursor.execute(query +
+            'SELECT ' + columns + ', n, mean, '
+                'CASE WHEN n > 1 '
+                    'THEN SQRT(variance + n * POWER(average - mean, 2) '
+                        '/ (n - 1)) '
+                    'ELSE 0 END, '
+                'mr '
+            'FROM ('
+                'SELECT ' + columns + ', COUNT(*) AS n, '
+                    'VAR_SAMP(CAST(result AS NUMERIC)) AS variance, '
+                    'AVG(CAST(result AS NUMERIC)) AS average, '
+                    'ROUND(AVG(CAST(result AS NUMERIC)), 2) AS mean, '
+                    'SUM(mr) AS mr, MIN(end_date) AS end_date, '
+                    'MIN(id) AS id '
+                'FROM lines '
+                'GROUP BY ' + columns + ') g '
+            'ORDER BY end_date, id', params)
+        stats = cursor.fetchall()
+        if not stats:
             return []
 
-        range_min = self.start.range_min
-        range_max = self.start.range_max
-
-        check_line_family = False
-        if self.start.family:
-            check_line_family = True
-            cursor.execute('SELECT product_type, matrix '
-                'FROM "' + AnalysisFamilyCertificant._table + '" '
-                'WHERE family = %s',
-                (self.start.family.id,))
-            res = cursor.fetchall()
-            families = [(x[0], x[1]) for x in res]
-
-        records = {}
-        for line in lines:
-            if check_line_family:
-                family_key = (line.notebook.product_type.id,
-                    line.notebook.matrix.id)
-                if family_key not in families:
-                    continue
-            try:
-                result = float(line.result or None)
-            except (TypeError, ValueError):
-                continue
-            if range_min and result < range_min:
-                continue
-            if range_max and result > range_max:
-                continue
-
-            product_type_id = line.notebook.product_type.id
-            matrix_id = line.notebook.matrix.id
-            fraction_type_id = line.notebook.fraction_type.id
-            analysis_id = line.analysis.id
-            concentration_level_id = line.concentration_level.id
-
-            key = (product_type_id, matrix_id, analysis_id,
-                concentration_level_id)
-            if key not in records:
-                records[key] = {
-                    'product_type': product_type_id,
-                    'matrix': matrix_id,
-                    'fraction_type': fraction_type_id,
-                    'analysis': analysis_id,
-                    'concentration_level': concentration_level_id,
-                    'details': {},
-                    'mr_last_result': None,
-                    }
-            mr = (records[key]['mr_last_result'] and
-                abs(result - records[key]['mr_last_result']) or 0.0)
-            records[key]['mr_last_result'] = result
-            records[key]['details'][line.id] = {
-                'date': line.end_date,
-                'fraction': line.notebook.fraction.id,
-                'device': line.device.id if line.device else None,
+        details = {}
+        cursor.execute(query +
+            'SELECT ' + columns + ', end_date, fraction, device, result, mr '
+            'FROM lines '
+            'ORDER BY end_date, id', params)
+        for row in cursor.fetchall():
+            key = row[:len(keys)]
+            date, fraction, device, result, mr = row[len(keys):]
+            details.setdefault(key, []).append({
+                'date': date,
+                'fraction': fraction,
+                'device': device,
                 'result': result,
                 'mr': mr,
-                }
-        if not records:
-            return []
-
-        to_create = []
-        for record in records.values():
-            details = [d for d in record['details'].values()]
-            to_create.append({
-                'session_id': self._session_id,
-                'family': None,
-                'product_type': record['product_type'],
-                'matrix': record['matrix'],
-                'fraction_type': record['fraction_type'],
-                'analysis': record['analysis'],
-                'concentration_level': record['concentration_level'],
-                'details': [('create', details)],
-                'date_from': self.start.date_from,
-                'date_to': self.start.date_to,
-                'range_min': range_min,
-                'range_max': range_max,
                 })
-        if to_create:
-            res_lines = ControlResultLine.create(to_create)
-
-            to_save = []
-            for line in res_lines:
-                count = 0
-                total = 0.00
-                mr_abs_diff = 0.00
-                for detail in line.details:
-                    count += 1
-                    total += detail.result
-                    mr_abs_diff += detail.mr
-                if count > 2:
-                    mr_avg_abs_diff = round(
-                        mr_abs_diff / (count - 1), 2)
-                else:
-                    mr_avg_abs_diff = mr_abs_diff
-                mean = round(total / count, 2)
-                total = 0.00
-                for detail in line.details:
-                    total += (detail.result - mean) ** 2
-                # Se toma correcion poblacional Bessel n-1
-                if count > 1:
-                    deviation = round(sqrt(total / (count - 1)), 2)
-                else:
-                    deviation = 0.00
-                line.mean = mean
-                line.deviation = deviation
-                line.mr_avg_abs_diff = mr_avg_abs_diff
-                to_save.append(line)
-            ControlResultLine.save(to_save)
-            return res_lines
-        return []
-
-    def _create_grouped_lines(self):
-        cursor = Transaction().connection.cursor()
-        pool = Pool()
-        ControlResultLine = pool.get('lims.control.result_line')
-        AnalysisFamily = pool.get('lims.analysis.family')
-        AnalysisFamilyCertificant = pool.get(
-            'lims.analysis.family.certificant')
-        NotebookLine = pool.get('lims.notebook.line')
-
-        clause = [
-            ('laboratory', '=', self.start.laboratory.id),
-            ('end_date', '>=', self.start.date_from),
-            ('end_date', '<=', self.start.date_to),
-            ('notebook.fraction.type', '=', self.start.fraction_type.id),
-            ('analysis.behavior', '=', 'normal'),
-            ('concentration_level', '!=', None),
-            ('result', 'not in', [None, '']),
-            ('annulled', '=', False),
-            ]
-        if self.start.concentration_level:
-            clause.append(('concentration_level', '=',
-                self.start.concentration_level.id))
-
-        lines = NotebookLine.search(clause,
-            order=[('end_date', 'ASC'), ('id', 'ASC')])
-        if not lines:
-            return []
 
         range_min = self.start.range_min
         range_max = self.start.range_max
-
-        if self.start.family:
-            all_families = [self.start.family]
-        else:
-            all_families = AnalysisFamily.search([])
-
-        records = {}
-        for family in all_families:
-            cursor.execute('SELECT product_type, matrix '
-                'FROM "' + AnalysisFamilyCertificant._table + '" '
-                'WHERE family = %s',
-                (family.id,))
-            res = cursor.fetchall()
-            families = [(x[0], x[1]) for x in res]
-
-            for line in lines:
-                family_key = (line.notebook.product_type.id,
-                    line.notebook.matrix.id)
-                if family_key not in families:
-                    continue
-                try:
-                    result = float(line.result or None)
-                except (TypeError, ValueError):
-                    continue
-                if range_min and result < range_min:
-                    continue
-                if range_max and result > range_max:
-                    continue
-
-                family_id = family.id
-                fraction_type_id = line.notebook.fraction_type.id
-                analysis_id = line.analysis.id
-                concentration_level_id = line.concentration_level.id
-
-                key = (family_id, analysis_id, concentration_level_id)
-                if key not in records:
-                    records[key] = {
-                        'family': family_id,
-                        'fraction_type': fraction_type_id,
-                        'analysis': analysis_id,
-                        'concentration_level': concentration_level_id,
-                        'details': {},
-                        'mr_last_result': None,
-                        }
-                mr = (records[key]['mr_last_result'] and
-                    abs(result - records[key]['mr_last_result']) or 0.0)
-                records[key]['mr_last_result'] = result
-                records[key]['details'][line.id] = {
-                    'date': line.end_date,
-                    'fraction': line.notebook.fraction.id,
-                    'device': line.device.id if line.device else None,
-                    'result': result,
-                    'mr': mr,
-                    }
-        if not records:
-            return []
-
         to_create = []
-        for record in records.values():
-            details = [d for d in record['details'].values()]
+        for row in stats:
+            key = row[:len(keys)]
+            count, mean, deviation, mr_abs_diff = row[len(keys):]
+            if count > 2:
+                mr_avg_abs_diff = round(mr_abs_diff / (count - 1), 2)
+            else:
+                mr_avg_abs_diff = mr_abs_diff
+            mean = float(mean)
+            # Se toma correcion poblacional Bessel n-1
+            deviation = round(float(deviation), 2)
+            values = dict(zip(keys, key))
             to_create.append({
                 'session_id': self._session_id,
-                'family': record['family'],
-                'product_type': None,
-                'matrix': None,
-                'fraction_type': record['fraction_type'],
-                'analysis': record['analysis'],
-                'concentration_level': record['concentration_level'],
-                'details': [('create', details)],
+                'family': values.get('family'),
+                'product_type': values.get('product_type'),
+                'matrix': values.get('matrix'),
+                'fraction_type': self.start.fraction_type.id,
+                'analysis': values['analysis'],
+                'concentration_level': values['concentration_level'],
+                'details': [('create', details[key])],
+                'mean': mean,
+                'deviation': deviation,
+                'mr_avg_abs_diff': mr_avg_abs_diff,
                 'date_from': self.start.date_from,
                 'date_to': self.start.date_to,
                 'range_min': range_min,
                 'range_max': range_max,
                 })
-        if to_create:
-            res_lines = ControlResultLine.create(to_create)
-
-            to_save = []
-            for line in res_lines:
-                count = 0
-                total = 0.00
-                mr_abs_diff = 0.00
-                for detail in line.details:
-                    count += 1
-                    total += detail.result
-                    mr_abs_diff += detail.mr
-                if count > 2:
-                    mr_avg_abs_diff = round(
-                        mr_abs_diff / (count - 1), 2)
-                else:
-                    mr_avg_abs_diff = mr_abs_diff
-                mean = round(total / count, 2)
-                total = 0.00
-                for detail in line.details:
-                    total += (detail.result - mean) ** 2
-                # Se toma correcion poblacional Bessel n-1
-                if count > 1:
-                    deviation = round(sqrt(total / (count - 1)), 2)
-                else:
-                    deviation = 0.00
-                line.mean = mean
-                line.deviation = deviation
-                line.mr_avg_abs_diff = mr_avg_abs_diff
-                to_save.append(line)
-            ControlResultLine.save(to_save)
-            return res_lines
-        return []
+        return ControlResultLine.create(to_create)
 
     def default_result(self, fields):
         lines = [l.id for l in self.result.lines]
@@ -1280,10 +1279,8 @@ class TendenciesAnalysis(Wizard):
         cursor = Transaction().connection.cursor()
         pool = Pool()
         ControlTendency = pool.get('lims.control.tendency')
-        ControlTendencyDetail = pool.get('lims.control.tendency.detail')
         AnalysisFamilyCertificant = pool.get(
             'lims.analysis.family.certificant')
-        NotebookLine = pool.get('lims.notebook.line')
 
         tendency_result = []
 
@@ -1328,222 +1325,188 @@ class TendenciesAnalysis(Wizard):
                 family_key = (tendency.product_type.id, tendency.matrix.id)
                 if family_key not in families:
                     continue
+            if self._analyse_tendency(tendency):
+                tendency_result.append(tendency)
+
+        if tendency_result:
+            self.result.tendencies = tendency_result
+            return 'open'
+        return 'end'
 
-            old_details = ControlTendencyDetail.search([
-                ('tendency', '=', tendency.id),
+    def _analyse_tendency(self, tendency):
+        '''
+        Evaluate the control rules over the results of the tendency.
+        When the previous analysis covered the same laboratory, start date
+        and parameters and no result was added or removed in the period it
+        covered, only the new results are evaluated and their details are
+        appended to the existing ones. Otherwise the details are rebuilt.
+        Return True if the tendency has details.
+        '''
+        cursor = Transaction().connection.cursor()
+        pool = Pool()
+        ControlTendency = pool.get('lims.control.tendency')
+        ControlTendencyDetail = pool.get('lims.control.tendency.detail')
+        AnalysisFamilyCertificant = pool.get(
+            'lims.analysis.family.certificant')
+        NotebookLine = pool.get('lims.notebook.line')
+
+        tendency_families = None
+        if tendency.family:
+            cursor.execute('SELECT product_type, matrix '
+                'FROM "' + AnalysisFamilyCertificant._table + '" '
+                'WHERE family = %s',
+                (tendency.family.id,))
+            res = cursor.fetchall()
+            tendency_families = [(x[0], x[1]) for x in res]
+
+        def filter_family(lines):
+            if tendency_families is None:
+                return lines
+            return [line for line in lines
+                if (line.notebook.product_type.id,
+                    line.notebook.matrix.id) in tendency_families]
+
+        clause = [
+            ('laboratory', '=', self.start.laboratory.id),
+            ('notebook.fraction.type', '=', tendency.fraction_type.id),
+            ('analysis', '=', tendency.analysis.id),
+            ('concentration_level', '=', tendency.concentration_level.id),
+            ('result', 'not in', [None, '']),
+            ('annulled', '=', False),
+            ]
+        if tendency_families is None:
+            clause.extend([
+                ('notebook.product_type', '=', tendency.product_type.id),
+                ('notebook.matrix', '=', tendency.matrix.id),
                 ])
-            if old_details:
-                ControlTendencyDetail.delete(old_details)
+        order = [('end_date', 'ASC'), ('id', 'ASC')]
 
-            check_line_family = False
-            if tendency.family:
-                check_line_family = True
-                cursor.execute('SELECT product_type, matrix '
-                    'FROM "' + AnalysisFamilyCertificant._table + '" '
-                    'WHERE family = %s',
-                    (tendency.family.id,))
-                res = cursor.fetchall()
-                tendency_families = [(x[0], x[1]) for x in res]
-
-            clause = [
-                ('laboratory', '=', self.start.laboratory.id),
-                ('notebook.fraction.type', '=', tendency.fraction_type.id),
-                ('analysis', '=', tendency.analysis.id),
-                ('concentration_level', '=', tendency.concentration_level.id),
-                ('result', 'not in', [None, '']),
-                ('annulled', '=', False),
-                ]
-            if not check_line_family:
-                clause.extend([
-                    ('notebook.product_type', '=', tendency.product_type.id),
-                    ('notebook.matrix', '=', tendency.matrix.id),
-                    ])
+        evaluator = WestgardEvaluator(tendency)
+        old_details = ControlTendencyDetail.search([
+            ('tendency', '=', tendency.id),
+            ], order=[('id', 'ASC')])
+        rule_counts = {'1': 0, '2': 0, '3': 0, '4': 0}
 
-            rule_1_count = 0
-            rule_2_count = 0
-            rule_3_count = 0
-            rule_4_count = 0
-            all_lines = NotebookLine.search(clause + [
+        def float_result(line):
+            try:
+                return float(line.result if line.result else None)
+            except(TypeError, ValueError):
+                return None
+
+        lines = None
+        if (len(old_details) >= WestgardEvaluator.WINDOW and
+                all(d.notebook_line for d in old_details) and
+                tendency.analysis_laboratory == self.start.laboratory and
+                tendency.analysis_date_from == self.start.date_from and
+                tendency.analysis_date_to and
+                tendency.analysis_date_to <= self.start.date_to and
+                tendency.analysis_parameters ==
+                evaluator.get_parameters()):
+            last_detail = old_details[-1]
+            last_line = last_detail.notebook_line
+            covered_lines = filter_family(NotebookLine.search(clause + [
+                    ('end_date', '>=', self.start.date_from),
+                    ('end_date', '<=', last_line.end_date),
+                    ], order=order))
+            detail_lines = [d.notebook_line.id for d in old_details]
+            if [l.id for l in covered_lines
+                    if float_result(l) is not None] == detail_lines:
+                covered_ids = set(detail_lines)
+                new_lines = filter_family(NotebookLine.search(clause + [
+                        ('end_date', '>=', last_line.end_date),
+                        ('end_date', '<=', self.start.date_to),
+                        ('id', 'not in', list(covered_ids)),
+                        ], order=order))
+                if all((l.end_date, l.id) > (last_line.end_date,
+                        last_line.id) for l in new_lines):
+                    lines = new_lines
+                    for detail in old_details[-WestgardEvaluator.WINDOW:]:
+                        evaluator.add_result(detail.result)
+                    mr_last_result = last_detail.result
+                    rule_counts = {
+                        '1': tendency.rule_1_count or 0,
+                        '2': tendency.rule_2_count or 0,
+                        '3': tendency.rule_3_count or 0,
+                        '4': tendency.rule_4_count or 0,
+                        }
+
+        if lines is None:
+            if old_details:
+                ControlTendencyDetail.delete(old_details)
+                old_details = []
+            lines = filter_family(NotebookLine.search(clause + [
                     ('end_date', '>=', self.start.date_from),
                     ('end_date', '<=', self.start.date_to),
-                    ], order=[('end_date', 'ASC'), ('id', 'ASC')])
-            if not check_line_family:
-                lines = all_lines
-            else:
-                lines = []
-                for line in all_lines:
-                    family_key = (line.notebook.product_type.id,
-                        line.notebook.matrix.id)
-                    if family_key in tendency_families:
-                        lines.append(line)
-            if lines:
-                results = []
-                prevs = 8 - len(lines)  # Qty of previous results required
-                if prevs > 0:
-                    all_prev_lines = NotebookLine.search(clause + [
-                            ('end_date', '<', self.start.date_from),
-                            ], order=[('end_date', 'ASC'), ('id', 'ASC')],
-                            limit=prevs)
-                    if not check_line_family:
-                        prev_lines = all_prev_lines
-                    else:
-                        prev_lines = []
-                        for line in all_prev_lines:
-                            family_key = (line.notebook.product_type.id,
-                                line.notebook.matrix.id)
-                            if family_key in tendency_families:
-                                prev_lines.append(line)
-                    if prev_lines:
-                        for line in prev_lines:
-                            try:
-                                result = float(line.result if
-                                    line.result else None)
-                            except(TypeError, ValueError):
-                                continue
-                            results.append(result)
-
-                mr_last_result = None
-                to_create = []
-                for line in lines:
-                    try:
-                        result = float(line.result if
-                            line.result else None)
-                    except(TypeError, ValueError):
+                    ], order=order))
+            prevs = WestgardEvaluator.WINDOW - len(lines)
+            if lines and prevs > 0:
+                # Qty of previous results required
+                prev_lines = filter_family(NotebookLine.search(clause + [
+                        ('end_date', '<', self.start.date_from),
+                        ], order=order, limit=prevs))
+                for line in prev_lines:
+                    result = float_result(line)
+                    if result is None:
                         continue
-                    mr = (mr_last_result and
-                          abs(result - mr_last_result) or 0.0)
-                    mr_last_result = result
-                    results.append(result)
-                    rules = self.get_rules(results, tendency)
-                    rules_to_create = []
-                    for r in rules:
-                        if r == '':
-                            continue
-                        rules_to_create.append({'rule': r})
-                        if r == '1':
-                            rule_1_count += 1
-                        elif r == '2':
-                            rule_2_count += 1
-                        elif r == '3':
-                            rule_3_count += 1
-                        elif r == '4':
-                            rule_4_count += 1
-
-                    record = {
-                        'notebook_line': line.id,
-                        'tendency': tendency.id,
-                        'date': line.end_date,
-                        'fraction': line.notebook.fraction.id,
-                        'device': line.device.id if line.device else None,
-                        'result': result,
-                        'rule': rules[0],
-                        'mr': mr,
-                        }
-                    if rules_to_create:
-                        record['rules'] = [('create', rules_to_create)]
-                    to_create.append(record)
+                    evaluator.add_result(result)
+            mr_last_result = None
 
-                ControlTendencyDetail.create(to_create)
-                tendency_result.append(tendency)
+        to_create = []
+        for line in lines:
+            result = float_result(line)
+            if result is None:
+                continue
+            mr = (mr_last_result and
+                  abs(result - mr_last_result) or 0.0)
+            mr_last_result = result
+            rules = evaluator.add_result(result)
+            rules_to_create = []
+            for r in rules:
+                if r == '':
+                    continue
+                rules_to_create.append({'rule': r})
+                rule_counts[r] += 1
 
-            ControlTendency.write([tendency], {
-                'rule_1_count': rule_1_count,
-                'rule_2_count': rule_2_count,
-                'rule_3_count': rule_3_count,
-                'rule_4_count': rule_4_count,
-                })
+            record = {
+                'notebook_line': line.id,
+                'tendency': tendency.id,
+                'date': line.end_date,
+                'fraction': line.notebook.fraction.id,
+                'device': line.device.id if line.device else None,
+                'result': result,
+                'rule': rules[0],
+                'mr': mr,
+                }
+            if rules_to_create:
+                record['rules'] = [('create', rules_to_create)]
+            to_create.append(record)
 
-        if tendency_result:
-            self.result.tendencies = tendency_result
-            return 'open'
-        return 'end'
+        if to_create:
+            ControlTendencyDetail.create(to_create)
+
+        ControlTendency.write([tendency], {
+            'rule_1_count': rule_counts['1'],
+            'rule_2_count': rule_counts['2'],
+            'rule_3_count': rule_counts['3'],
+            'rule_4_count': rule_counts['4'],
+            'analysis_laboratory': self.start.laboratory.id,
+            'analysis_date_from': self.start.date_from,
+            'analysis_date_to': self.start.date_to,
+            'analysis_parameters': evaluator.get_parameters(),
+            })
+        return bool(old_details or lines)
 
     def get_rules(self, results, tendency):
-
-        rules = []
-
-        # Check rule 4
-        # 1 value above or below the mean +/- 3 SD
-        upper_parameter = tendency.mean + tendency.three_sd_adj
-        lower_parameter = tendency.mean - tendency.three_sd_adj
-        occurrences = 1
-        total = 1
-        if self._check_rule(results, upper_parameter, lower_parameter,
-                occurrences, total):
-            rules.append('4')
-
-        # Check rule 3
-        # 2 of 3 consecutive values above or below the mean +/- 2 SD
-        upper_parameter = tendency.mean + tendency.two_sd_adj
-        lower_parameter = tendency.mean - tendency.two_sd_adj
-        occurrences = 2
-        total = 3
-        if self._check_rule(results, upper_parameter, lower_parameter,
-                occurrences, total):
-            rules.append('3')
-
-        # Check rule 2
-        # 4 of 5 consecutive values above or below the mean +/- 1 SD
-        upper_parameter = tendency.mean + tendency.one_sd_adj
-        lower_parameter = tendency.mean - tendency.one_sd_adj
-        occurrences = 4
-        total = 5
-        if self._check_rule(results, upper_parameter, lower_parameter,
-                occurrences, total):
-            rules.append('2')
-
-        # Check rule 1
-        # 8 consecutive values above or below the mean
-        upper_parameter = tendency.mean
-        lower_parameter = tendency.mean
-        occurrences = 8
-        total = 8
-        if self._check_rule(results, upper_parameter, lower_parameter,
-                occurrences, total):
-            rules.append('1')
-
-        if not rules:
-            rules.append('')
-
+        evaluator = WestgardEvaluator(tendency)
+        rules = ['']
+        for result in results[-WestgardEvaluator.WINDOW:]:
+            rules = evaluator.add_result(result)
         return rules
 
     def _check_rule(self, results, upper_parameter, lower_parameter,
             occurrences, total):
-
-        if len(results) < total:
-            return False
-
-        total_counter = 0
-        upper_counter = 0
-        lower_counter = 0
-        for result in reversed(results):
-
-            total_counter += 1
-            if result > upper_parameter:
-                upper_counter += 1
-                if total_counter == total:
-                    if (upper_counter >= occurrences or
-                            lower_counter >= occurrences):
-                        return True
-                    return False
-                lower_counter = 0
-            elif result < lower_parameter:
-                lower_counter += 1
-                if total_counter == total:
-                    if (lower_counter >= occurrences or
-                            upper_counter >= occurrences):
-                        return True
-                    return False
-                upper_counter = 0
-            else:
-                if total_counter == total:
-                    if (upper_counter >= occurrences or
-                            lower_counter >= occurrences):
-                        return True
-                    return False
-                upper_counter = 0
-                lower_counter = 0
-        return False
+        return check_rule(results, upper_parameter, lower_parameter,
+            occurrences, total)
 
     def do_open(self, action):
         action['pyson_domain'] = PYSONEncoder().encode([
@@ -1670,43 +1633,46 @@ class ControlChartReport(Report):
         for r in sorted(list(records.values()), key=lambda x: x['order']):
             cols.append(r['name'])
             ds[r['name']] = [r['recs'][col] for col in index]
-        df = pd.DataFrame(ds, index=index)
-        df = df.reindex(cols, axis=1)
-
-        output = BytesIO()
-        try:
-            ax = df[[gettext('lims.msg_ucl'),
-                ]].plot(kind='line', color='red', rot=45, fontsize=7,
-                    figsize=(10, 7.5), linestyle='-')
-            ax = df[[gettext('lims.msg_uwl'),
-                ]].plot(kind='line', color='orange', rot=45, fontsize=7,
-                    figsize=(10, 7.5), linestyle='-', ax=ax)
-            ax = df[[gettext('lims.msg_upl'),
-                ]].plot(kind='line', color='yellow', rot=45, fontsize=7,
-                    figsize=(10, 7.5), linestyle='--', ax=ax)
-            ax = df[[gettext('lims.msg_cl'),
-                ]].plot(kind='line', color='green', rot=45, fontsize=7,
-                    figsize=(10, 7.5), linestyle='-', ax=ax)
-            ax = df[[gettext('lims.msg_lpl'),
-                ]].plot(kind='line', color='yellow', rot=45, fontsize=7,
-                    figsize=(10, 7.5), linestyle='--', ax=ax)
-            ax = df[[gettext('lims.msg_lwl'),
-                ]].plot(kind='line', color='orange', rot=45, fontsize=7,
-                    figsize=(10, 7.5), linestyle='-', ax=ax)
-            ax = df[[gettext('lims.msg_lcl'),
-                ]].plot(kind='line', color='red', rot=45, fontsize=7,
-                    figsize=(10, 7.5), linestyle='-', ax=ax)
-            ax = df[[gettext('lims.msg_control_chart_result'),
-                ]].plot(kind='line', color='blue', rot=45, fontsize=7,
-                    figsize=(10, 7.5), marker='o', linestyle='-', ax=ax)
-
-            ax.legend(loc='center left', bbox_to_anchor=(1.0, 0.5))
-            ax.get_figure().savefig(output, bbox_inches='tight', dpi=300)
-            image = output.getvalue()
-            output.close()
-            return image
-        except TypeError:
-            return output.getvalue()
+        # (column, color, linestyle, marker)
+        lines = [
+            (gettext('lims.msg_ucl'), 'red', '-', None),
+            (gettext('lims.msg_uwl'), 'orange', '-', None),
+            (gettext('lims.msg_upl'), 'yellow', '--', None),
+            (gettext('lims.msg_cl'), 'green', '-', None),
+            (gettext('lims.msg_lpl'), 'yellow', '--', None),
+            (gettext('lims.msg_lwl'), 'orange', '-', None),
+            (gettext('lims.msg_lcl'), 'red', '-', None),
+            (gettext('lims.msg_control_chart_result'), 'blue', '-', 'o'),
+            ]
+        options = {
+            'chart': 'control',
+            'index': index,
+            'columns': cols,
+            'data': ds,
+            'lines': lines,
+            }
+        return get_chart(options,
+            partial(draw_control_chart, index, cols, ds, lines))
+
+
+def draw_control_chart(index, cols, ds, lines):
+    df = pd.DataFrame(ds, index=index)
+    df = df.reindex(cols, axis=1)
+
+    output = BytesIO()
+    try:
+        ax = None
+        for column, color, linestyle, marker in lines:
+            ax = df[[column]].plot(kind='line', color=color, rot=45,
+                fontsize=7, figsize=(10, 7.5), marker=marker,
+                linestyle=linestyle, ax=ax)
+        ax.legend(loc='center left', bbox_to_anchor=(1.0, 0.5))
+        ax.get_figure().savefig(output, bbox_inches='tight', dpi=300)
+        image = output.getvalue()
+        output.close()
+        return image
+    except TypeError:
+        return output.getvalue()
 
 
 class TrendChart(ModelSQL, ModelView):
@@ -1924,128 +1890,116 @@ class TrendChart(ModelSQL, ModelView):
                 ds2[a_description].append(float(val)
                     if val is not None else None)
 
-        df = pd.DataFrame(ds, index=index)
-        df = df.reindex(cols.values(), axis=1)
+        labels = {
+            'x': self.x_axis_string,
+            'y': self.uom and self.uom.symbol or None,
+            'y2': self.uom_y2 and self.uom_y2.symbol or None,
+            }
+        options = {
+            'chart': 'trend',
+            'index': index,
+            'columns': list(cols.values()),
+            'data': ds,
+            'columns_y2': list(cols_y2.values()),
+            'data_y2': ds2,
+            'labels': labels,
+            }
+        return get_chart(options, partial(draw_trend_chart, index,
+            list(cols.values()), ds, list(cols_y2.values()), ds2, labels))
+
+    @classmethod
+    def clean(cls):
+        TrendChartData = Pool().get('lims.trend.chart.data')
+        to_delete = cls.search([('active', '=', False)])
+        cls.delete(to_delete)
+        to_delete = TrendChartData.search([])
+        TrendChartData.delete(to_delete)
+
+
+def draw_trend_chart(index, cols, ds, cols_y2, ds2, labels):
+    df = pd.DataFrame(ds, index=index)
+    df = df.reindex(cols, axis=1)
+    try:
+        df_interpolated = df.interpolate()
+    except TypeError:
+        df_interpolated = df
+    if ds2:
+        df2 = pd.DataFrame(ds2, index=index)
+        df2 = df2.reindex(cols_y2, axis=1)
         try:
-            df_interpolated = df.interpolate()
+            df2_interpolated = df2.interpolate()
         except TypeError:
-            df_interpolated = df
+            df2_interpolated = df2
+
+    def set_legends(ax):
+        loc, i = ['upper left', 'upper right'], 0
+        for axis in ax.figure.axes:
+            handles, legend_labels = [], []
+            for h, l in zip(*axis.get_legend_handles_labels()):
+                if l in legend_labels:
+                    continue
+                handles.append(h)
+                legend_labels.append(l)
+            axis.legend(handles, legend_labels, loc=loc[i], fontsize=14)
+            i += 1
+
+    output = BytesIO()
+    try:
+        ax = df_interpolated.plot(kind='line',
+            rot=45, fontsize=14, figsize=(10, 7.5),
+            linestyle='-', marker=None, legend=None)
+        ax = df.plot(kind='line',
+            rot=45, fontsize=14, figsize=(10, 7.5),
+            linestyle='', marker='o', color='black',
+            legend=None, ax=ax)
+        ax.set_xlabel(labels['x'])
+        if labels['y']:
+            ax.set_ylabel(labels['y'])
         if ds2:
-            df2 = pd.DataFrame(ds2, index=index)
-            df2 = df2.reindex(cols_y2.values(), axis=1)
             try:
-                df2_interpolated = df2.interpolate()
+                ax = df2_interpolated.plot(kind='line',
+                    rot=45, fontsize=14, figsize=(10, 7.5),
+                    linestyle='-', marker=None, legend=None,
+                    secondary_y=True, ax=ax)
+                ax = df2.plot(kind='line',
+                    rot=45, fontsize=14, figsize=(10, 7.5),
+                    linestyle='', marker='o', color='black',
+                    legend=None, secondary_y=True, ax=ax)
+                if labels['y2']:
+                    ax.set_ylabel(labels['y2'])
             except TypeError:
-                df2_interpolated = df2
-
-        output = BytesIO()
-        try:
-            with plt.rc_context(rc={'figure.max_open_warning': 0}):
-                ax = df_interpolated.plot(kind='line',
+                pass
+        ax.xaxis.label.set_fontsize(14)
+        ax.yaxis.label.set_fontsize(14)
+        set_legends(ax)
+        ax.get_figure().savefig(output, bbox_inches='tight', dpi=300)
+        return output.getvalue()
+
+    except (TypeError, ModuleNotFoundError):
+        if ds2:
+            try:
+                ax = df2_interpolated.plot(kind='line',
                     rot=45, fontsize=14, figsize=(10, 7.5),
-                    linestyle='-', marker=None, legend=None)
-                ax = df.plot(kind='line',
+                    linestyle='-', marker=None, legend=None,
+                    secondary_y=True)
+                ax = df2.plot(kind='line',
                     rot=45, fontsize=14, figsize=(10, 7.5),
                     linestyle='', marker='o', color='black',
-                    legend=None, ax=ax)
-                ax.set_xlabel(self.x_axis_string)
-                if self.uom:
-                    ax.set_ylabel(self.uom.symbol)
-                if ds2:
-                    try:
-                        ax = df2_interpolated.plot(kind='line',
-                            rot=45, fontsize=14, figsize=(10, 7.5),
-                            linestyle='-', marker=None, legend=None,
-                            secondary_y=True, ax=ax)
-                        ax = df2.plot(kind='line',
-                            rot=45, fontsize=14, figsize=(10, 7.5),
-                            linestyle='', marker='o', color='black',
-                            legend=None, secondary_y=True, ax=ax)
-                        if self.uom_y2:
-                            ax.set_ylabel(self.uom_y2.symbol)
-                    except TypeError:
-                        pass
+                    legend=None, secondary_y=True, ax=ax)
+                ax.set_xlabel(labels['x'])
+                if labels['y2']:
+                    ax.set_ylabel(labels['y2'])
                 ax.xaxis.label.set_fontsize(14)
                 ax.yaxis.label.set_fontsize(14)
-
-                loc, i = ['upper left', 'upper right'], 0
-                for axis in ax.figure.axes:
-                    handles, labels = [], []
-                    for h, l in zip(*axis.get_legend_handles_labels()):
-                        if l in labels:
-                            continue
-                        handles.append(h)
-                        labels.append(l)
-                    axis.legend(handles, labels, loc=loc[i], fontsize=14)
-                    i += 1
-
-                ax.get_figure().savefig(output, bbox_inches='tight', dpi=300)
-                plt.close('all')
-                image = output.getvalue()
-                output.close()
-            # release memory
-            del ax, df, df_interpolated
-            if ds2:
-                del df2, df2_interpolated
-            gc.collect()
-            return image
-
-        except (TypeError, ModuleNotFoundError):
-            if ds2:
-                try:
-                    ax = df2_interpolated.plot(kind='line',
-                        rot=45, fontsize=14, figsize=(10, 7.5),
-                        linestyle='-', marker=None, legend=None,
-                        secondary_y=True)
-                    ax = df2.plot(kind='line',
-                        rot=45, fontsize=14, figsize=(10, 7.5),
-                        linestyle='', marker='o', color='black',
-                        legend=None, secondary_y=True, ax=ax)
-                    ax.set_xlabel(self.x_axis_string)
-                    if self.uom_y2:
-                        ax.set_ylabel(self.uom_y2.symbol)
-                    ax.xaxis.label.set_fontsize(14)
-                    ax.yaxis.label.set_fontsize(14)
-
-                    loc, i = ['upper left', 'upper right'], 0
-                    for axis in ax.figure.axes:
-                        handles, labels = [], []
-                        for h, l in zip(*axis.get_legend_handles_labels()):
-                            if l in labels:
-                                continue
-                            handles.append(h)
-                            labels.append(l)
-                        axis.legend(handles, labels, loc=loc[i], fontsize=14)
-                        i += 1
-
-                    ax.get_figure().savefig(output, bbox_inches='tight',
-                        dpi=300)
-                    plt.close('all')
-                    image = output.getvalue()
-                    output.close()
-                    # release memory
-                    del ax, df, df_interpolated
-                    if ds2:
-                        del df2, df2_interpolated
-                    gc.collect()
-                    return image
-
-                except (TypeError, ModuleNotFoundError):
-                    pass
-            # release memory
-            del df, df_interpolated
-            if ds2:
-                del df2, df2_interpolated
-            gc.collect()
-            return output.getvalue()
-
-    @classmethod
-    def clean(cls):
-        TrendChartData = Pool().get('lims.trend.chart.data')
-        to_delete = cls.search([('active', '=', False)])
-        cls.delete(to_delete)
-        to_delete = TrendChartData.search([])
-        TrendChartData.delete(to_delete)
+                set_legends(ax)
+                output = BytesIO()
+                ax.get_figure().savefig(output, bbox_inches='tight',
+                    dpi=300)
+                return output.getvalue()
+
+            except (TypeError, ModuleNotFoundError):
+                pass
+        return output.getvalue()
 
 
 class TrendChartAnalysis(ModelSQL, ModelView):
@@ -17,13 +17,15 @@ from trytond.wizard import Wizard, StateTransition, StateView, StateReport, \
 from trytond.pool import Pool
 from trytond.pyson import Eval, Equal, Bool, Not, If
 from trytond.transaction import Transaction
-from trytond.tools import get_smtp_server
+from trytond.tools import grouped_slice
 from trytond.config import config as tconfig
 from trytond.report import Report
 from trytond.rpc import RPC
 from trytond.exceptions import UserError, UserWarning
 from trytond.i18n import gettext, lazy_gettext
 
+from .mail import SMTPTransport, send_mail
+
 logger = logging.getLogger(__name__)
 
 
@@ -586,7 +588,7 @@ class Entry(Workflow, ModelSQL, ModelView):
         session_id, _, _ = ForwardAcknowledgmentOfReceipt.create()
         acknowledgment_forward = ForwardAcknowledgmentOfReceipt(session_id)
         with Transaction().set_context(active_ids=[entry.id
-                for entry in entries]):
+                for entry in entries]), SMTPTransport():
             data = acknowledgment_forward.transition_start()
             if data:
                 logger.info('data: %s' % data)  # debug
@@ -716,25 +718,36 @@ class Entry(Workflow, ModelSQL, ModelView):
 
     @classmethod
     def update_entries_state(cls, entry_ids):
+        cursor = Transaction().connection.cursor()
+        Sample = Pool().get('lims.sample')
+
         entries_states = ['ongoing', 'finished']
         entries_exclude = cls._get_update_entries_state_exclude()
 
-        entries_to_save = []
         entries = cls.search([
             ('id', 'in', list(set(entry_ids) - set(entries_exclude))),
             ('state', 'in', entries_states),
             ])
+        if not entries:
+            return
+
+        ongoing_ids = set()
+        for sub_entries in grouped_slice(entries):
+            cursor.execute('SELECT DISTINCT(entry) '
+                'FROM "' + Sample._table + '" '
+                'WHERE entry IN %s '
+                    'AND state IS DISTINCT FROM \'report_released\'',
+                (tuple(e.id for e in sub_entries),))
+            ongoing_ids.update(x[0] for x in cursor.fetchall())
+
+        entries_to_write = {'ongoing': [], 'finished': []}
         for entry in entries:
-            state = 'finished'
-            for sample in entry.samples:
-                if sample.state != 'report_released':
-                    state = 'ongoing'
-                    break
+            state = 'ongoing' if entry.id in ongoing_ids else 'finished'
             if entry.state != state:
-                entry.state = state
-                entries_to_save.append(entry)
-        if entries_to_save:
-            cls.save(entries_to_save)
+                entries_to_write[state].append(entry)
+        for state, to_write in entries_to_write.items():
+            if to_write:
+                cls.write(to_write, {'state': state})
 
     @classmethod
     def _get_update_entries_state_exclude(cls):
@@ -846,17 +859,12 @@ class Entry(Workflow, ModelSQL, ModelView):
     def send_msg(self, from_addr, to_addrs, msg):
         to_addrs = list(set(to_addrs))
         success = False
-        server = None
         try:
-            server = get_smtp_server()
-            server.sendmail(from_addr, to_addrs, msg.as_string())
-            server.quit()
+            send_mail(from_addr, to_addrs, msg.as_string())
             success = True
         except Exception as e:
             logger.error('Unable to deliver mail for entry %s' % (self.number))
             logger.error(str(e))
-            if server is not None:
-                server.quit()
         return success
 
     def _confirm(self):
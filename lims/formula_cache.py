@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# This file is part of lims module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import threading
+import formulas
+
+from trytond.cache import LRUDict
+from trytond.config import config
+
+__all__ = ['compile_formula', 'formula_cache_info', 'clear_formula_cache']
+
+
+class FormulaCache(object):
+    '''
+    Process-wide cache of compiled formulas functions.
+
+    Compiled functions are keyed by the normalised formula text and live
+    across transactions. Schedula dispatchers keep the last solution on
+    the instance, so each thread holds its own bounded LRU of compiled
+    functions while the hit/miss counters are shared by the process.
+    '''
+
+    def __init__(self, size_limit):
+        self.size_limit = size_limit
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def _cache(self):
+        cache = getattr(self._local, 'cache', None)
+        if cache is None:
+            cache = self._local.cache = LRUDict(self.size_limit)
+        return cache
+
+    @staticmethod
+    def normalise(formula):
+        formula = (formula or '').strip()
+        if not formula.startswith('='):
+            formula = '=' + formula
+        return formula
+
+    @staticmethod
+    def compile(formula):
+        return formulas.Parser().ast(formula)[1].compile()
+
+    def get(self, formula):
+        key = self.normalise(formula)
+        cache = self._cache
+        ast = cache.get(key)
+        if ast is not None:
+            with self._lock:
+                self.hits += 1
+            return ast
+        ast = self.compile(key)
+        cache[key] = ast
+        with self._lock:
+            self.misses += 1
+        return ast
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+                'size_limit': self.size_limit,
+                }
+
+    def clear(self):
+        self._cache.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+_formula_cache = FormulaCache(
+    config.getint('lims', 'formula_cache_size', default=1024))
+
+
+def compile_formula(formula):
+    'Return the compiled formulas function for formula, cached'
+    return _formula_cache.get(formula)
+
+
+def formula_cache_info():
+    'Return the hit/miss counters and size of the formula cache'
+    return _formula_cache.info()
+
+
+def clear_formula_cache():
+    _formula_cache.clear()
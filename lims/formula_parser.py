@@ -6,25 +6,53 @@ import re
 from math import log10 as math_log10
 
 from trytond.model import Model
+from trytond.config import config
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
+from .formula_cache import FormulaCache
+
+
+def _clean_variable(variable):
+    return variable.replace(
+        '{', '').replace(
+        '}', '').replace(
+        '.', '')
+
+
+def compile_expression(string):
+    '''
+    Return the compiled form of the formula string: a function that takes
+    the variables mapping and returns the value. Compiled formulas are
+    cached by their text.
+    '''
+    return _expressions.get(string)
+
+
+class ExpressionCache(FormulaCache):
+    'Process-wide cache of the compiled FormulaParser expressions'
+
+    @staticmethod
+    def normalise(string):
+        return string
+
+    @staticmethod
+    def compile(string):
+        return ExpressionCompiler(string).compile()
+
+
+_expressions = ExpressionCache(
+    config.getint('lims', 'formula_parser_cache_size', default=1024))
 
 
 class FormulaParser(Model):
     'Formula Parser'
-    __slots__ = ('_string', '_index', '_vars')
+    __slots__ = ('_string', '_vars')
 
     def __init__(self, string, vars={}, subcall=False, id=None, **kwargs):
-        def _clean_variable(variable):
-            return variable.replace(
-                '{', '').replace(
-                '}', '').replace(
-                '.', '')
         self._string = string
         for var in re.findall(r'\{.*?\}', string):
             clean_var = _clean_variable(var)
             self._string = self._string.replace(var, clean_var)
-        self._index = 0
         self._vars = {
             'pi': 3.141592653589793,
             'e': 2.718281828459045,
@@ -38,12 +66,27 @@ class FormulaParser(Model):
         super().__init__(id, **kwargs)
 
     def getValue(self):
-        value = self.parseExpression()
+        return compile_expression(self._string)(self._vars)
+
+
+class ExpressionCompiler(object):
+    '''
+    Compile a formula into nested functions evaluated against a variables
+    mapping, following the grammar of the previous string evaluator
+    '''
+    __slots__ = ('_string', '_index')
+
+    def __init__(self, string):
+        self._string = string
+        self._index = 0
+
+    def compile(self):
+        expression = self.parseExpression()
         self.skipWhitespace()
         if self.hasNext():
             raise UserError(gettext('lims.msg_unexpected_character',
                 character=self.peek(), index=str(self._index)))
-        return value
+        return expression
 
     def peek(self):
         return self._string[self._index:self._index + 1]
@@ -59,58 +102,51 @@ class FormulaParser(Model):
                 return
 
     def parseExpression(self):
-        return self.parseFunction()
-
-    def parseFunction(self):
-        string = self._string
-        # log10
-        for funct in re.findall(r'LOG10\(.*?\)', string):
-            formula = funct[6:-1]
-            variables = self._vars
-            parser = FormulaParser(formula, vars=variables, subcall=True)
-            value = parser.getValue()
-            value = str(math_log10(float(value)))
-            self._string = self._string.replace(funct, value)
         return self.parseAddition()
 
     def parseAddition(self):
-        values = [self.parseMultiplication()]
+        terms = [self.parseMultiplication()]
         while True:
             self.skipWhitespace()
             char = self.peek()
             if char == '+':
                 self._index += 1
-                values.append(self.parseMultiplication())
+                terms.append(self.parseMultiplication())
             elif char == '-':
                 self._index += 1
-                values.append(-1 * self.parseMultiplication())
+                term = self.parseMultiplication()
+                terms.append(lambda v, term=term: -1 * term(v))
             else:
                 break
-        return sum(values)
+        return lambda v: sum([term(v) for term in terms])
 
     def parseMultiplication(self):
-        values = [self.parsePower()]
+        factors = [(False, self.parsePower())]
         while True:
             self.skipWhitespace()
             char = self.peek()
             if char == '*':
                 self._index += 1
-                values.append(self.parsePower())
+                factors.append((False, self.parsePower()))
             elif char == '/':
-                # div_index = self._index
                 self._index += 1
-                denominator = self.parsePower()
-                if denominator == 0:
-                    # raise UserError(gettext(
-                    #     'lims.msg_division_zero', index=str(div_index)))
-                    return 0.0
-                values.append(1.0 / denominator)
+                factors.append((True, self.parsePower()))
             else:
                 break
-        value = 1.0
-        for factor in values:
-            value *= factor
-        return value
+        if len(factors) == 1:
+            return factors[0][1]
+
+        def multiplication(v):
+            value = 1.0
+            for division, factor in factors:
+                factor = factor(v)
+                if division:
+                    if factor == 0:
+                        return 0.0
+                    factor = 1.0 / factor
+                value *= factor
+            return value
+        return multiplication
 
     def parsePower(self):
         values = [self.parseParenthesis()]
@@ -122,10 +158,15 @@ class FormulaParser(Model):
                 values.append(self.parseParenthesis())
             else:
                 break
-        value = values[0]
-        for exponent in values[1:]:
-            value **= exponent
-        return value
+        if len(values) == 1:
+            return values[0]
+
+        def power(v):
+            value = values[0](v)
+            for exponent in values[1:]:
+                value **= exponent(v)
+            return value
+        return power
 
     def parseParenthesis(self):
         self.skipWhitespace()
@@ -147,7 +188,8 @@ class FormulaParser(Model):
         char = self.peek()
         if char == '-':
             self._index += 1
-            return -1 * self.parseParenthesis()
+            value = self.parseParenthesis()
+            return lambda v: -1 * value(v)
         else:
             return self.parseValue()
 
@@ -161,30 +203,49 @@ class FormulaParser(Model):
 
     def parseVariable(self):
         self.skipWhitespace()
-        var = ''
+        start = self._index
         while self.hasNext():
             char = self.peek()
             if char.lower() in '_abcdefghijklmnopqrstuvwxyz0123456789':
-                var += char
                 self._index += 1
             else:
                 break
-
-        value = self._vars.get(var, None)
-        if value is None:
+        var = self._string[start:self._index]
+        if not var:
+            # Fail here, before any error further in the formula, as the
+            # string evaluator did
             raise UserError(gettext(
                 'lims.msg_unrecognized_variable', variable=var))
-        if value == '':
-            return float(0)
-        try:
-            value = float(value)
-        except (ValueError):
-            return float(0)
-        return value
+        if var == 'LOG10' and self.peek() == '(':
+            return self.parseLog10()
+
+        def variable(v):
+            value = v.get(var, None)
+            if value is None:
+                raise UserError(gettext(
+                    'lims.msg_unrecognized_variable', variable=var))
+            if value == '':
+                return float(0)
+            try:
+                value = float(value)
+            except (ValueError):
+                return float(0)
+            return value
+        return variable
+
+    def parseLog10(self):
+        self._index += 1
+        value = self.parseExpression()
+        self.skipWhitespace()
+        if self.peek() != ')':
+            raise UserError(gettext(
+                'lims.msg_closing_parenthesis', index=str(self._index)))
+        self._index += 1
+        return lambda v: math_log10(float(value(v)))
 
     def parseNumber(self):
         self.skipWhitespace()
-        strValue = ''
+        start = self._index
         decimal_found = False
         char = ''
 
@@ -195,18 +256,17 @@ class FormulaParser(Model):
                     raise UserError(gettext(
                         'lims.msg_extra_period', index=str(self._index)))
                 decimal_found = True
-                strValue += '.'
-            elif char in '0123456789':
-                strValue += char
-            else:
+            elif char not in '0123456789':
                 break
             self._index += 1
 
-        if len(strValue) == 0:
+        str_value = self._string[start:self._index]
+        if len(str_value) == 0:
             if char == '':
                 raise UserError(gettext('lims.msg_unexpected_end'))
             else:
                 raise UserError(gettext('lims.msg_number_expected',
                     index=str(self._index), character=char))
 
-        return float(strValue)
+        value = float(str_value)
+        return lambda v: value
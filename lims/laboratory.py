@@ -3,6 +3,7 @@
 # The COPYRIGHT file at the top level of this repository contains
 # the full copyright notices and license terms.
 from datetime import datetime
+from functools import lru_cache
 import operator
 from sql import Cast
 
@@ -17,6 +18,56 @@ from trytond.i18n import gettext
 from trytond.rpc import RPC
 from .formula_parser import FormulaParser
 
+CONDITION_OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'lt': operator.lt,
+    'le': operator.le,
+    'in': lambda v, l: v in l,
+    'not_in': lambda v, l: v not in l,
+    }
+
+
+@lru_cache(maxsize=1024)
+def compile_rule_condition(field, condition, value):
+    '''
+    Return a function that evaluates the rule condition on a line. The
+    field path is split and the operands are parsed once. Values are
+    compared as numbers when both sides can be converted, as strings
+    otherwise.
+    '''
+    path = tuple(field.split('.'))
+    operator_func = CONDITION_OPERATORS[condition]
+    if condition in ('in', 'not_in'):
+        str_operand = [str(x).strip() for x in value.split(',')]
+        try:
+            float_operand = [float(x) for x in str_operand]
+        except ValueError:
+            float_operand = None
+    else:
+        str_operand = str(value)
+        try:
+            float_operand = float(value)
+        except ValueError:
+            float_operand = None
+
+    def evaluate(line):
+        value = line
+        try:
+            for name in path:
+                value = getattr(value, name)
+        except AttributeError:
+            return False
+        if float_operand is not None:
+            try:
+                return operator_func(float(value), float_operand)
+            except (TypeError, ValueError):
+                pass
+        return (value and operator_func(str(value), str_operand) or False)
+    return evaluate
+
 
 class Laboratory(ModelSQL, ModelView):
     'Laboratory'
@@ -859,6 +910,19 @@ class NotebookRule(ModelSQL, ModelView):
             methods = [m.id for m in self.target_analysis.methods]
         return methods
 
+    @classmethod
+    def get_rules_index(cls, analysis_ids):
+        '''
+        Return the rules triggered by each analysis, read with one search
+        '''
+        index = {}
+        analysis_ids = list(set(analysis_ids))
+        if not analysis_ids:
+            return index
+        for rule in cls.search([('analysis', 'in', analysis_ids)]):
+            index.setdefault(rule.analysis.id, []).append(rule)
+        return index
+
     def eval_condition(self, line):
         for condition in self.conditions:
             if not condition.eval_condition(line):
@@ -1082,43 +1146,8 @@ class NotebookRuleCondition(ModelSQL, ModelView):
         "(e.g.: AB, CD, 12, 34)"))
 
     def eval_condition(self, line):
-        path = self.field.split('.')
-        field = path.pop(0)
-        try:
-            value = getattr(line, field)
-            while path:
-                field = path.pop(0)
-                value = getattr(value, field)
-        except AttributeError:
-            return False
-
-        operator_func = {
-            'eq': operator.eq,
-            'ne': operator.ne,
-            'gt': operator.gt,
-            'ge': operator.ge,
-            'lt': operator.lt,
-            'le': operator.le,
-            'in': lambda v, l: v in l,
-            'not_in': lambda v, l: v not in l,
-            }
-
-        if self.condition in ('in', 'not_in'):
-            values = [str(x).strip() for x in self.value.split(',')]
-            try:
-                result = operator_func[self.condition](
-                    float(value), [float(x) for x in values])
-            except (TypeError, ValueError):
-                result = (value and operator_func[self.condition](
-                    str(value), [str(x) for x in values]) or False)
-        else:
-            try:
-                result = operator_func[self.condition](
-                    float(value), float(self.value))
-            except (TypeError, ValueError):
-                result = (value and operator_func[self.condition](
-                    str(value), str(self.value)) or False)
-        return result
+        return compile_rule_condition(
+            self.field, self.condition, self.value)(line)
 
     @classmethod
     def validate(cls, conditions):
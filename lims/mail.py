@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# This file is part of lims module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import logging
+import smtplib
+import threading
+from collections import deque
+
+from trytond.config import config
+from trytond.tools import get_smtp_server
+
+__all__ = ['SMTPTransport', 'send_mail']
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGES = config.getint('lims', 'smtp_max_messages', default=100)
+RETRIES = config.getint('lims', 'smtp_retries', default=2)
+
+_local = threading.local()
+
+
+class SMTPTransport(object):
+    '''
+    SMTP transport that keeps one authenticated connection open for many
+    messages.
+
+    The connection is renewed after `max_messages` messages and whenever
+    the server drops it. A message that fails with a connection error or
+    a temporary (4xx) reply is kept in the retry queue and sent again on a
+    new connection up to `retries` times. Used as a context manager, the
+    transport becomes the one used by send_mail in the current thread
+    until it is closed.
+    '''
+
+    def __init__(self, max_messages=None, retries=None,
+            connect=get_smtp_server):
+        self.max_messages = max_messages or MAX_MESSAGES
+        self.retries = RETRIES if retries is None else retries
+        self.connect = connect
+        self.server = None
+        self.sent = 0
+        self.queue = deque()
+
+    def __enter__(self):
+        if not hasattr(_local, 'transports'):
+            _local.transports = []
+        _local.transports.append(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        _local.transports.remove(self)
+        self.close()
+
+    def _get_server(self):
+        if self.server is not None and self.sent >= self.max_messages:
+            self.close()
+        if self.server is None:
+            self.server = self.connect()
+            self.sent = 0
+        return self.server
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+    def send(self, from_addr, to_addrs, msg):
+        '''
+        Send msg (a string) and return True if it was delivered
+        '''
+        self.queue.append((from_addr, to_addrs, msg, self.retries))
+        return self.flush()
+
+    def flush(self):
+        '''
+        Send the queued messages and return True if all were delivered
+        '''
+        success = True
+        while self.queue:
+            from_addr, to_addrs, msg, retries = self.queue.popleft()
+            try:
+                server = self._get_server()
+                server.sendmail(from_addr, to_addrs, msg)
+                self.sent += 1
+            except OSError as e:
+                if not self._is_temporary(e):
+                    logger.error('Unable to deliver mail: %s', e)
+                    success = False
+                    continue
+                # The connection may be broken: reconnect for the next try
+                logger.warning('Unable to deliver mail: %s', e)
+                if self.server is not None:
+                    self.server.close()
+                    self.server = None
+                if retries > 0:
+                    self.queue.append((from_addr, to_addrs, msg, retries - 1))
+                else:
+                    success = False
+        return success
+
+    @staticmethod
+    def _is_temporary(error):
+        '''
+        Return True if the delivery may succeed on a new try after error
+        '''
+        if isinstance(error, smtplib.SMTPResponseException):
+            # 4xx replies are temporary, 5xx replies are permanent
+            return error.smtp_code < 500
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        # Other SMTP errors are permanent, socket errors are not
+        return not isinstance(error, smtplib.SMTPException)
+
+
+def send_mail(from_addr, to_addrs, msg):
+    '''
+    Send msg with the transport opened in the current thread if any, or
+    with a connection of its own otherwise. Exceptions are propagated
+    when the message could not be delivered.
+    '''
+    transports = getattr(_local, 'transports', None)
+    if transports:
+        transport = transports[-1]
+        if not transport.send(from_addr, to_addrs, msg):
+            raise smtplib.SMTPException('Unable to deliver mail')
+        return
+    transport = SMTPTransport(retries=0)
+    try:
+        if not transport.send(from_addr, to_addrs, msg):
+            raise smtplib.SMTPException('Unable to deliver mail')
+    finally:
+        transport.close()
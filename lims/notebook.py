@@ -21,9 +21,11 @@ from trytond.pyson import PYSONEncoder, Eval, Bool, Not, Or
 from trytond.transaction import Transaction
 from trytond.report import Report
 from trytond.exceptions import UserError
+from trytond.tools import grouped_slice
 from trytond.i18n import gettext
-from .configuration import get_print_date
+from .configuration import get_print_date, clean_transaction_cache
 from .formula_parser import FormulaParser
+from .formula_cache import compile_formula
 
 ALLOWED_RESULT_TYPES = (str, int, float, Decimal, time, date, timedelta,
     type(None))
@@ -1207,50 +1209,81 @@ class NotebookLine(ModelSQL, ModelView):
 
     @staticmethod
     def update_detail_report(lines):
-        cursor = Transaction().connection.cursor()
+        """ Copy the report flag of the last notebook line of each
+            analysis detail to the detail
+        """
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
         pool = Pool()
         EntryDetailAnalysis = pool.get('lims.entry.detail.analysis')
         NotebookLine = pool.get('lims.notebook.line')
 
-        to_save = []
-        details_ids = list(set(nl.analysis_detail.id for nl in lines))
-        with Transaction().set_context(_check_access=False):
-            analysis_details = EntryDetailAnalysis.browse(details_ids)
-        for d in analysis_details:
-            cursor.execute('SELECT report '
-                'FROM "' + NotebookLine._table + '" '
-                'WHERE analysis_detail = %s '
-                'ORDER BY id DESC LIMIT 1',
-                (d.id,))
-            value = cursor.fetchone()
-            d.report = value[0] if value else False
-            to_save.append(d)
-        EntryDetailAnalysis.save(to_save)
+        details_ids = set()
+        for sub_ids in grouped_slice([nl.id for nl in lines]):
+            cursor.execute('UPDATE "' + EntryDetailAnalysis._table + '" d '
+                'SET report = l.report, '
+                    'write_date = CURRENT_TIMESTAMP, '
+                    'write_uid = %s '
+                'FROM (SELECT DISTINCT ON (analysis_detail) '
+                        'analysis_detail, COALESCE(report, FALSE) AS report '
+                    'FROM "' + NotebookLine._table + '" '
+                    'WHERE analysis_detail IN ('
+                        'SELECT analysis_detail '
+                        'FROM "' + NotebookLine._table + '" '
+                        'WHERE id IN %s) '
+                    'ORDER BY analysis_detail, id DESC) l '
+                'WHERE d.id = l.analysis_detail '
+                    'AND d.report IS DISTINCT FROM l.report '
+                'RETURNING d.id',
+                (transaction.user, tuple(sub_ids)))
+            details_ids.update(x[0] for x in cursor.fetchall())
+        if not details_ids:
+            return
+        clean_transaction_cache(EntryDetailAnalysis, details_ids)
 
     @classmethod
     def update_referrals_state(cls, lines):
-        Referral = Pool().get('lims.referral')
-
-        referral_ids = [l.analysis_detail.referral.id
-            for l in lines if l.analysis_detail.referral]
-        if not referral_ids:
-            return
+        """ Set as done the sent referrals of the lines that have no
+            notebook line pending of result
+        """
+        cursor = Transaction().connection.cursor()
+        pool = Pool()
+        Referral = pool.get('lims.referral')
+        EntryDetailAnalysis = pool.get('lims.entry.detail.analysis')
+        ResultModifier = pool.get('lims.result_modifier')
 
-        referrals = Referral.search([
-            ('state', '=', 'sent'),
-            ('id', 'in', referral_ids),
-            ])
-        for referral in referrals:
-            if cls.search_count([
-                    ('analysis_detail.referral', '=', referral.id),
-                    ('annulled', '=', False),
-                    ('result', 'in', [None, '']),
-                    ('literal_result', 'in', [None, '']),
-                    ['OR', ('result_modifier', '=', None),
-                        ('result_modifier.code', 'not in',
-                        ['d', 'nd', 'pos', 'neg', 'ni', 'abs', 'pre', 'na'])],
-                    ]) == 0:
-                Referral.write([referral], {'state': 'done'})
+        result_modifiers = ('d', 'nd', 'pos', 'neg', 'ni', 'abs', 'pre', 'na')
+        referral_ids = []
+        for sub_ids in grouped_slice([nl.id for nl in lines]):
+            cursor.execute('SELECT d.referral '
+                'FROM "' + EntryDetailAnalysis._table + '" d '
+                    'INNER JOIN "' + Referral._table + '" r '
+                    'ON r.id = d.referral '
+                    'INNER JOIN "' + cls._table + '" nl '
+                    'ON nl.analysis_detail = d.id '
+                    'LEFT JOIN "' + ResultModifier._table + '" rm '
+                    'ON rm.id = nl.result_modifier '
+                'WHERE r.state = %s '
+                    'AND d.referral IN ('
+                        'SELECT d2.referral '
+                        'FROM "' + cls._table + '" nl2 '
+                            'INNER JOIN "' +
+                            EntryDetailAnalysis._table + '" d2 '
+                            'ON d2.id = nl2.analysis_detail '
+                        'WHERE nl2.id IN %s) '
+                'GROUP BY d.referral '
+                'HAVING COUNT(*) FILTER (WHERE nl.annulled = FALSE '
+                    'AND COALESCE(nl.result, \'\') = \'\' '
+                    'AND COALESCE(nl.literal_result, \'\') = \'\' '
+                    'AND (nl.result_modifier IS NULL '
+                        'OR rm.code NOT IN %s)) = 0',
+                ('sent', tuple(sub_ids), result_modifiers))
+            referral_ids.extend(x[0] for x in cursor.fetchall())
+
+        if referral_ids:
+            Referral.write(Referral.browse(list(set(referral_ids))), {
+                'state': 'done',
+                })
 
     @classmethod
     def validate(cls, notebook_lines):
@@ -2953,11 +2986,10 @@ class CalculateInternalRelations(Wizard):
         if not formula.startswith('='):
             formula = '=' + formula
 
-        parser = formulas.Parser()
         with Transaction().set_context(
                 lims_analysis_notebook=notebook_line.notebook.id):
             try:
-                ast = parser.ast(formula)[1].compile()
+                ast = compile_formula(formula)
             except Exception as e:
                 return None
 
@@ -3363,12 +3395,11 @@ class CalculateInternalRelationsUsingReps(Wizard):
         if not formula.startswith('='):
             formula = '=' + formula
 
-        parser = formulas.Parser()
         with Transaction().set_context(
                 lims_analysis_notebook=notebook_line.notebook.id,
                 lims_analysis_variables=variables):
             try:
-                ast = parser.ast(formula)[1].compile()
+                ast = compile_formula(formula)
             except Exception as e:
                 return None
 
@@ -7442,11 +7473,10 @@ class NotebookEvaluateRules(Wizard):
         pool = Pool()
         NotebookRule = pool.get('lims.rule')
 
+        rules_index = NotebookRule.get_rules_index(
+            [line.analysis.id for line in notebook_lines])
         for line in notebook_lines:
-            rules = NotebookRule.search([
-                ('analysis', '=', line.analysis),
-                ])
-            for rule in rules:
+            for rule in rules_index.get(line.analysis.id, []):
                 if rule.eval_condition(line):
                     rule.exec_action(line)
 
@@ -0,0 +1,230 @@
+# This file is part of lims module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import heapq
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from trytond.config import config
+from trytond.model import ModelView, ModelSQL, fields, dualmethod
+from trytond.pool import Pool, PoolMeta
+from trytond.transaction import Transaction
+
+logger = logging.getLogger(__name__)
+
+ENABLED = config.getboolean('lims', 'perf_instrumentation', default=False)
+# Operations faster than this (in seconds) are not recorded
+MIN_DURATION = config.getfloat('lims', 'perf_min_duration', default=0.5)
+SLOWEST_STATEMENTS = config.getint('lims', 'perf_slowest_statements',
+    default=5)
+# Only the operations of these models are instrumented
+MODEL_PREFIX = 'lims'
+
+_local = threading.local()
+_cursor_classes = {}
+
+
+class _Recorder(object):
+
+    def __init__(self, kind, operation):
+        self.kind = kind
+        self.operation = operation
+        self.count = 0
+        self.sql_duration = 0.
+        self.slowest = []
+
+    def add(self, query, duration):
+        self.count += 1
+        self.sql_duration += duration
+        item = (duration, self.count, query)
+        if len(self.slowest) < SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, item)
+        elif SLOWEST_STATEMENTS:
+            heapq.heappushpop(self.slowest, item)
+
+    def get_slowest(self):
+        return '\n\n'.join('%.4fs: %s' % (d, q)
+            for d, _, q in sorted(self.slowest, reverse=True))
+
+
+def _get_cursor_class(base):
+    'Return a subclass of the cursor base that times its statements'
+    if base not in _cursor_classes:
+
+        def timed(method):
+            def wrapper(self, query, *args, **kwargs):
+                recorder = getattr(_local, 'recorder', None)
+                if not recorder:
+                    return method(self, query, *args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return method(self, query, *args, **kwargs)
+                finally:
+                    if isinstance(query, bytes):
+                        query = query.decode('utf-8', 'replace')
+                    recorder.add(str(query)[:1000],
+                        time.perf_counter() - start)
+            return wrapper
+
+        _cursor_classes[base] = type('Perf' + base.__name__, (base,), {
+                'execute': timed(base.execute),
+                'executemany': timed(base.executemany),
+                })
+    return _cursor_classes[base]
+
+
+@contextmanager
+def instrument(kind, operation):
+    '''
+    Record the SQL statements and the duration of the code run inside the
+    context as a performance sample of the operation.
+
+    Nested operations are accounted to the outermost one. Statements are
+    only timed on connections with a cursor factory (PostgreSQL).
+    '''
+    if not ENABLED or getattr(_local, 'recorder', None):
+        yield
+        return
+
+    connection = Transaction().connection
+    factory = getattr(connection, 'cursor_factory', None)
+    if factory:
+        connection.cursor_factory = _get_cursor_class(factory)
+    recorder = _local.recorder = _Recorder(kind, operation)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        _local.recorder = None
+        if factory:
+            connection.cursor_factory = factory
+        if duration >= MIN_DURATION:
+            _store(recorder, duration)
+
+
+def instrumented(kind, get_operation):
+    '''
+    Decorate a function to run it in an instrument context. The operation
+    name is returned by get_operation called with the same arguments, or
+    None to not instrument the call.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            operation = get_operation(*args, **kwargs)
+            if not operation:
+                return func(*args, **kwargs)
+            with instrument(kind, operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _store(recorder, duration):
+    logger.info('%s %s: %.3fs, %s statements in %.3fs',
+        recorder.kind, recorder.operation, duration, recorder.count,
+        recorder.sql_duration)
+    try:
+        with Transaction().new_transaction() as transaction, \
+                transaction.set_context(_check_access=False):
+            PerfSample = Pool().get('lims.perf.sample')
+            PerfSample.create([{
+                'kind': recorder.kind,
+                'operation': recorder.operation[:200],
+                'duration': duration,
+                'sql_count': recorder.count,
+                'sql_duration': recorder.sql_duration,
+                'slowest_statements': recorder.get_slowest(),
+                }])
+    except Exception:
+        logger.warning('Unable to store the performance sample of %s',
+            recorder.operation, exc_info=True)
+
+
+def _is_lims(name):
+    return name.split('.', 1)[0].startswith(MODEL_PREFIX)
+
+
+def _wizard_operation(cls, session_id, data, state_name):
+    if _is_lims(cls.__name__):
+        return '%s:%s' % (cls.__name__, state_name)
+
+
+def _report_operation(cls, ids, data):
+    if _is_lims(cls.__name__):
+        return cls.__name__
+
+
+def _function_operation(field, ids, Model, name, values=None):
+    if _is_lims(Model.__name__):
+        if isinstance(name, (list, tuple)):
+            name = ','.join(sorted(name))
+        return '%s.%s' % (Model.__name__, name)
+
+
+def install():
+    '''
+    Instrument the wizard transitions, the report executions and the
+    Function field getters of the LIMS models. It does nothing unless the
+    instrumentation is enabled in the configuration.
+    '''
+    from trytond.report import Report
+    from trytond.wizard import Wizard
+
+    if not ENABLED or getattr(install, 'installed', False):
+        return
+    Wizard.execute = classmethod(instrumented('wizard', _wizard_operation)(
+            Wizard.execute.__func__))
+    Report.execute = classmethod(instrumented('report', _report_operation)(
+            Report.execute.__func__))
+    fields.Function.get = instrumented('function', _function_operation)(
+        fields.Function.get)
+    install.installed = True
+
+
+class PerfSample(ModelSQL, ModelView):
+    'Performance Sample'
+    __name__ = 'lims.perf.sample'
+
+    date = fields.DateTime('Date', readonly=True, select=True)
+    kind = fields.Selection([
+        ('wizard', 'Wizard'),
+        ('report', 'Report'),
+        ('cron', 'Scheduled Task'),
+        ('function', 'Function Field'),
+        ], 'Kind', readonly=True, select=True)
+    operation = fields.Char('Operation', readonly=True, select=True)
+    user = fields.Many2One('res.user', 'User', readonly=True)
+    duration = fields.Float('Duration (s)', digits=(16, 3), readonly=True)
+    sql_count = fields.Integer('SQL Statements', readonly=True)
+    sql_duration = fields.Float('SQL Duration (s)', digits=(16, 3),
+        readonly=True)
+    slowest_statements = fields.Text('Slowest Statements', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls._order.insert(0, ('date', 'DESC'))
+
+    @staticmethod
+    def default_date():
+        return datetime.now()
+
+    @staticmethod
+    def default_user():
+        return Transaction().user
+
+
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @dualmethod
+    def run_once(cls, crons):
+        for cron in crons:
+            with instrument('cron', cron.method):
+                super().run_once([cron])
@@ -12,11 +12,15 @@ from trytond.wizard import Wizard, StateTransition, StateView, StateAction, \
 from trytond.report import Report
 from trytond.pool import Pool
 from trytond.transaction import Transaction
+from trytond.config import config
 from trytond.pyson import PYSONEncoder, Eval, Equal, Bool, Not, Or
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
 from .configuration import get_print_date
 
+CONFIRM_CHUNK_SIZE = config.getint('lims', 'planification_confirm_chunk_size',
+    default=500)
+
 
 class Planification(Workflow, ModelSQL, ModelView):
     'Planification'
@@ -63,6 +67,8 @@ class Planification(Workflow, ModelSQL, ModelView):
         ('not_executed', 'Not executed'),
         ], 'State', required=True, readonly=True)
     waiting_process = fields.Boolean('Waiting process')
+    confirm_progress = fields.Integer('Confirmation progress', readonly=True,
+        help='Last notebook line linked by the confirmation process')
     wizard_executed = fields.Boolean('Wizard executed')
     method_domain = fields.Function(fields.One2Many('lims.lab.method',
         None, 'Method domain'),
@@ -332,10 +338,11 @@ class Planification(Workflow, ModelSQL, ModelView):
     @classmethod
     def do_confirm(cls, planifications):
         for planification in planifications:
-            planification.update_laboratory_notebook()
-            if planification.waiting_process:
-                planification.waiting_process = False
-                planification.save()
+            if not planification.update_laboratory_notebook():
+                continue
+            planification.waiting_process = False
+            planification.confirm_progress = None
+            planification.save()
 
     def pre_update_laboratory_notebook(self):
         cursor = Transaction().connection.cursor()
@@ -361,70 +368,133 @@ class Planification(Workflow, ModelSQL, ModelView):
                 })
 
     def update_laboratory_notebook(self):
-        cursor = Transaction().connection.cursor()
+        '''
+        Link the professionals and controls of the planification to its
+        notebook lines, committing each chunk of lines. The last line
+        linked is kept in confirm_progress and the planification stays
+        waiting process until the end, so an interrupted run is resumed
+        by the waiting planifications cron.
+
+        The run holds a session lock on the planification across the
+        commits; it returns False without doing anything when another
+        run holds it.
+        '''
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        lock = ('CAST(CAST(CAST(%s AS REGCLASS) AS OID) AS INTEGER), %s')
+        lock_params = ('"' + self._table + '"', self.id)
+        cursor.execute('SELECT pg_try_advisory_lock(' + lock + ')',
+            lock_params)
+        if not cursor.fetchone()[0]:
+            return False
+        try:
+            self._update_laboratory_notebook()
+        except Exception:
+            transaction.rollback()
+            raise
+        finally:
+            cursor = transaction.connection.cursor()
+            cursor.execute('SELECT pg_advisory_unlock(' + lock + ')',
+                lock_params)
+        return True
+
+    def _update_laboratory_notebook(self):
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
         pool = Pool()
         PlanificationDetail = pool.get('lims.planification.detail')
         PlanificationServiceDetail = pool.get(
             'lims.planification.service_detail')
+
+        if not self.waiting_process:
+            self.waiting_process = True
+            self.save()
+            transaction.commit()
+
+        # A previous run may have linked lines since this record was read
+        cursor.execute('SELECT confirm_progress '
+            'FROM "' + self._table + '" '
+            'WHERE id = %s', (self.id,))
+        self.confirm_progress = cursor.fetchone()[0]
+
+        while True:
+            cursor.execute('SELECT MAX(notebook_line) FROM ('
+                    'SELECT DISTINCT sd.notebook_line '
+                    'FROM "' + PlanificationServiceDetail._table + '" sd '
+                        'INNER JOIN "' + PlanificationDetail._table + '" pd '
+                        'ON pd.id = sd.detail '
+                    'WHERE pd.planification = %s '
+                        'AND sd.notebook_line > %s '
+                    'ORDER BY sd.notebook_line '
+                    'LIMIT %s) l',
+                (self.id, self.confirm_progress or 0, CONFIRM_CHUNK_SIZE))
+            last_line = cursor.fetchone()[0]
+            if not last_line:
+                break
+            self._link_notebook_lines(self.confirm_progress or 0, last_line)
+            self.confirm_progress = last_line
+            self.save()
+            transaction.commit()
+
+    def _link_notebook_lines(self, from_line, to_line):
+        '''
+        Replace the professionals and controls of the notebook lines of
+        the planification with an id in (from_line, to_line]
+        '''
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        pool = Pool()
+        PlanificationDetail = pool.get('lims.planification.detail')
+        PlanificationServiceDetail = pool.get(
+            'lims.planification.service_detail')
+        PlanificationFraction = pool.get('lims.planification-fraction')
         ServiceDetailProfessional = pool.get(
             'lims.planification.service_detail-laboratory.professional')
         NotebookLineProfessional = pool.get(
             'lims.notebook.line-laboratory.professional')
         NotebookLineControl = pool.get('lims.notebook.line-fraction')
 
-        # Professionals
-        cursor.execute('SELECT sd.notebook_line, sdp.professional '
-            'FROM "' + ServiceDetailProfessional._table + '" sdp '
-                'INNER JOIN "' + PlanificationServiceDetail._table + '" sd '
-                'ON sd.id = sdp.detail '
+        service_details = (
+            'FROM "' + PlanificationServiceDetail._table + '" sd '
                 'INNER JOIN "' + PlanificationDetail._table + '" pd '
-                'ON pd.id = sd.detail '
+                'ON pd.id = sd.detail ')
+        lines_where = (
             'WHERE pd.planification = %s '
-                'AND sd.notebook_line IS NOT NULL',
-            (self.id,))
-        res = cursor.fetchall()
-        if res:
-            notebook_lines_ids = ', '.join(str(nl_id)
-                for nl_id, sd_id in res)
-            cursor.execute('DELETE FROM "' +
-                NotebookLineProfessional._table + '" '
-                'WHERE notebook_line IN (' + notebook_lines_ids + ')')
+                'AND sd.notebook_line > %s '
+                'AND sd.notebook_line <= %s ')
+        params = (self.id, from_line, to_line)
 
-            to_create = []
-            for notebook_line, professional in res:
-                to_create.append({
-                    'notebook_line': notebook_line,
-                    'professional': professional,
-                    })
-            NotebookLineProfessional.create(to_create)
+        # Professionals
+        professionals = (service_details +
+            'INNER JOIN "' + ServiceDetailProfessional._table + '" sdp '
+            'ON sdp.detail = sd.id ' + lines_where)
+        cursor.execute('DELETE FROM "' +
+            NotebookLineProfessional._table + '" '
+            'WHERE notebook_line IN ('
+                'SELECT sd.notebook_line ' + professionals + ')', params)
+        cursor.execute('INSERT INTO "' +
+            NotebookLineProfessional._table + '" '
+                '(notebook_line, professional, create_uid, create_date) '
+            'SELECT sd.notebook_line, sdp.professional, %s, '
+                'CURRENT_TIMESTAMP ' + professionals,
+            (transaction.user,) + params)
 
         # Controls
-        controls = [f.id for f in self.controls]
-        if controls:
-            cursor.execute('SELECT sd.notebook_line '
-                'FROM "' + PlanificationServiceDetail._table + '" sd '
-                    'INNER JOIN "' + PlanificationDetail._table + '" pd '
-                    'ON pd.id = sd.detail '
-                'WHERE pd.planification = %s '
-                    'AND sd.notebook_line IS NOT NULL '
-                    'AND sd.is_control = FALSE',
-                (self.id,))
-            res = [x[0] for x in cursor.fetchall()]
-            if res:
-                notebook_lines_ids = ', '.join(str(nl_id)
-                    for nl_id in res)
-                cursor.execute('DELETE FROM "' +
-                    NotebookLineControl._table + '" '
-                    'WHERE notebook_line IN (' + notebook_lines_ids + ')')
-
-                to_create = []
-                for notebook_line in res:
-                    for fraction in controls:
-                        to_create.append({
-                            'notebook_line': notebook_line,
-                            'fraction': fraction,
-                            })
-                NotebookLineControl.create(to_create)
+        controls = (service_details +
+            'INNER JOIN "' + PlanificationFraction._table + '" pf '
+            'ON pf.planification = pd.planification ' + lines_where +
+                'AND sd.is_control = FALSE ')
+        cursor.execute('DELETE FROM "' +
+            NotebookLineControl._table + '" '
+            'WHERE notebook_line IN ('
+                'SELECT sd.notebook_line ' + controls + ')', params)
+        cursor.execute('INSERT INTO "' +
+            NotebookLineControl._table + '" '
+                '(notebook_line, fraction, create_uid, create_date) '
+            'SELECT sd.notebook_line, pf.fraction, %s, '
+                'CURRENT_TIMESTAMP ' + controls,
+            (transaction.user,) + params)
 
     def update_analysis_detail(self):
         cursor = Transaction().connection.cursor()
@@ -4196,6 +4266,8 @@ class SearchFractions(Wizard):
         pool = Pool()
         PlanificationServiceDetail = pool.get(
             'lims.planification.service_detail')
+        PlanificationDetail = pool.get('lims.planification.detail')
+        Planification = pool.get('lims.planification')
         NotebookLine = pool.get('lims.notebook.line')
         Notebook = pool.get('lims.notebook')
         Fraction = pool.get('lims.fraction')
@@ -4203,81 +4275,75 @@ class SearchFractions(Wizard):
         Service = pool.get('lims.service')
         Analysis = pool.get('lims.analysis')
 
-        planification_details = PlanificationServiceDetail.search([
-            ('planification.state', '=', 'preplanned'),
-            ('notebook_line', '!=', None),
-            ])
-        planned_lines = [pd.notebook_line.id for pd in planification_details]
-        planned_lines_ids = ', '.join(str(x) for x in [0] + planned_lines)
-        preplanned_where = 'AND nl.id NOT IN (%s) ' % planned_lines_ids
+        result = {}
+        analysis_ids = [a.id for a in planification.analysis]
+        if not analysis_ids:
+            return result
+        included_query, included_params = (
+            Analysis.get_included_analysis_query(analysis_ids))
+
+        preplanned_where = (
+            'AND NOT EXISTS ('
+                'SELECT 1 '
+                'FROM "' + PlanificationServiceDetail._table + '" psd '
+                    'INNER JOIN "' + PlanificationDetail._table + '" pd '
+                    'ON pd.id = psd.detail '
+                    'INNER JOIN "' + Planification._table + '" p '
+                    'ON p.id = pd.planification '
+                'WHERE psd.notebook_line = nl.id '
+                    'AND p.state = \'preplanned\') ')
 
         dates_where = self._get_dates_clause(planification)
 
-        result = {}
-        nlines_added = []
-        for a in planification.analysis:
-            analysis_id = a.id
-
-            all_included_analysis = [analysis_id]
-            all_included_analysis.extend(
-                Analysis.get_included_analysis_analysis(analysis_id))
-            all_included_analysis_ids = ', '.join(str(x)
-                for x in all_included_analysis)
-            service_where = ('AND ad.analysis IN (%s) ' %
-                all_included_analysis_ids)
-
-            sql_select = (
-                'SELECT nl.id, nb.fraction, srv.analysis, nl.repetition != 0 ')
-
-            sql_from = (
-                'FROM "' + NotebookLine._table + '" nl '
-                'INNER JOIN "' + Analysis._table + '" nla '
-                'ON nla.id = nl.analysis '
-                'INNER JOIN "' + Notebook._table + '" nb '
-                'ON nb.id = nl.notebook '
-                'INNER JOIN "' + Fraction._table + '" frc '
-                'ON frc.id = nb.fraction '
-                'INNER JOIN "' + EntryDetailAnalysis._table + '" ad '
-                'ON ad.id = nl.analysis_detail '
-                'INNER JOIN "' + Service._table + '" srv '
-                'ON srv.id = nl.service ')
-
-            sql_where = (
-                'WHERE ad.plannable = TRUE '
-                'AND nl.start_date IS NULL '
-                'AND nl.annulled = FALSE '
-                'AND nl.laboratory = %s '
-                'AND nla.behavior != \'internal_relation\' ' +
-                preplanned_where + dates_where + service_where + extra_where)
-
-            sql_order = (
-                'ORDER BY nb.fraction ASC, srv.analysis ASC')
-
-            with Transaction().set_user(0):
-                cursor.execute(sql_select + sql_from + sql_where + sql_order,
-                    (planification.laboratory.id,))
-            notebook_lines = cursor.fetchall()
-            if not notebook_lines:
-                continue
-            if extra_where:
-                for nl in notebook_lines:
-                    f_ = nl[1]
-                    s_ = nl[2]
-                    if (f_, s_) not in result:
-                        result[(f_, s_)] = []
-                    if nl[0] not in nlines_added:
-                        nlines_added.append(nl[0])
-                        result[(f_, s_)].append({
-                            'notebook_line': nl[0],
-                            'planned_service': a.id,
-                            })
-            else:
-                for nl in notebook_lines:
-                    f_ = nl[1]
-                    s_ = nl[2]
-                    result[(f_, s_)] = {
-                        'repetition': nl[3],
-                        }
+        # Each line is planned once, for the first planned analysis that
+        # includes it
+        sql_select = (
+            'SELECT DISTINCT ON (nl.id) nl.id, nb.fraction, srv.analysis, '
+                'nl.repetition != 0, ia.analysis ')
+
+        sql_from = (
+            'FROM "' + NotebookLine._table + '" nl '
+            'INNER JOIN "' + Analysis._table + '" nla '
+            'ON nla.id = nl.analysis '
+            'INNER JOIN "' + Notebook._table + '" nb '
+            'ON nb.id = nl.notebook '
+            'INNER JOIN "' + Fraction._table + '" frc '
+            'ON frc.id = nb.fraction '
+            'INNER JOIN "' + EntryDetailAnalysis._table + '" ad '
+            'ON ad.id = nl.analysis_detail '
+            'INNER JOIN "' + Service._table + '" srv '
+            'ON srv.id = nl.service '
+            'INNER JOIN (' + included_query + ') ia '
+            'ON ia.included_analysis = ad.analysis ')
+
+        sql_where = (
+            'WHERE ad.plannable = TRUE '
+            'AND nl.start_date IS NULL '
+            'AND nl.annulled = FALSE '
+            'AND nl.laboratory = %s '
+            'AND nla.behavior != \'internal_relation\' ' +
+            preplanned_where + dates_where + extra_where)
+
+        sql_order = (
+            'ORDER BY nl.id ASC, ia.position ASC')
+
+        with Transaction().set_user(0):
+            cursor.execute('SELECT * FROM (' +
+                sql_select + sql_from + sql_where + sql_order + ') l '
+                'ORDER BY 2 ASC, 3 ASC, 1 ASC',
+                included_params + [planification.laboratory.id])
+        notebook_lines = cursor.fetchall()
+        if extra_where:
+            for nl in notebook_lines:
+                result.setdefault((nl[1], nl[2]), []).append({
+                    'notebook_line': nl[0],
+                    'planned_service': nl[4],
+                    })
+        else:
+            for nl in notebook_lines:
+                result[(nl[1], nl[2])] = {
+                    'repetition': nl[3],
+                    }
 
         return result
 
@@ -4427,6 +4493,13 @@ class SearchPlannedFractions(Wizard):
         Service = pool.get('lims.service')
         Analysis = pool.get('lims.analysis')
 
+        result = {}
+        analysis_ids = [a.id for a in self.start.analysis]
+        if not analysis_ids:
+            return result
+        included_query, included_params = (
+            Analysis.get_included_analysis_query(analysis_ids))
+
         dates_where = ''
         if self.start.date_from:
             dates_where += ('AND ad.confirmation_date::date >= \'%s\'::date ' %
@@ -4435,78 +4508,68 @@ class SearchPlannedFractions(Wizard):
             dates_where += ('AND ad.confirmation_date::date <= \'%s\'::date ' %
                 self.start.date_to)
 
-        result = {}
-        nlines_added = []
-        for a in self.start.analysis:
-            analysis_id = a.id
-
-            all_included_analysis = [analysis_id]
-            all_included_analysis.extend(
-                Analysis.get_included_analysis_analysis(analysis_id))
-            all_included_analysis_ids = ', '.join(str(x)
-                for x in all_included_analysis)
-            service_where = ('AND ad.analysis IN (%s) ' %
-                all_included_analysis_ids)
-
-            excluded_fractions = self.get_control_fractions_excluded(
-                self.start.laboratory.id, service_where)
-            excluded_fractions_ids = ', '.join(str(x)
-                for x in [0] + excluded_fractions)
-            excluded_where = ('AND nb.fraction NOT IN (%s) ' %
-                excluded_fractions_ids)
-
-            sql_select = (
-                'SELECT nl.id, nb.fraction, srv.analysis, nl.repetition != 0 ')
-
-            sql_from = (
-                'FROM "' + NotebookLine._table + '" nl '
-                'INNER JOIN "' + Analysis._table + '" nla '
-                'ON nla.id = nl.analysis '
-                'INNER JOIN "' + Notebook._table + '" nb '
-                'ON nb.id = nl.notebook '
-                'INNER JOIN "' + Fraction._table + '" frc '
-                'ON frc.id = nb.fraction '
-                'INNER JOIN "' + EntryDetailAnalysis._table + '" ad '
-                'ON ad.id = nl.analysis_detail '
-                'INNER JOIN "' + Service._table + '" srv '
-                'ON srv.id = nl.service ')
-
-            sql_where = (
-                'WHERE ad.plannable = TRUE '
-                'AND nl.start_date IS NOT NULL '
-                'AND nl.end_date IS NULL '
-                'AND nl.laboratory = %s '
-                'AND nla.behavior != \'internal_relation\' ' +
-                excluded_where + dates_where + service_where + extra_where)
-
-            sql_order = (
-                'ORDER BY nb.fraction ASC, srv.analysis ASC')
+        # Control fractions are excluded when they have lines of any of the
+        # analysis, which excludes the same lines as checking the analysis
+        # one by one
+        cursor.execute('SELECT DISTINCT included_analysis '
+            'FROM (' + included_query + ') ia', included_params)
+        service_where = ('AND ad.analysis IN (%s) ' %
+            ', '.join(str(x[0]) for x in cursor.fetchall()))
+        excluded_fractions = self.get_control_fractions_excluded(
+            self.start.laboratory.id, service_where)
+        excluded_fractions_ids = ', '.join(str(x)
+            for x in [0] + excluded_fractions)
+        excluded_where = ('AND nb.fraction NOT IN (%s) ' %
+            excluded_fractions_ids)
+
+        sql_select = (
+            'SELECT DISTINCT ON (nl.id) nl.id, nb.fraction, srv.analysis, '
+                'nl.repetition != 0, ia.analysis ')
+
+        sql_from = (
+            'FROM "' + NotebookLine._table + '" nl '
+            'INNER JOIN "' + Analysis._table + '" nla '
+            'ON nla.id = nl.analysis '
+            'INNER JOIN "' + Notebook._table + '" nb '
+            'ON nb.id = nl.notebook '
+            'INNER JOIN "' + Fraction._table + '" frc '
+            'ON frc.id = nb.fraction '
+            'INNER JOIN "' + EntryDetailAnalysis._table + '" ad '
+            'ON ad.id = nl.analysis_detail '
+            'INNER JOIN "' + Service._table + '" srv '
+            'ON srv.id = nl.service '
+            'INNER JOIN (' + included_query + ') ia '
+            'ON ia.included_analysis = ad.analysis ')
+
+        sql_where = (
+            'WHERE ad.plannable = TRUE '
+            'AND nl.start_date IS NOT NULL '
+            'AND nl.end_date IS NULL '
+            'AND nl.laboratory = %s '
+            'AND nla.behavior != \'internal_relation\' ' +
+            excluded_where + dates_where + extra_where)
+
+        sql_order = (
+            'ORDER BY nl.id ASC, ia.position ASC')
 
-            with Transaction().set_user(0):
-                cursor.execute(sql_select + sql_from + sql_where + sql_order,
-                    (self.start.laboratory.id,))
-            notebook_lines = cursor.fetchall()
-            if notebook_lines:
-                if extra_where:
-                    for nl in notebook_lines:
-                        f_ = nl[1]
-                        s_ = nl[2]
-                        if (f_, s_) not in result:
-                            result[(f_, s_)] = []
-                        if nl[0] not in nlines_added:
-                            nlines_added.append(nl[0])
-                            result[(f_, s_)].append({
-                                'notebook_line': nl[0],
-                                'planned_service': a.id,
-                                'is_replanned': True,
-                                })
-                else:
-                    for nl in notebook_lines:
-                        f_ = nl[1]
-                        s_ = nl[2]
-                        result[(f_, s_)] = {
-                            'repetition': nl[3],
-                            }
+        with Transaction().set_user(0):
+            cursor.execute('SELECT * FROM (' +
+                sql_select + sql_from + sql_where + sql_order + ') l '
+                'ORDER BY 2 ASC, 3 ASC, 1 ASC',
+                included_params + [self.start.laboratory.id])
+        notebook_lines = cursor.fetchall()
+        if extra_where:
+            for nl in notebook_lines:
+                result.setdefault((nl[1], nl[2]), []).append({
+                    'notebook_line': nl[0],
+                    'planned_service': nl[4],
+                    'is_replanned': True,
+                    })
+        else:
+            for nl in notebook_lines:
+                result[(nl[1], nl[2])] = {
+                    'repetition': nl[3],
+                    }
 
         return result
 
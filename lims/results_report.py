@@ -2,7 +2,8 @@
 # This file is part of lims module for Tryton.
 # The COPYRIGHT file at the top level of this repository contains
 # the full copyright notices and license terms.
-from io import BytesIO
+import os
+import tempfile
 from datetime import datetime
 from PyPDF2 import PdfFileMerger
 from sql import Literal, Null
@@ -425,25 +426,37 @@ class ResultsReport(ModelSQL, ModelView):
         pool = Pool()
         CachedReport = pool.get('lims.results_report.cached_report')
 
-        all_cache = []
-        for detail in details:
-            cached_reports = CachedReport.search([
-                ('version_detail', '=', detail.id),
+        cached_reports = {}
+        for cached_report in CachedReport.search([
+                ('version_detail', 'in', [d.id for d in details]),
                 ('report_language', '=', language.id),
                 ('report_format', '=', 'pdf'),
-                ])
-            if cached_reports:
-                all_cache.append(cached_reports[0].report_cache)
-        if not all_cache:
+                ], order=[('id', 'ASC')]):
+            cached_reports.setdefault(cached_report.version_detail.id,
+                cached_report.id)
+        cached_report_ids = [cached_reports[d.id] for d in details
+            if d.id in cached_reports]
+        if not cached_report_ids:
             return False
 
-        merger = PdfFileMerger(strict=False)
-        for cache in all_cache:
-            filedata = BytesIO(cache)
-            merger.append(filedata)
-        output = BytesIO()
-        merger.write(output)
-        return bytearray(output.getvalue())
+        # Each part is spooled to disk and read back by the merger on
+        # demand, so only one part is held in memory at a time
+        with tempfile.TemporaryDirectory() as directory:
+            merger = PdfFileMerger(strict=False)
+            for cached_report_id in cached_report_ids:
+                cache, = CachedReport.read([cached_report_id],
+                    ['report_cache'])
+                path = os.path.join(directory, '%s.pdf' % cached_report_id)
+                with open(path, 'wb') as part:
+                    part.write(cache['report_cache'])
+                del cache
+                merger.append(path)
+            path = os.path.join(directory, 'global.pdf')
+            with open(path, 'wb') as output:
+                merger.write(output)
+            merger.close()
+            with open(path, 'rb') as output:
+                return bytearray(output.read())
 
     @classmethod
     def get_samples_list(cls, reports, name):
@@ -26,9 +26,12 @@ from trytond.exceptions import UserError, UserWarning
 from trytond.i18n import gettext
 from trytond.rpc import RPC
 from trytond.config import config as tconfig
-from trytond.tools import get_smtp_server
+from trytond.tools import grouped_slice
 from trytond import backend
 
+from .mail import send_mail
+from .configuration import clean_transaction_cache
+
 logger = logging.getLogger(__name__)
 
 
@@ -3012,113 +3015,128 @@ class Sample(ModelSQL, ModelView):
             raise UserError(gettext('lims.msg_no_service_sequence',
                 work_year=workyear.rec_name))
 
+        # Values of the original records are read only once
         sample_dict = sample._get_dict_for_fast_copy()
+        packages = [p._get_dict_for_fast_copy() for p in sample.packages]
+        fractions = []
+        for fraction in sample.fractions:
+            services = []
+            for service in fraction.services:
+                services.append((service._get_dict_for_fast_copy(),
+                    [d._get_dict_for_fast_copy()
+                        for d in service.analysis_detail]))
+            fractions.append((fraction._get_dict_for_fast_copy(), services))
+
+        # samples
+        samples_rows, sample_numbers = [], []
         for label in labels:
             if not label:
                 continue
+            sample_number = str(sample_sequence.get())
+            row = sample_dict.copy()
+            row['number'] = "'%s'" % sample_number
+            row['label'] = "'%s'" % str(label)
+            samples_rows.append(row)
+            sample_numbers.append(sample_number)
+        if not samples_rows:
+            return
+        sample_ids = dict((number, id_) for id_, number in cls._fast_insert(
+            'lims_sample', samples_rows, 'id, number'))
 
-            # sample
-            sample_number = sample_sequence.get()
-            f_count = 0
-            sample_dict['number'] = "'%s'" % str(sample_number)
-            sample_dict['label'] = "'%s'" % str(label)
-
-            query = "INSERT INTO lims_sample ("
-            query += ", ".join([str(x) for x in sample_dict.keys()])
-            query += ") VALUES ("
-            query += ", ".join([str(x) for x in sample_dict.values()])
-            query += ") RETURNING id"
-            cursor.execute(query)
-            row = cursor.fetchone()
-            if not row:
-                raise
-            sample_id = row[0]
-
-            # sample eng fields
+        # sample eng fields
+        translations = []
+        for sample_number in sample_numbers:
+            sample_id = sample_ids[sample_number]
             if default.get('sample_client_description_lang'):
-                cursor.execute("INSERT INTO ir_translation "
-                    "(lang, src, name, res_id, value, type) VALUES "
-                    "(%s, %s, 'lims.sample,sample_client_description', %s, "
-                    "%s, 'model')",
-                    (default['foreign_language_code'],
+                translations.append((default['foreign_language_code'],
                     sample_dict['sample_client_description'], sample_id,
-                    default['sample_client_description_lang']))
+                    default['sample_client_description_lang'],
+                    'lims.sample,sample_client_description'))
             if default.get('obj_description_manual_lang'):
-                cursor.execute("INSERT INTO ir_translation "
-                    "(lang, src, name, res_id, value, type) VALUES "
-                    "(%s, %s, 'lims.sample,obj_description_manual', %s, "
-                    "%s, 'model')",
-                    (default['foreign_language_code'],
+                translations.append((default['foreign_language_code'],
                     sample_dict['obj_description_manual'], sample_id,
-                    default['obj_description_manual_lang']))
-
-            # packages
-            for package in sample.packages:
-                package_dict = package._get_dict_for_fast_copy()
-                package_dict['sample'] = str(sample_id)
-
-                query = "INSERT INTO lims_sample_package ("
-                query += ", ".join([str(x) for x in package_dict.keys()])
-                query += ") VALUES ("
-                query += ", ".join([str(x) for x in package_dict.values()])
-                query += ") RETURNING id"
-                cursor.execute(query)
-                row = cursor.fetchone()
-                if not row:
-                    raise
+                    default['obj_description_manual_lang'],
+                    'lims.sample,obj_description_manual'))
+        for sub_translations in grouped_slice(translations):
+            sub_translations = list(sub_translations)
+            cursor.execute("INSERT INTO ir_translation "
+                "(lang, src, res_id, value, name, type) VALUES " +
+                ", ".join(["(%s, %s, %s, %s, %s, 'model')"] *
+                    len(sub_translations)),
+                [v for t in sub_translations for v in t])
+
+        # packages
+        packages_rows = []
+        for sample_number in sample_numbers:
+            for package_dict in packages:
+                row = package_dict.copy()
+                row['sample'] = str(sample_ids[sample_number])
+                packages_rows.append(row)
+        cls._fast_insert('lims_sample_package', packages_rows)
+
+        # fractions
+        fractions_rows = []
+        for sample_number in sample_numbers:
+            for f_count, (fraction_dict, _) in enumerate(fractions, 1):
+                row = fraction_dict.copy()
+                row['sample'] = str(sample_ids[sample_number])
+                row['number'] = "'%s-%s'" % (sample_number, f_count)
+                fractions_rows.append(row)
+        fraction_ids = dict((number, id_) for id_, number in cls._fast_insert(
+            'lims_fraction', fractions_rows, 'id, number'))
+
+        # services
+        services_rows, services_details = [], []
+        for sample_number in sample_numbers:
+            for f_count, (_, services) in enumerate(fractions, 1):
+                fraction_id = fraction_ids['%s-%s' % (sample_number, f_count)]
+                for service_dict, details in services:
+                    row = service_dict.copy()
+                    row['fraction'] = str(fraction_id)
+                    service_number = str(service_sequence.get())
+                    row['number'] = "'%s'" % service_number
+                    services_rows.append(row)
+                    services_details.append((service_number, details))
+        service_ids = dict((number, id_) for id_, number in cls._fast_insert(
+            'lims_service', services_rows, 'id, number'))
+
+        # analysis_detail
+        details_rows = []
+        for service_number, details in services_details:
+            service_id = service_ids[service_number]
+            for detail_dict in details:
+                row = detail_dict.copy()
+                row['service'] = str(service_id)
+                details_rows.append(row)
+        cls._fast_insert('lims_entry_detail_analysis', details_rows)
+
+        # the rows are inserted without create, so the modules that follow
+        # the samples state are notified here
+        cls.update_samples_state(list(sample_ids.values()))
 
-            # fractions
-            for fraction in sample.fractions:
-                fraction_dict = fraction._get_dict_for_fast_copy()
-                fraction_dict['sample'] = str(sample_id)
-                f_count += 1
-                fraction_dict['number'] = "'%s-%s'" % (sample_number, f_count)
-
-                query = "INSERT INTO lims_fraction ("
-                query += ", ".join([str(x) for x in fraction_dict.keys()])
-                query += ") VALUES ("
-                query += ", ".join([str(x) for x in fraction_dict.values()])
-                query += ") RETURNING id"
+    @staticmethod
+    def _fast_insert(table, rows, returning='id'):
+        '''
+        Insert rows (dictionaries of SQL values as built by
+        _get_dict_for_fast_copy) with multi-row INSERT statements and
+        return the fetched returning columns
+        '''
+        cursor = Transaction().connection.cursor()
+        result = []
+        by_columns = {}
+        for row in rows:
+            by_columns.setdefault(tuple(row.keys()), []).append(row)
+        for columns, column_rows in by_columns.items():
+            for sub_rows in grouped_slice(column_rows):
+                query = "INSERT INTO " + table + " ("
+                query += ", ".join([str(x) for x in columns])
+                query += ") VALUES "
+                query += ", ".join(["(" + ", ".join([str(r[x])
+                    for x in columns]) + ")" for r in sub_rows])
+                query += " RETURNING " + returning
                 cursor.execute(query)
-                row = cursor.fetchone()
-                if not row:
-                    raise
-                fraction_id = row[0]
-
-                # services
-                for service in fraction.services:
-                    service_dict = service._get_dict_for_fast_copy()
-                    service_dict['fraction'] = str(fraction_id)
-                    service_number = service_sequence.get()
-                    service_dict['number'] = "'%s'" % str(service_number)
-
-                    query = "INSERT INTO lims_service ("
-                    query += ", ".join([str(x) for x in service_dict.keys()])
-                    query += ") VALUES ("
-                    query += ", ".join([str(x) for x in service_dict.values()])
-                    query += ") RETURNING id"
-                    cursor.execute(query)
-                    row = cursor.fetchone()
-                    if not row:
-                        raise
-                    service_id = row[0]
-
-                    # analysis_detail
-                    for detail in service.analysis_detail:
-                        detail_dict = detail._get_dict_for_fast_copy()
-                        detail_dict['service'] = str(service_id)
-
-                        query = "INSERT INTO lims_entry_detail_analysis ("
-                        query += ", ".join([str(x)
-                            for x in detail_dict.keys()])
-                        query += ") VALUES ("
-                        query += ", ".join([str(x)
-                            for x in detail_dict.values()])
-                        query += ") RETURNING id"
-                        cursor.execute(query)
-                        row = cursor.fetchone()
-                        if not row:
-                            raise
+                result.extend(cursor.fetchall())
+        return result
 
     def _get_dict_for_fast_copy(self):
         cursor = Transaction().connection.cursor()
@@ -3845,36 +3863,57 @@ class Sample(ModelSQL, ModelView):
 
     @classmethod
     def update_samples_state(cls, sample_ids):
+        cursor = Transaction().connection.cursor()
         Entry = Pool().get('lims.entry')
+
+        sample_ids = list(set(sample_ids))
+        if not sample_ids:
+            return
+
         entry_ids = set()
-        samples = cls.browse(sample_ids)
-        for sample in samples:
-            sample.update_sample_dates()
-            sample.update_sample_state()
-            sample.update_qty_lines()
-            entry_ids.add(sample.entry.id)
+        current, new = {}, {}
+        for sub_ids in grouped_slice(sample_ids):
+            sub_ids = tuple(sub_ids)
+            cursor.execute('SELECT id, entry, ' +
+                ', '.join(cls._samples_state_fields) + ' '
+                'FROM "' + cls._table + '" '
+                'WHERE id IN %s', (sub_ids,))
+            for row in cursor.fetchall():
+                entry_ids.add(row[1])
+                current[row[0]] = dict(zip(cls._samples_state_fields,
+                    row[2:]))
+            new.update(cls._get_samples_state_values(
+                [x for x in sub_ids if x in current]))
+
+        if Transaction().context.get('manage_service', False):
+            for sample in cls.browse(list(new.keys())):
+                new[sample.id].update(sample._get_origin_default_dates())
+
+        to_update = {}
+        for sample_id, values in new.items():
+            values['state'] = cls._compute_sample_state(values)
+            for field in cls._samples_state_fields:
+                if values[field] != current[sample_id][field]:
+                    to_update.setdefault(field, []).append(
+                        (sample_id, values[field]))
+        cls._update_samples_columns(to_update)
+
         if entry_ids:
             Entry.update_entries_state(list(entry_ids))
 
-    def update_sample_dates(self):
-        dates = self._get_sample_dates()
-        for field, value in dates.items():
-            setattr(self, field, value)
-        self.save()
+    _samples_state_fields = ('confirmation_date', 'laboratory_date',
+        'report_date', 'laboratory_start_date', 'laboratory_end_date',
+        'laboratory_acceptance_date', 'results_report_create_date',
+        'results_report_release_date', 'state', 'qty_lines_pending',
+        'qty_lines_pending_acceptance')
 
-    def _get_origin_default_dates(self):
-        ''' Used on Manage services context
-            Sample dates modifier based on origin.
-            Extend this method for use cases where the sample
-            is not part of an entry.
-        '''
-        res = {}
-        # Set confirmation date to None for draft and pending entries
-        if self.entry and self.entry.state != 'ongoing':
-            res['confirmation_date'] = None
-        return res
-
-    def _get_sample_dates(self):
+    @classmethod
+    def _get_samples_state_values(cls, sample_ids):
+        """ Return the dates and the pending lines counters of each sample,
+            computed with one query per related model. Besides the field
+            values, the counters needed by _compute_sample_state are
+            returned under keys starting with an underscore.
+        """
         cursor = Transaction().connection.cursor()
         pool = Pool()
         Fraction = pool.get('lims.fraction')
@@ -3886,102 +3925,85 @@ class Sample(ModelSQL, ModelView):
         ResultsDetail = pool.get('lims.results_report.version.detail')
         ResultsSample = pool.get('lims.results_report.version.detail.sample')
 
-        res = {}
-        if Transaction().context.get(
-                    'manage_service', False):
-            res = self._get_origin_default_dates()
-
-        # Confirmation date
-        if 'confirmation_date' not in res:
-            cursor.execute('SELECT MIN(s.confirmation_date) '
-                'FROM "' + Service._table + '" s '
-                    'INNER JOIN "' + Fraction._table + '" f '
-                    'ON f.id = s.fraction '
-                'WHERE f.sample = %s',
-                (self.id,))
-            res['confirmation_date'] = cursor.fetchone()[0] or None
-
-        # Laboratory deadline
-        cursor.execute('SELECT MAX(s.laboratory_date) '
-            'FROM "' + Service._table + '" s '
-                'INNER JOIN "' + Fraction._table + '" f '
-                'ON f.id = s.fraction '
-            'WHERE f.sample = %s',
-            (self.id,))
-        res['laboratory_date'] = cursor.fetchone()[0] or None
-
-        # Date agreed for result
-        cursor.execute('SELECT MAX(s.report_date) '
+        sample_ids = tuple(sample_ids)
+        if not sample_ids:
+            return {}
+        res = dict((s_id, {
+            'confirmation_date': None,
+            'laboratory_date': None,
+            'report_date': None,
+            'laboratory_start_date': None,
+            'laboratory_end_date': None,
+            'laboratory_acceptance_date': None,
+            'results_report_create_date': None,
+            'results_report_release_date': None,
+            'qty_lines_pending': 0,
+            'qty_lines_pending_acceptance': 0,
+            '_services': 0,
+            '_annulled_services': 0,
+            '_lines': 0,
+            '_annulled_lines': 0,
+            '_ended_lines': 0,
+            }) for s_id in sample_ids)
+
+        cursor.execute('SELECT f.sample, MIN(s.confirmation_date), '
+                'MAX(s.laboratory_date), MAX(s.report_date), COUNT(*), '
+                'COUNT(*) FILTER (WHERE s.annulled = TRUE) '
             'FROM "' + Service._table + '" s '
                 'INNER JOIN "' + Fraction._table + '" f '
                 'ON f.id = s.fraction '
-            'WHERE f.sample = %s',
-            (self.id,))
-        res['report_date'] = cursor.fetchone()[0] or None
-
-        # Laboratory start date
-        cursor.execute('SELECT MIN(nl.start_date) '
-            'FROM "' + NotebookLine._table + '" nl '
-                'INNER JOIN "' + Service._table + '" s '
-                'ON s.id = nl.service '
-                'INNER JOIN "' + Fraction._table + '" f '
-                'ON f.id = s.fraction '
-            'WHERE f.sample = %s',
-            (self.id,))
-        res['laboratory_start_date'] = cursor.fetchone()[0] or None
+            'WHERE f.sample IN %s '
+            'GROUP BY f.sample',
+            (sample_ids,))
+        for row in cursor.fetchall():
+            res[row[0]].update({
+                'confirmation_date': row[1],
+                'laboratory_date': row[2],
+                'report_date': row[3],
+                '_services': row[4],
+                '_annulled_services': row[5],
+                })
 
-        # Laboratory end date
-        laboratory_end_date = None
-        cursor.execute('SELECT COUNT(*) '
+        reportable = 'nl.report = TRUE AND nl.annulled = FALSE'
+        cursor.execute('SELECT f.sample, MIN(nl.start_date), '
+                'MAX(nl.end_date), MAX(nl.acceptance_date::date), '
+                'COUNT(*) FILTER (WHERE ' + reportable + ' '
+                    'AND nl.end_date IS NULL), '
+                'COUNT(*) FILTER (WHERE ' + reportable + ' '
+                    'AND nl.acceptance_date IS NULL), '
+                'COUNT(*) FILTER (WHERE ' + reportable + ' '
+                    'AND nl.end_date IS NOT NULL), '
+                'COUNT(*) FILTER (WHERE ' + reportable + ' '
+                    'AND nl.end_date IS NOT NULL '
+                    'AND nl.acceptance_date IS NULL), '
+                'COUNT(*), '
+                'COUNT(*) FILTER (WHERE nl.annulled = TRUE) '
             'FROM "' + NotebookLine._table + '" nl '
                 'INNER JOIN "' + Service._table + '" s '
                 'ON s.id = nl.service '
                 'INNER JOIN "' + Fraction._table + '" f '
                 'ON f.id = s.fraction '
-            'WHERE f.sample = %s '
-                'AND nl.report = TRUE '
-                'AND nl.annulled = FALSE '
-                'AND nl.end_date IS NULL',
-            (self.id,))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute('SELECT MAX(nl.end_date) '
-                'FROM "' + NotebookLine._table + '" nl '
-                    'INNER JOIN "' + Service._table + '" s '
-                    'ON s.id = nl.service '
-                    'INNER JOIN "' + Fraction._table + '" f '
-                    'ON f.id = s.fraction '
-                'WHERE f.sample = %s',
-                (self.id,))
-            laboratory_end_date = cursor.fetchone()[0] or None
-        res['laboratory_end_date'] = laboratory_end_date
-
-        # Laboratory acceptance date
-        laboratory_acceptance_date = None
-        cursor.execute('SELECT COUNT(*) '
-            'FROM "' + NotebookLine._table + '" nl '
-                'INNER JOIN "' + Service._table + '" s '
-                'ON s.id = nl.service '
-                'INNER JOIN "' + Fraction._table + '" f '
-                'ON f.id = s.fraction '
-            'WHERE f.sample = %s '
-                'AND nl.report = TRUE '
-                'AND nl.annulled = FALSE '
-                'AND nl.acceptance_date IS NULL',
-            (self.id,))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute('SELECT MAX(nl.acceptance_date::date) '
-                'FROM "' + NotebookLine._table + '" nl '
-                    'INNER JOIN "' + Service._table + '" s '
-                    'ON s.id = nl.service '
-                    'INNER JOIN "' + Fraction._table + '" f '
-                    'ON f.id = s.fraction '
-                'WHERE f.sample = %s',
-                (self.id,))
-            laboratory_acceptance_date = cursor.fetchone()[0] or None
-        res['laboratory_acceptance_date'] = laboratory_acceptance_date
+            'WHERE f.sample IN %s '
+            'GROUP BY f.sample',
+            (sample_ids,))
+        for row in cursor.fetchall():
+            (sample_id, start_date, end_date, acceptance_date, not_ended,
+                not_accepted, ended, pending_acceptance, lines,
+                annulled_lines) = row
+            res[sample_id].update({
+                'laboratory_start_date': start_date,
+                'laboratory_end_date': end_date if not not_ended else None,
+                'laboratory_acceptance_date': (acceptance_date
+                    if not not_accepted else None),
+                'qty_lines_pending': not_ended,
+                'qty_lines_pending_acceptance': pending_acceptance,
+                '_lines': lines,
+                '_annulled_lines': annulled_lines,
+                '_ended_lines': ended,
+                })
 
-        # Report start date
-        cursor.execute('SELECT MIN(r.create_date::date) '
+        cursor.execute('SELECT f.sample, MIN(r.create_date::date), '
+                'MAX(rd.release_date::date) FILTER (WHERE rd.valid) '
             'FROM "' + ResultsReport._table + '" r '
                 'INNER JOIN "' + ResultsVersion._table + '" rv '
                 'ON rv.results_report = r.id '
@@ -3993,106 +4015,83 @@ class Sample(ModelSQL, ModelView):
                 'ON n.id = rs.notebook '
                 'INNER JOIN "' + Fraction._table + '" f '
                 'ON f.id = n.fraction '
-            'WHERE f.sample = %s '
-                'AND rd.type != \'preliminary\'',
-            (self.id,))
-        res['results_report_create_date'] = cursor.fetchone()[0] or None
-
-        # Report release date
-        cursor.execute('SELECT MAX(rd.release_date::date) '
-            'FROM "' + ResultsDetail._table + '" rd '
-                'INNER JOIN "' + ResultsSample._table + '" rs '
-                'ON rs.version_detail = rd.id '
-                'INNER JOIN "' + Notebook._table + '" n '
-                'ON n.id = rs.notebook '
-                'INNER JOIN "' + Fraction._table + '" f '
-                'ON f.id = n.fraction '
-            'WHERE f.sample = %s '
-                'AND rd.valid '
-                'AND rd.type != \'preliminary\'',
-            (self.id,))
-        res['results_report_release_date'] = cursor.fetchone()[0] or None
-
+            'WHERE f.sample IN %s '
+                'AND rd.type != \'preliminary\' '
+            'GROUP BY f.sample',
+            (sample_ids,))
+        for row in cursor.fetchall():
+            res[row[0]].update({
+                'results_report_create_date': row[1],
+                'results_report_release_date': row[2],
+                })
         return res
 
-    def update_sample_state(self):
-        state = self._get_sample_state()
-        if self.state != state:
-            self.state = state
-            self.save()
-
-    def _get_sample_state(self):
-        cursor = Transaction().connection.cursor()
-        pool = Pool()
-        Fraction = pool.get('lims.fraction')
-        Service = pool.get('lims.service')
-        NotebookLine = pool.get('lims.notebook.line')
-
-        if self.results_report_release_date:
+    @staticmethod
+    def _compute_sample_state(values):
+        """ Return the state of a sample from the values returned by
+            _get_samples_state_values
+        """
+        if values['results_report_release_date']:
             return 'report_released'
-        if self.results_report_create_date:
+        if values['results_report_create_date']:
             return 'in_report'
-        if self.laboratory_acceptance_date:
+        if values['laboratory_acceptance_date']:
             return 'pending_report'
-        cursor.execute('SELECT COUNT(*) '
-            'FROM "' + NotebookLine._table + '" nl '
-                'INNER JOIN "' + Service._table + '" s '
-                'ON s.id = nl.service '
-                'INNER JOIN "' + Fraction._table + '" f '
-                'ON f.id = s.fraction '
-            'WHERE f.sample = %s '
-                'AND nl.annulled = TRUE',
-            (self.id,))
-        annulled_lines = cursor.fetchone()[0]
-        if annulled_lines > 0:
-            cursor.execute('SELECT COUNT(*) '
-                'FROM "' + NotebookLine._table + '" nl '
-                    'INNER JOIN "' + Service._table + '" s '
-                    'ON s.id = nl.service '
-                    'INNER JOIN "' + Fraction._table + '" f '
-                    'ON f.id = s.fraction '
-                'WHERE f.sample = %s',
-                (self.id,))
-            if cursor.fetchone()[0] == annulled_lines:
-                return 'annulled'
-        if self.laboratory_end_date:
+        if (values['_annulled_lines'] > 0 and
+                values['_lines'] == values['_annulled_lines']):
+            return 'annulled'
+        if values['laboratory_end_date']:
             return 'lab_pending_acceptance'
-        if self.laboratory_start_date:
-            cursor.execute('SELECT COUNT(*) '
-                'FROM "' + NotebookLine._table + '" nl '
-                    'INNER JOIN "' + Service._table + '" s '
-                    'ON s.id = nl.service '
-                    'INNER JOIN "' + Fraction._table + '" f '
-                    'ON f.id = s.fraction '
-                'WHERE f.sample = %s '
-                    'AND nl.report = TRUE '
-                    'AND nl.annulled = FALSE '
-                    'AND nl.end_date IS NOT NULL',
-                (self.id,))
-            if cursor.fetchone()[0] > 0:
+        if values['laboratory_start_date']:
+            if values['_ended_lines'] > 0:
                 return 'in_lab'
             return 'planned'
-        if self.confirmation_date:
+        if values['confirmation_date']:
             return 'pending_planning'
-        cursor.execute('SELECT COUNT(*) '
-            'FROM "' + Service._table + '" s '
-                'INNER JOIN "' + Fraction._table + '" f '
-                'ON f.id = s.fraction '
-            'WHERE f.sample = %s '
-                'AND s.annulled = TRUE',
-            (self.id,))
-        annulled_services = cursor.fetchone()[0]
-        if annulled_services > 0:
-            cursor.execute('SELECT COUNT(*) '
-                'FROM "' + Service._table + '" s '
-                    'INNER JOIN "' + Fraction._table + '" f '
-                    'ON f.id = s.fraction '
-                'WHERE f.sample = %s',
-                (self.id,))
-            if cursor.fetchone()[0] == annulled_services:
-                return 'annulled'
+        if (values['_annulled_services'] > 0 and
+                values['_services'] == values['_annulled_services']):
+            return 'annulled'
         return 'draft'
 
+    @classmethod
+    def _update_samples_columns(cls, to_update):
+        """ Apply {field: [(sample_id, value), ...]} with one UPDATE
+            per changed column
+        """
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        if not to_update:
+            return
+        ids = set()
+        for field, values in to_update.items():
+            ids.update(x[0] for x in values)
+            sql_type = cls._fields[field].sql_type().base
+            for sub_values in grouped_slice(values):
+                sub_values = list(sub_values)
+                cursor.execute('UPDATE "' + cls._table + '" s '
+                    'SET "' + field + '" = v.value::' + sql_type + ', '
+                        'write_date = CURRENT_TIMESTAMP, '
+                        'write_uid = %s '
+                    'FROM (VALUES ' +
+                        ', '.join(['(%s, %s)'] * len(sub_values)) +
+                        ') AS v (id, value) '
+                    'WHERE s.id = v.id',
+                    [transaction.user] +
+                    [x for pair in sub_values for x in pair])
+        clean_transaction_cache(cls, ids)
+
+    def _get_origin_default_dates(self):
+        ''' Used on Manage services context
+            Sample dates modifier based on origin.
+            Extend this method for use cases where the sample
+            is not part of an entry.
+        '''
+        res = {}
+        # Set confirmation date to None for draft and pending entries
+        if self.entry and self.entry.state != 'ongoing':
+            res['confirmation_date'] = None
+        return res
+
     def update_qty_lines(self):
         save = False
         qty = self._get_qty_lines_pending()
@@ -7887,9 +7886,7 @@ class Referral(ModelSQL, ModelView):
         to_addrs = list(set(to_addrs))
         success = False
         try:
-            server = get_smtp_server()
-            server.sendmail(from_addr, to_addrs, msg.as_string())
-            server.quit()
+            send_mail(from_addr, to_addrs, msg.as_string())
             success = True
         except Exception:
             logger.error(
@@ -0,0 +1,105 @@
+# This file is part of lims module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import unittest
+from types import SimpleNamespace
+
+from trytond.modules.lims.control_tendency import check_rule, \
+    WestgardEvaluator
+
+
+class ControlRulesTestCase(unittest.TestCase):
+    'Test control tendency rules'
+
+    def test_check_rule_total(self):
+        'Test a rule needs total results'
+        self.assertFalse(check_rule([20, 20], 12, 8, 2, 3))
+        self.assertTrue(check_rule([10, 20, 20], 12, 8, 2, 3))
+
+    def test_check_rule_parameters(self):
+        'Test results on the parameters are not out of control'
+        self.assertFalse(check_rule([12, 12, 12], 12, 8, 2, 3))
+        self.assertTrue(check_rule([12.1, 12.1, 12], 12, 8, 2, 3))
+        self.assertFalse(check_rule([8, 8, 8], 12, 8, 2, 3))
+        self.assertTrue(check_rule([8, 7.9, 7.9], 12, 8, 2, 3))
+
+    def test_check_rule_occurrences(self):
+        'Test the occurrences must be consecutive and on the same side'
+        self.assertTrue(check_rule([10, 12.1, 12.1], 12, 8, 2, 3))
+        self.assertFalse(check_rule([10, 10, 12.1], 12, 8, 2, 3))
+        self.assertFalse(check_rule([12.1, 10, 12.1], 12, 8, 2, 3))
+        self.assertFalse(check_rule([12.1, 7.9, 12.1], 12, 8, 2, 3))
+        self.assertTrue(check_rule([7.9, 7.9, 12.1], 12, 8, 2, 3))
+
+    def test_check_rule_last_results(self):
+        'Test only the last total results are checked'
+        self.assertFalse(check_rule([12.1, 12.1, 10, 10, 10], 12, 8, 2, 3))
+        self.assertTrue(check_rule([10, 10, 10, 12.1, 12.1], 12, 8, 2, 3))
+
+    def test_check_rule_all_occurrences(self):
+        'Test a rule where occurrences equals total'
+        self.assertTrue(check_rule([10.1] * 8, 10, 10, 8, 8))
+        self.assertTrue(check_rule([9.9] * 8, 10, 10, 8, 8))
+        self.assertFalse(check_rule([10.1] * 7 + [10], 10, 10, 8, 8))
+        self.assertFalse(check_rule([10] + [10.1] * 7, 10, 10, 8, 8))
+        self.assertFalse(check_rule([10.1] * 4 + [9.9] * 4, 10, 10, 8, 8))
+
+    def get_evaluator(self):
+        tendency = SimpleNamespace(mean=10.0, one_sd_adj=1.0,
+            two_sd_adj=2.0, three_sd_adj=3.0)
+        return WestgardEvaluator(tendency)
+
+    def add_results(self, results):
+        evaluator = self.get_evaluator()
+        return [evaluator.add_result(r) for r in results]
+
+    def test_rule_4(self):
+        'Test 1 result beyond the mean +/- 3 SD'
+        self.assertEqual(self.add_results([13]), [['']])
+        self.assertEqual(self.add_results([13.1]), [['4']])
+        self.assertEqual(self.add_results([7]), [['']])
+        self.assertEqual(self.add_results([6.9]), [['4']])
+
+    def test_rule_3(self):
+        'Test 2 of 3 results beyond the mean +/- 2 SD'
+        self.assertEqual(self.add_results([10, 12.5, 12.5]),
+            [[''], [''], ['3']])
+        self.assertEqual(self.add_results([10, 7.5, 7.5]),
+            [[''], [''], ['3']])
+        self.assertEqual(self.add_results([10, 12, 12]),
+            [[''], [''], ['']])
+        self.assertEqual(self.add_results([12.5, 10, 12.5]),
+            [[''], [''], ['']])
+
+    def test_rule_2(self):
+        'Test 4 of 5 results beyond the mean +/- 1 SD'
+        self.assertEqual(self.add_results([10, 11.5, 11.5, 11.5, 11.5])[-1],
+            ['2'])
+        self.assertEqual(self.add_results([10, 8.5, 8.5, 8.5, 8.5])[-1],
+            ['2'])
+        self.assertEqual(self.add_results([10, 10, 11.5, 11.5, 11.5])[-1],
+            [''])
+        self.assertEqual(self.add_results([10, 11, 11, 11, 11])[-1],
+            [''])
+
+    def test_rule_1(self):
+        'Test 8 results on the same side of the mean'
+        results = self.add_results([10.5] * 8)
+        self.assertEqual(results[-2], [''])
+        self.assertEqual(results[-1], ['1'])
+        self.assertEqual(self.add_results([9.5] * 8)[-1], ['1'])
+        self.assertEqual(self.add_results([10] + [10.5] * 7)[-1], [''])
+
+    def test_rules_combined(self):
+        'Test a result may break several rules'
+        self.assertEqual(
+            self.add_results([10.5] * 4 + [11.5] + [12.5] * 2 + [13.5])[-1],
+            ['4', '3', '2', '1'])
+
+    def test_window(self):
+        'Test the evaluator only keeps the results the rules look at'
+        evaluator = self.get_evaluator()
+        for result in [13.5] * 3 + [10.5] * 8:
+            evaluator.add_result(result)
+        self.assertEqual(list(evaluator.window), [10.5] * 8)
+        self.assertEqual(evaluator.add_result(10.5), ['1'])
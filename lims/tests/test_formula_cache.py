@@ -0,0 +1,69 @@
+# This file is part of lims module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import unittest
+
+from trytond.modules.lims.formula_cache import FormulaCache, \
+    compile_formula, formula_cache_info, clear_formula_cache
+
+
+class CountingFormulaCache(FormulaCache):
+    'FormulaCache that records the formulas it compiles'
+
+    def __init__(self, size_limit):
+        super().__init__(size_limit)
+        self.compiled = []
+
+    def compile(self, formula):
+        self.compiled.append(formula)
+        return object()
+
+
+class FormulaCacheTestCase(unittest.TestCase):
+    'Test formula cache'
+
+    def test_counters(self):
+        'Test the hit/miss counters'
+        cache = CountingFormulaCache(10)
+        first = cache.get('A1 + 1')
+        self.assertIs(cache.get('A1 + 1'), first)
+        self.assertIs(cache.get(' =A1 + 1 '), first)
+        cache.get('A1 + 2')
+        self.assertEqual(cache.compiled, ['=A1 + 1', '=A1 + 2'])
+        self.assertEqual(cache.info(), {
+                'hits': 2,
+                'misses': 2,
+                'size': 2,
+                'size_limit': 10,
+                })
+
+    def test_eviction(self):
+        'Test the oldest formula is evicted at the size limit'
+        cache = CountingFormulaCache(2)
+        for formula in ['A1', 'B1', 'C1']:
+            cache.get(formula)
+        self.assertEqual(cache.info()['size'], 2)
+
+        cache.get('A1')
+        cache.get('C1')
+        self.assertEqual(cache.compiled, ['=A1', '=B1', '=C1', '=A1'])
+        self.assertEqual(cache.info(), {
+                'hits': 1,
+                'misses': 4,
+                'size': 2,
+                'size_limit': 2,
+                })
+
+    def test_clear(self):
+        'Test clear_formula_cache resets the counters and the size'
+        clear_formula_cache()
+        function = compile_formula('=A1 + 1')
+        self.assertIs(compile_formula('A1 + 1'), function)
+        info = formula_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']),
+            (1, 1, 1))
+
+        clear_formula_cache()
+        info = formula_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']),
+            (0, 0, 0))
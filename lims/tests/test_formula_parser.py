@@ -0,0 +1,80 @@
+# This file is part of lims module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import unittest
+
+from trytond.tests.test_tryton import activate_module, with_transaction
+from trytond.exceptions import UserError
+from trytond.i18n import gettext
+from trytond.modules.lims.formula_parser import FormulaParser
+
+
+FORMULAS = [
+    ('1 + 2 * 3', {}, 7.0),
+    ('(1 + 2) * 3', {}, 9.0),
+    ('2 ^ 3 ^ 2', {}, 64.0),
+    ('-2 ^ 2', {}, 4.0),
+    ('- (3 - 5) * 2', {}, 4.0),
+    ('10 / 4 / 5', {}, 0.5),
+    ('.5 + 1.', {}, 1.5),
+    ('  3 *\t( 4 + 1 )\n', {}, 15.0),
+    ('{A} * {B} - {C}', {'{A}': 2.5, '{B}': '4', '{C}': 1}, 9.0),
+    ('{A} / {B}', {'{A}': 3, '{B}': 0}, 0.0),
+    # a division by zero gives 0 for the whole product, the string
+    # evaluator stopped there and failed on the next operator
+    ('{A} / {B} * {C}', {'{A}': 3, '{B}': 0, '{C}': 2}, 0.0),
+    ('{A} + {B} + {C}', {'{A}': 1, '{B}': '', '{C}': 'n/d'}, 1.0),
+    ('pi * {R} ^ 2', {'{R}': 3}, 28.274333882308138),
+    ('e ^ 2 - 1', {}, 6.38905609893065),
+    ('{A.x} * 2 + {B_1}', {'{A.x}': 5, '{B_1}': 1}, 11.0),
+    ('LOG10({A}) * 2', {'{A}': 50}, 3.397940008672037),
+    ('LOG10(1000) + LOG10({B})', {'{B}': 0.01}, 1.0),
+    ('1 - LOG10({A} * 10)', {'{A}': 7}, -0.845098040014257),
+    ]
+
+ERRORS = [
+    ('1 + ', {}, 'lims.msg_unexpected_end', {}),
+    ('(1 + 2', {}, 'lims.msg_closing_parenthesis', {'index': '6'}),
+    ('1..2', {}, 'lims.msg_extra_period', {'index': '2'}),
+    ('1 + 2)', {}, 'lims.msg_unexpected_character',
+        {'character': ')', 'index': '5'}),
+    ('3 * $', {}, 'lims.msg_unrecognized_variable', {'variable': ''}),
+    ('{D} + 1', {'{A}': 1}, 'lims.msg_unrecognized_variable',
+        {'variable': 'D'}),
+    ('', {}, 'lims.msg_unexpected_end', {}),
+    ('{pi} * 2', {'{pi}': 3}, 'lims.msg_variable_redefine',
+        {'variable': '{pi}'}),
+    ]
+
+
+class FormulaParserTestCase(unittest.TestCase):
+    'Test FormulaParser'
+
+    @classmethod
+    def setUpClass(cls):
+        activate_module('lims')
+
+    @with_transaction()
+    def test_values(self):
+        'Test the values of formulas'
+        for formula, variables, expected in FORMULAS:
+            value = FormulaParser(formula, variables).getValue()
+            self.assertAlmostEqual(value, expected, msg=formula)
+
+    @with_transaction()
+    def test_values_cached(self):
+        'Test a cached formula is evaluated with the new variables'
+        for a, expected in [(1, 4.0), (2, 7.0), (30, 91.0)]:
+            variables = {'{A}': a, '{B}': a + 1}
+            self.assertAlmostEqual(
+                FormulaParser('{A} * 2 + {B}', variables).getValue(),
+                expected)
+
+    @with_transaction()
+    def test_errors(self):
+        'Test the errors of invalid formulas'
+        for formula, variables, message, kwargs in ERRORS:
+            with self.assertRaises(UserError) as error:
+                FormulaParser(formula, variables).getValue()
+            self.assertEqual(str(error.exception),
+                gettext(message, **kwargs), msg=formula)
@@ -8,6 +8,13 @@ import trytond.tests.test_tryton
 from trytond.tests.test_tryton import ModuleTestCase
 from trytond.tests.test_tryton import doctest_teardown
 from trytond.tests.test_tryton import doctest_checker
+from trytond.modules.lims.tests.test_mail import SMTPTransportTestCase
+from trytond.modules.lims.tests.test_formula_parser import \
+    FormulaParserTestCase
+from trytond.modules.lims.tests.test_control_tendency import \
+    ControlRulesTestCase
+from trytond.modules.lims.tests.test_formula_cache import \
+    FormulaCacheTestCase
 
 
 class LimsTestCase(ModuleTestCase):
@@ -19,6 +26,14 @@ def suite():
     suite = trytond.tests.test_tryton.suite()
     suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
             LimsTestCase))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+            SMTPTransportTestCase))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+            FormulaParserTestCase))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+            ControlRulesTestCase))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+            FormulaCacheTestCase))
     suite.addTests(doctest.DocFileSuite('scenario_lims.rst',
             tearDown=doctest_teardown, encoding='utf-8',
             checker=doctest_checker,
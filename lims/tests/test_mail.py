@@ -0,0 +1,164 @@
+# This file is part of lims module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import smtplib
+import unittest
+
+from trytond.modules.lims.mail import SMTPTransport, send_mail
+
+
+class StubSMTPServer(object):
+    'Stand-in for smtplib.SMTP that records the messages it receives'
+
+    def __init__(self, fail_on=(), error=None):
+        self.messages = []
+        self.calls = 0
+        self.fail_on = set(fail_on)
+        self.error = error
+        self.closed = False
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        self.calls += 1
+        if self.calls in self.fail_on and self.error:
+            raise self.error
+        if self.closed or self.calls in self.fail_on:
+            self.closed = True
+            raise smtplib.SMTPServerDisconnected('Connection dropped')
+        self.messages.append((from_addr, to_addrs, msg))
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class StubConnect(object):
+    'Connection factory that hands out the given servers in order'
+
+    def __init__(self, *servers):
+        self.servers = list(servers)
+        self.opened = []
+
+    def __call__(self):
+        if self.servers:
+            server = self.servers.pop(0)
+        else:
+            server = StubSMTPServer()
+        self.opened.append(server)
+        return server
+
+    @property
+    def messages(self):
+        return [m[2] for s in self.opened for m in s.messages]
+
+
+class SMTPTransportTestCase(unittest.TestCase):
+    'Test SMTP transport'
+
+    def send(self, transport, count):
+        return [transport.send('lims@example.com', ['to@example.com'],
+                'msg %s' % i) for i in range(count)]
+
+    def test_connection_reuse(self):
+        'Test messages share one connection'
+        connect = StubConnect()
+        transport = SMTPTransport(max_messages=10, connect=connect)
+
+        self.assertEqual(self.send(transport, 3), [True] * 3)
+        self.assertEqual(len(connect.opened), 1)
+        self.assertEqual(connect.messages, ['msg 0', 'msg 1', 'msg 2'])
+        self.assertFalse(connect.opened[0].closed)
+
+        transport.close()
+        self.assertTrue(connect.opened[0].closed)
+
+    def test_max_messages_rollover(self):
+        'Test the connection is renewed after max_messages'
+        connect = StubConnect()
+        transport = SMTPTransport(max_messages=2, connect=connect)
+
+        self.assertEqual(self.send(transport, 5), [True] * 5)
+        self.assertEqual([len(s.messages) for s in connect.opened],
+            [2, 2, 1])
+        self.assertEqual([s.closed for s in connect.opened],
+            [True, True, False])
+
+    def test_reconnect_after_drop(self):
+        'Test a dropped connection is replaced for the next message'
+        connect = StubConnect(StubSMTPServer(fail_on=[2]))
+        transport = SMTPTransport(max_messages=10, retries=1,
+            connect=connect)
+
+        self.assertEqual(self.send(transport, 3), [True] * 3)
+        self.assertEqual(len(connect.opened), 2)
+        self.assertEqual(connect.messages, ['msg 0', 'msg 1', 'msg 2'])
+        self.assertEqual(len(connect.opened[0].messages), 1)
+
+    def test_retry_queue(self):
+        'Test undelivered messages are retried up to retries times'
+        servers = [StubSMTPServer(fail_on=[1]) for _ in range(3)]
+        connect = StubConnect(*servers)
+        transport = SMTPTransport(retries=2, connect=connect)
+
+        self.assertFalse(transport.send('lims@example.com',
+                ['to@example.com'], 'msg'))
+        self.assertEqual(len(connect.opened), 3)
+        self.assertEqual(len(transport.queue), 0)
+
+        # The retry queue delivers on the next connection
+        servers = [StubSMTPServer(fail_on=[1]), StubSMTPServer()]
+        connect = StubConnect(*servers)
+        transport = SMTPTransport(retries=2, connect=connect)
+
+        self.assertTrue(transport.send('lims@example.com',
+                ['to@example.com'], 'msg'))
+        self.assertEqual(connect.messages, ['msg'])
+        self.assertEqual(len(transport.queue), 0)
+
+    def test_reply_codes(self):
+        'Test only temporary replies are retried'
+        error = smtplib.SMTPSenderRefused(451, b'Try again later',
+            'lims@example.com')
+        connect = StubConnect(StubSMTPServer(fail_on=[1], error=error))
+        transport = SMTPTransport(retries=2, connect=connect)
+
+        self.assertTrue(transport.send('lims@example.com',
+                ['to@example.com'], 'msg'))
+        self.assertEqual(len(connect.opened), 2)
+        self.assertEqual(connect.messages, ['msg'])
+
+        for error in [
+                smtplib.SMTPSenderRefused(550, b'Sender refused',
+                    'lims@example.com'),
+                smtplib.SMTPDataError(554, b'Message rejected'),
+                smtplib.SMTPRecipientsRefused(
+                    {'to@example.com': (550, b'Unknown user')}),
+                ]:
+            connect = StubConnect(StubSMTPServer(fail_on=[1], error=error))
+            transport = SMTPTransport(retries=2, connect=connect)
+
+            self.assertFalse(transport.send('lims@example.com',
+                    ['to@example.com'], 'msg 0'), msg=repr(error))
+            self.assertEqual(len(transport.queue), 0)
+            # The connection is kept for the next message
+            self.assertTrue(transport.send('lims@example.com',
+                    ['to@example.com'], 'msg 1'))
+            self.assertEqual(len(connect.opened), 1)
+            self.assertEqual(connect.messages, ['msg 1'])
+
+    def test_send_mail_transport(self):
+        'Test send_mail uses the transport opened in the thread'
+        connect = StubConnect()
+        with SMTPTransport(connect=connect):
+            send_mail('lims@example.com', ['to@example.com'], 'msg 0')
+            send_mail('lims@example.com', ['to@example.com'], 'msg 1')
+        self.assertEqual(len(connect.opened), 1)
+        self.assertEqual(connect.messages, ['msg 0', 'msg 1'])
+        self.assertTrue(connect.opened[0].closed)
+
+        connect = StubConnect(*[StubSMTPServer(fail_on=[1])
+                for _ in range(3)])
+        with SMTPTransport(retries=2, connect=connect):
+            with self.assertRaises(smtplib.SMTPException):
+                send_mail('lims@example.com', ['to@example.com'], 'msg')
@@ -17,14 +17,25 @@ from trytond.wizard import Wizard, StateTransition, StateView, Button
 from trytond.pool import Pool, PoolMeta
 from trytond.pyson import Eval, Bool, Or, If
 from trytond.transaction import Transaction
-from trytond.tools import get_smtp_server
 from trytond.config import config
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
+from trytond.modules.lims.mail import SMTPTransport, send_mail
 
 logger = logging.getLogger(__name__)
 
 
+def service_origin_id(alias=None):
+    '''
+    Return the SQL expression of the service id of the invoice lines
+    aliased as alias, that is covered by the service origin index when
+    used with the LIKE 'lims.service,%' condition
+    '''
+    origin = alias + '.origin' if alias else 'origin'
+    return ('NULLIF(SPLIT_PART(' + origin + ', \',\', 2), \'\')'
+        '::INTEGER')
+
+
 class Invoice(metaclass=PoolMeta):
     __name__ = 'account.invoice'
 
@@ -111,7 +122,7 @@ class Invoice(metaclass=PoolMeta):
             session_id, _, _ = SendOfInvoice.create()
             send_of_invoice = SendOfInvoice(session_id)
             with Transaction().set_context(active_ids=[invoice.id for invoice
-                    in invoices]):
+                    in invoices]), SMTPTransport():
                 send_of_invoice.transition_start()
         tt = round(time() - t1, 2)  # DEBUG
         logger.info('Cron - Send Of Invoice:END:Finalizado en %s segundos.',
@@ -212,9 +223,7 @@ class Invoice(metaclass=PoolMeta):
         to_addrs = list(set(to_addrs))
         success = False
         try:
-            server = get_smtp_server()
-            server.sendmail(from_addr, to_addrs, msg.as_string())
-            server.quit()
+            send_mail(from_addr, to_addrs, msg.as_string())
             success = True
         except Exception:
             logger.error('Unable to deliver mail for invoice %s', self.number)
@@ -281,6 +290,16 @@ class InvoiceLine(metaclass=PoolMeta):
             Bool(Eval('lims_service_sample')))
         cls.product.depends.append('lims_service_sample')
 
+    @classmethod
+    def __register__(cls, module_name):
+        cursor = Transaction().connection.cursor()
+        super().__register__(module_name)
+        cursor.execute('CREATE INDEX IF NOT EXISTS '
+            '"' + cls._table + '_lims_service_origin_index" '
+            'ON "' + cls._table + '" '
+            '((' + service_origin_id() + ')) '
+            'WHERE origin LIKE \'lims.service,%\'')
+
     @classmethod
     def delete(cls, lines):
         if not Transaction().context.get('delete_service', False):
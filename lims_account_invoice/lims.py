@@ -12,8 +12,10 @@ from trytond.report import Report
 from trytond.pool import Pool, PoolMeta
 from trytond.pyson import PYSONEncoder
 from trytond.transaction import Transaction
+from trytond.tools import grouped_slice
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
+from .invoice import service_origin_id
 
 
 class FractionType(metaclass=PoolMeta):
@@ -45,9 +47,10 @@ class Entry(metaclass=PoolMeta):
         Fraction = pool.get('lims.fraction')
         Sample = pool.get('lims.sample')
 
-        result = {}
-        for e in entries:
-            cursor.execute('SELECT MAX(rd.release_date) '
+        result = dict((e.id, None) for e in entries)
+        for sub_ids in grouped_slice(list(result.keys())):
+            sub_ids = list(sub_ids)
+            cursor.execute('SELECT s.entry, MAX(rd.release_date) '
                 'FROM "' + ResultsVersion._table + '" rv '
                     'INNER JOIN "' + ResultsDetail._table + '" rd '
                     'ON rv.id = rd.report_version '
@@ -59,12 +62,12 @@ class Entry(metaclass=PoolMeta):
                     'ON f.id = n.fraction '
                     'INNER JOIN "' + Sample._table + '" s '
                     'ON s.id = f.sample '
-                'WHERE s.entry = %s '
+                'WHERE s.entry IN (' +
+                    ', '.join(['%s'] * len(sub_ids)) + ') '
                     'AND rd.state = \'released\' '
-                    'AND rd.type != \'preliminary\'',
-                (str(e.id),))
-            result[e.id] = cursor.fetchone()[0]
-
+                    'AND rd.type != \'preliminary\' '
+                'GROUP BY s.entry', sub_ids)
+            result.update(cursor.fetchall())
         return result
 
     @classmethod
@@ -76,30 +79,23 @@ class Entry(metaclass=PoolMeta):
         Service = pool.get('lims.service')
         InvoiceLine = pool.get('account.invoice.line')
 
-        result = {}
-        for e in entries:
-            result[e.id] = 0
-
-            cursor.execute('SELECT srv.id '
+        result = dict((e.id, 0) for e in entries)
+        for sub_ids in grouped_slice(list(result.keys())):
+            sub_ids = list(sub_ids)
+            cursor.execute('SELECT s.entry, COUNT(il.id) '
                 'FROM "' + Service._table + '" srv '
                     'INNER JOIN "' + Fraction._table + '" f '
                     'ON f.id = srv.fraction '
                     'INNER JOIN "' + Sample._table + '" s '
                     'ON s.id = f.sample '
-                'WHERE s.entry = %s',
-                (str(e.id),))
-            services_ids = [x[0] for x in cursor.fetchall()]
-            if not services_ids:
-                continue
-
-            origins = '\', \''.join(['lims.service,' + str(s)
-                for s in services_ids])
-            cursor.execute('SELECT COUNT(*) '
-                'FROM "' + InvoiceLine._table + '" '
-                'WHERE origin IN (\'' + origins + '\') '
-                    'AND invoice IS NULL')
-            result[e.id] = cursor.fetchone()[0]
-
+                    'INNER JOIN "' + InvoiceLine._table + '" il '
+                    'ON il.origin LIKE \'lims.service,%%\' '
+                    'AND ' + service_origin_id('il') + ' = srv.id '
+                'WHERE s.entry IN (' +
+                    ', '.join(['%s'] * len(sub_ids)) + ') '
+                    'AND il.invoice IS NULL '
+                'GROUP BY s.entry', sub_ids)
+            result.update(cursor.fetchall())
         return result
 
     @classmethod
@@ -344,44 +340,24 @@ class OpenEntriesReadyForInvoicing(Wizard):
         Fraction = pool.get('lims.fraction')
         Sample = pool.get('lims.sample')
 
-        cursor.execute('SELECT origin '
-            'FROM "' + InvoiceLine._table + '" '
-            'WHERE origin LIKE \'lims.service,%\' '
-                'AND invoice IS NULL')
-        invoiced_services = [x[0][13:] for x in cursor.fetchall()]
-        if not invoiced_services:
-            return []
-        services_ids = ', '.join(s for s in invoiced_services)
-
-        cursor.execute('SELECT DISTINCT(s.entry) '
-            'FROM "' + NotebookLine._table + '" nl '
+        lines = ('FROM "' + InvoiceLine._table + '" il '
+                'INNER JOIN "' + NotebookLine._table + '" nl '
+                'ON nl.service = ' + service_origin_id('il') + ' '
                 'INNER JOIN "' + Notebook._table + '" n '
                 'ON n.id = nl.notebook '
                 'INNER JOIN "' + Fraction._table + '" f '
                 'ON f.id = n.fraction '
                 'INNER JOIN "' + Sample._table + '" s '
                 'ON s.id = f.sample '
-            'WHERE nl.service IN (' + services_ids + ')')
-        invoiced_entries = [x[0] for x in cursor.fetchall()]
-
-        cursor.execute('SELECT DISTINCT(s.entry) '
-            'FROM "' + NotebookLine._table + '" nl '
-                'INNER JOIN "' + Notebook._table + '" n '
-                'ON n.id = nl.notebook '
-                'INNER JOIN "' + Fraction._table + '" f '
-                'ON f.id = n.fraction '
-                'INNER JOIN "' + Sample._table + '" s '
-                'ON s.id = f.sample '
-            'WHERE nl.service IN (' + services_ids + ') '
-                'AND (nl.annulled = FALSE '
+            'WHERE il.origin LIKE \'lims.service,%\' '
+                'AND il.invoice IS NULL ')
+        cursor.execute('SELECT s.entry ' + lines +
+            'EXCEPT '
+            'SELECT s.entry ' + lines +
+                'AND nl.annulled = FALSE '
                 'AND nl.report = TRUE '
-                'AND nl.results_report IS NULL)')
-        pending_entries = [x[0] for x in cursor.fetchall()]
-
-        entries = list(set(invoiced_entries) - set(pending_entries))
-        if not entries:
-            return []
-        return entries
+                'AND nl.results_report IS NULL')
+        return [x[0] for x in cursor.fetchall()]
 
     def do_open_(self, action):
         entries_ids = self._get_entries_ready_for_invoicing()
@@ -412,25 +388,20 @@ class OpenLinesPendingInvoicing(Wizard):
 
         lines_ids = []
         entries = Entry.browse(Transaction().context['active_ids'])
-        for entry in entries:
-            cursor.execute('SELECT srv.id '
+        for sub_ids in grouped_slice([e.id for e in entries]):
+            sub_ids = list(sub_ids)
+            cursor.execute('SELECT il.id '
                 'FROM "' + Service._table + '" srv '
                     'INNER JOIN "' + Fraction._table + '" f '
                     'ON f.id = srv.fraction '
                     'INNER JOIN "' + Sample._table + '" s '
                     'ON s.id = f.sample '
-                'WHERE s.entry = %s',
-                (str(entry.id),))
-            services_ids = [x[0] for x in cursor.fetchall()]
-            if not services_ids:
-                continue
-
-            origins = '\', \''.join(['lims.service,' + str(s)
-                for s in services_ids])
-            cursor.execute('SELECT id '
-                'FROM "' + InvoiceLine._table + '" '
-                'WHERE origin IN (\'' + origins + '\') '
-                    'AND invoice IS NULL')
+                    'INNER JOIN "' + InvoiceLine._table + '" il '
+                    'ON il.origin LIKE \'lims.service,%%\' '
+                    'AND ' + service_origin_id('il') + ' = srv.id '
+                'WHERE s.entry IN (' +
+                    ', '.join(['%s'] * len(sub_ids)) + ') '
+                    'AND il.invoice IS NULL', sub_ids)
             lines_ids.extend(x[0] for x in cursor.fetchall())
 
         action['pyson_domain'] = PYSONEncoder().encode([
@@ -16,7 +16,7 @@ from trytond.transaction import Transaction
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
 from trytond.config import config as tconfig
-from trytond.tools import get_smtp_server
+from trytond.modules.lims.mail import SMTPTransport, send_mail
 from trytond.modules.lims_tools.event_creator import EventCreator
 
 logger = logging.getLogger(__name__)
@@ -376,22 +376,23 @@ class AdministrativeTask(Workflow, ModelSQL, ModelView):
 
         config_ = Config(1)
 
-        for task in tasks:
-            to_addrs = []
-            if task.responsible.email:
-                to_addrs.append(task.responsible.email)
-            if not to_addrs:
-                logger.error("Missing address for '%s' to send email",
-                    task.responsible.rec_name)
-                continue
-            if task.scheduled:
-                continue
-
-            subject = str('%s (%s)' % (config_.email_responsible_subject,
-                task.number)).strip()
-            body = task._get_mail_body()
-            msg = cls._create_msg(from_addr, to_addrs, subject, body)
-            cls._send_msg(from_addr, to_addrs, msg, task.number)
+        with SMTPTransport():
+            for task in tasks:
+                to_addrs = []
+                if task.responsible.email:
+                    to_addrs.append(task.responsible.email)
+                if not to_addrs:
+                    logger.error("Missing address for '%s' to send email",
+                        task.responsible.rec_name)
+                    continue
+                if task.scheduled:
+                    continue
+
+                subject = str('%s (%s)' % (config_.email_responsible_subject,
+                    task.number)).strip()
+                body = task._get_mail_body()
+                msg = cls._create_msg(from_addr, to_addrs, subject, body)
+                cls._send_msg(from_addr, to_addrs, msg, task.number)
 
     @classmethod
     def send_email_update(cls, tasks):
@@ -405,24 +406,25 @@ class AdministrativeTask(Workflow, ModelSQL, ModelView):
 
         config_ = Config(1)
 
-        for task in tasks:
-            to_addrs = []
-            if task.responsible.email:
-                to_addrs.append(task.responsible.email)
-            if task.create_uid.email:
-                to_addrs.append(task.create_uid.email)
-            for user in task.notified_users:
-                to_addrs.append(user.email)
-            if not to_addrs:
-                logger.error("Missing address for '%s' to send email",
-                    task.responsible.rec_name)
-                continue
-
-            subject = str('%s (%s)' % (config_.email_update_subject,
-                task.number)).strip()
-            body = task._get_mail_body()
-            msg = cls._create_msg(from_addr, to_addrs, subject, body)
-            cls._send_msg(from_addr, to_addrs, msg, task.number)
+        with SMTPTransport():
+            for task in tasks:
+                to_addrs = []
+                if task.responsible.email:
+                    to_addrs.append(task.responsible.email)
+                if task.create_uid.email:
+                    to_addrs.append(task.create_uid.email)
+                for user in task.notified_users:
+                    to_addrs.append(user.email)
+                if not to_addrs:
+                    logger.error("Missing address for '%s' to send email",
+                        task.responsible.rec_name)
+                    continue
+
+                subject = str('%s (%s)' % (config_.email_update_subject,
+                    task.number)).strip()
+                body = task._get_mail_body()
+                msg = cls._create_msg(from_addr, to_addrs, subject, body)
+                cls._send_msg(from_addr, to_addrs, msg, task.number)
 
     def _get_mail_body(self):
         pool = Pool()
@@ -493,9 +495,7 @@ class AdministrativeTask(Workflow, ModelSQL, ModelView):
         to_addrs = list(set(to_addrs))
         success = False
         try:
-            server = get_smtp_server()
-            server.sendmail(from_addr, to_addrs, msg.as_string())
-            server.quit()
+            send_mail(from_addr, to_addrs, msg.as_string())
             success = True
         except Exception:
             logger.error(
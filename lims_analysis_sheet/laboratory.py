@@ -2,12 +2,12 @@
 # The COPYRIGHT file at the top level of this repository contains
 # the full copyright notices and license terms.
 from datetime import datetime, date
-import operator
 
 from trytond.model import ModelSQL, ModelView, fields
 from trytond.pool import Pool, PoolMeta
 from trytond.transaction import Transaction
 from trytond.pyson import Eval, Bool, And
+from trytond.modules.lims.laboratory import compile_rule_condition
 
 
 class LabDevice(metaclass=PoolMeta):
@@ -473,43 +473,8 @@ class NotebookRuleCondition(metaclass=PoolMeta):
     __name__ = 'lims.rule.condition'
 
     def eval_sheet_condition(self, line):
-        path = self.field.split('.')
-        field = path.pop(0)
-        try:
-            value = getattr(line, field)
-            while path:
-                field = path.pop(0)
-                value = getattr(value, field)
-        except AttributeError:
-            return False
-
-        operator_func = {
-            'eq': operator.eq,
-            'ne': operator.ne,
-            'gt': operator.gt,
-            'ge': operator.ge,
-            'lt': operator.lt,
-            'le': operator.le,
-            'in': lambda v, l: v in l,
-            'not_in': lambda v, l: v not in l,
-            }
-
-        if self.condition in ('in', 'not_in'):
-            values = [str(x).strip() for x in self.value.split(',')]
-            try:
-                result = operator_func[self.condition](
-                    float(value), [float(x) for x in values])
-            except (TypeError, ValueError):
-                result = (value and operator_func[self.condition](
-                    str(value), [str(x) for x in values]) or False)
-        else:
-            try:
-                result = operator_func[self.condition](
-                    float(value), float(self.value))
-            except (TypeError, ValueError):
-                result = (value and operator_func[self.condition](
-                    str(value), str(self.value)) or False)
-        return result
+        return compile_rule_condition(
+            self.field, self.condition, self.value)(line)
 
     def check_field(self):
         if not self.rule.analysis_sheet:
@@ -1324,11 +1324,11 @@ class EvaluateRules(Wizard):
                 ('compilation', '=', sheet.compilation.id),
                 ('notebook_line', '!=', None),
                 ])
+            rules_index = NotebookRule.get_rules_index(
+                [line.notebook_line.analysis.id for line in lines])
             for line in lines:
-                rules = NotebookRule.search([
-                    ('analysis', '=', line.notebook_line.analysis),
-                    ])
-                for rule in rules:
+                for rule in rules_index.get(
+                        line.notebook_line.analysis.id, []):
                     if rule.eval_sheet_condition(line):
                         rule.exec_sheet_action(line)
         return 'end'
@@ -19,6 +19,7 @@ from trytond.wizard import Wizard, StateTransition, StateView, StateAction, \
 from trytond.pool import Pool
 from trytond.pyson import PYSONEncoder, Eval, Bool, If
 from trytond.transaction import Transaction
+from trytond.tools import grouped_slice
 from trytond.report import Report
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
@@ -582,12 +583,33 @@ class AnalysisSheet(Workflow, ModelSQL, ModelView):
 
     order_date2 = order_date
 
+    @classmethod
+    def get_transfer_fields(cls, table_ids):
+        '''
+        Return the name and type of the columns of the interface tables
+        that are transferred to the result fields of the notebook lines,
+        as a dict {table id: {notebook line field: (name, type)}}
+        '''
+        Field = Pool().get('lims.interface.table.field')
+
+        result = dict((t, {}) for t in table_ids)
+        for sub_tables in grouped_slice(list(table_ids)):
+            fields_ = Field.search([
+                ('table', 'in', list(sub_tables)),
+                ('transfer_field', '=', True),
+                ('related_line_field.name', 'in',
+                    ['result', 'literal_result', 'result_modifier']),
+                ])
+            for field in fields_:
+                result[field.table.id].setdefault(
+                    field.related_line_field.name, (field.name, field.type))
+        return result
+
     @classmethod
     def get_fields(cls, sheets, names):
         cursor = Transaction().connection.cursor()
         pool = Pool()
         ModelData = pool.get('ir.model.data')
-        Field = pool.get('lims.interface.table.field')
         notebook_line = pool.get('lims.notebook.line').__table__()
 
         _ZERO = Decimal(0)
@@ -607,129 +629,169 @@ class AnalysisSheet(Workflow, ModelSQL, ModelView):
             'partial_analysys': {},
             'completion_percentage': {},
             }
+
+        # Sheets are grouped by the table of their compilation, so each
+        # count is one grouped query per table
+        tables = {}
         for s in sheets:
-            sql_table = Table(s.compilation.table.name)
+            tables.setdefault((s.compilation.table.id,
+                s.compilation.table.name), []).append(s)
+        transfer_fields = cls.get_transfer_fields(
+            [t[0] for t in tables.keys()])
+
+        for (table_id, table_name), table_sheets in tables.items():
+            sql_table = Table(table_name)
             sql_join = sql_table.join(notebook_line,
                 condition=sql_table.notebook_line == notebook_line.id)
-
-            cursor.execute(*sql_table.select(Count(Literal('*')),
-                where=((sql_table.compilation == s.compilation.id) &
-                    (sql_table.notebook_line != Null))))
-            total = cursor.fetchone()[0]
-
-            results = _ZERO
-            if s.state != 'draft':
-                table_id = s.compilation.table.id
-
-                result_field = None
-                result_column = Field.search([
-                    ('table', '=', table_id),
-                    ('transfer_field', '=', True),
-                    ('related_line_field.name', '=', 'result'),
-                    ])
-                if result_column:
-                    result_field = result_column[0].name
-                    result_field_type = result_column[0].type
-
-                literal_result_column = Field.search([
-                    ('table', '=', table_id),
-                    ('transfer_field', '=', True),
-                    ('related_line_field.name', '=', 'literal_result'),
-                    ])
-                literal_result_field = (literal_result_column and
-                    literal_result_column[0].name or None)
-
-                result_modifier_column = Field.search([
-                    ('table', '=', table_id),
-                    ('transfer_field', '=', True),
-                    ('related_line_field.name', '=', 'result_modifier'),
-                    ])
-                result_modifier_field = (result_modifier_column and
-                    result_modifier_column[0].name or None)
-
+            compilations = [s.compilation.id for s in table_sheets]
+
+            total = dict((c, 0) for c in compilations)
+            results = dict((c, _ZERO) for c in compilations)
+            urgent = set()
+            samples = dict((c, {}) for c in compilations)
+
+            for sub_compilations in grouped_slice(compilations):
+                sub_compilations = list(sub_compilations)
+                cursor.execute(*sql_table.select(sql_table.compilation,
+                    Count(Literal('*')),
+                    where=(sql_table.compilation.in_(sub_compilations) &
+                        (sql_table.notebook_line != Null)),
+                    group_by=[sql_table.compilation]))
+                total.update(cursor.fetchall())
+
+                cursor.execute(*sql_join.select(sql_table.compilation,
+                    where=(sql_table.compilation.in_(sub_compilations) &
+                        (notebook_line.urgent == Literal(True))),
+                    group_by=[sql_table.compilation]))
+                urgent.update(x[0] for x in cursor.fetchall())
+
+                cursor.execute(*sql_join.select(sql_table.compilation,
+                    notebook_line.notebook, notebook_line.analysis,
+                    where=sql_table.compilation.in_(sub_compilations)))
+                for compilation, notebook, analysis in cursor.fetchall():
+                    samples[compilation].setdefault(notebook, []).append(
+                        analysis)
+
+            not_draft = [s.compilation.id for s in table_sheets
+                if s.state != 'draft']
+            if not_draft:
+                table_fields = transfer_fields[table_id]
                 result_clause = Literal(False)
-                if result_field:
+                if 'result' in table_fields:
+                    result_field, result_field_type = table_fields['result']
                     if result_field_type == 'char':
                         result_clause |= (Coalesce(Column(sql_table,
                             result_field), '') != '')
                     else:
                         result_clause |= (Column(sql_table,
                             result_field) != Null)
-                if literal_result_field:
+                if 'literal_result' in table_fields:
                     result_clause |= (Coalesce(Column(sql_table,
-                        literal_result_field), '') != '')
-                if result_modifier_field:
+                        table_fields['literal_result'][0]), '') != '')
+                if 'result_modifier' in table_fields:
                     result_clause |= (Column(sql_table,
-                        result_modifier_field).in_(result_modifiers))
-
-                cursor.execute(*sql_join.select(Count(Literal('*')),
-                    where=(sql_table.compilation == s.compilation.id) & (
-                        (notebook_line.end_date != Null) |
-                        (sql_table.annulled == Literal(True)) |
-                        result_clause)))
-                results = cursor.fetchone()[0]
-
-            result['urgent'][s.id] = False
-            cursor.execute(*sql_join.select(Count(Literal('*')),
-                where=(sql_table.compilation == s.compilation.id) &
-                    (notebook_line.urgent == Literal(True))))
-            if cursor.fetchone()[0] > 0:
-                result['urgent'][s.id] = True
-
-            samples = {}
-            cursor.execute(*sql_join.select(notebook_line.notebook,
-                notebook_line.analysis,
-                where=sql_table.compilation == s.compilation.id))
-            for x in cursor.fetchall():
-                if x[0] not in samples:
-                    samples[x[0]] = []
-                samples[x[0]].append(x[1])
-            result['samples_qty'][s.id] = len(samples)
-
-            result['partial_analysys'][s.id] = False
-            template_analysis = [ta.analysis.id
-                for ta in s.template.analysis]
-            for k, v in samples.items():
-                if not all(x in v for x in template_analysis):
-                    result['partial_analysys'][s.id] = True
-                    break
-
-            result['completion_percentage'][s.id] = _ZERO
-            if total and results:
-                result['completion_percentage'][s.id] = Decimal(
-                    results / Decimal(total)
-                    ).quantize(Decimal(str(10 ** -digits)))
+                        table_fields['result_modifier'][0]).in_(
+                            result_modifiers))
+
+                for sub_compilations in grouped_slice(not_draft):
+                    cursor.execute(*sql_join.select(sql_table.compilation,
+                        Count(Literal('*')),
+                        where=(sql_table.compilation.in_(
+                            list(sub_compilations)) & (
+                            (notebook_line.end_date != Null) |
+                            (sql_table.annulled == Literal(True)) |
+                            result_clause)),
+                        group_by=[sql_table.compilation]))
+                    results.update(cursor.fetchall())
+
+            for s in table_sheets:
+                compilation = s.compilation.id
+                result['urgent'][s.id] = compilation in urgent
+                sheet_samples = samples[compilation]
+                result['samples_qty'][s.id] = len(sheet_samples)
+
+                result['partial_analysys'][s.id] = False
+                template_analysis = [ta.analysis.id
+                    for ta in s.template.analysis]
+                for k, v in sheet_samples.items():
+                    if not all(x in v for x in template_analysis):
+                        result['partial_analysys'][s.id] = True
+                        break
+
+                result['completion_percentage'][s.id] = _ZERO
+                if total[compilation] and results[compilation]:
+                    result['completion_percentage'][s.id] = Decimal(
+                        results[compilation] / Decimal(total[compilation])
+                        ).quantize(Decimal(str(10 ** -digits)))
 
         return result
 
     def get_interface(self, name):
         return self.compilation.interface.id
 
-    def get_out_of_ranges(self, name):
-        # TODO: improve perf
-        res = False
-        Column = Pool().get('lims.interface.column')
-        Data = Pool().get('lims.interface.data')
-        validation_column = Column.search([
-                                        ('interface','=',self.interface),
-                                        ('validation_column','=',True)
-                                        ])
-        if not len(validation_column):
-            return False
-        validation_column = validation_column[0].alias
-        with Transaction().set_context(
-                    lims_interface_table=self.compilation.table.id):
-                clause = [('compilation', '=', self.compilation.id)]
-                lines = Data.search(clause)
-                for line in lines:
-                    try:
-                        if getattr(line, validation_column):
-                            res = True
-                            break
-                    except AttributeError:
-                        pass
-                    
-        return res
+    @classmethod
+    def get_out_of_ranges(cls, sheets, name):
+        '''
+        Return if any row of the sheets has its validation column set,
+        with one query per interface table
+        '''
+        cursor = Transaction().connection.cursor()
+        pool = Pool()
+        Column_ = pool.get('lims.interface.column')
+        Field = pool.get('lims.interface.table.field')
+
+        result = dict((s.id, False) for s in sheets)
+        interface_ids = list(set(s.interface.id for s in sheets))
+        validation_columns = {}
+        for column in Column_.search([
+                ('interface', 'in', interface_ids),
+                ('validation_column', '=', True),
+                ]):
+            validation_columns.setdefault(column.interface.id, column.alias)
+        if not validation_columns:
+            return result
+
+        tables = {}
+        for s in sheets:
+            alias = validation_columns.get(s.interface.id)
+            if not alias:
+                continue
+            table = s.compilation.table
+            tables.setdefault((table.id, table.name, alias), []).append(s)
+
+        field_types = {}
+        for field in Field.search([
+                ('table', 'in', list(set(t[0] for t in tables.keys()))),
+                ('name', 'in', list(set(validation_columns.values()))),
+                ]):
+            field_types[(field.table.id, field.name)] = field.type
+
+        for (table_id, table_name, alias), table_sheets in tables.items():
+            field_type = field_types.get((table_id, alias))
+            if not field_type:
+                continue
+            sql_table = Table(table_name)
+            column = Column(sql_table, alias)
+            if field_type == 'boolean':
+                out_of_range = (column == Literal(True))
+            elif field_type in ('char', 'multiline'):
+                out_of_range = (Coalesce(column, '') != '')
+            elif field_type in ('integer', 'float', 'numeric'):
+                out_of_range = (Coalesce(column, 0) != 0)
+            else:
+                out_of_range = (column != Null)
+
+            sheets_by_compilation = dict((s.compilation.id, s)
+                for s in table_sheets)
+            for sub_compilations in grouped_slice(
+                    list(sheets_by_compilation.keys())):
+                cursor.execute(*sql_table.select(sql_table.compilation,
+                    where=(sql_table.compilation.in_(
+                        list(sub_compilations)) & out_of_range),
+                    group_by=[sql_table.compilation]))
+                for compilation, in cursor.fetchall():
+                    result[sheets_by_compilation[compilation].id] = True
+        return result
 
     @classmethod
     def get_notebook_lines(cls, records):
@@ -14,4 +14,7 @@ def register():
         board.BoardLaboratory,
         board.BoardLaboratorySampleLaboratoryDate,
         board.BoardLaboratorySampleReportDate,
+        board.BoardSampleSummary,
+        board.Sample,
+        board.Cron,
         module='lims_board', type_='model')
@@ -1,11 +1,13 @@
 # This file is part of lims_board module for Tryton.
 # The COPYRIGHT file at the top level of this repository contains
 # the full copyright notices and license terms.
-from dateutil.relativedelta import relativedelta
+from sql import Literal
+from sql.aggregate import Count, Sum
 
 from trytond.model import ModelSQL, ModelView, fields
-from trytond.pool import Pool
+from trytond.pool import Pool, PoolMeta
 from trytond.transaction import Transaction
+from trytond.tools import grouped_slice
 from trytond.i18n import gettext
 
 DEPARTMENTS_LIMIT = 30
@@ -16,7 +18,34 @@ SAMPLES_IN_LABORATORY = ['pending_planning', 'planned',
     'in_lab', 'lab_pending_acceptance']
 
 
-class BoardGeneral(ModelSQL, ModelView):
+class BoardSamplesMixin(object):
+
+    def _get_samples_clause(self):
+        clause = []
+        if self.date_from:
+            clause.append(('date2', '>=', self.date_from))
+        if self.date_to:
+            clause.append(('date2', '<=', self.date_to))
+        if self.parties:
+            clause.append(('party', 'in', [p.id for p in self.parties]))
+        if self.departments:
+            clause.append(('department', 'in',
+                [d.id for d in self.departments]))
+        if self.analysis:
+            clause.append(('fractions.services.analysis', 'in',
+                [a.id for a in self.analysis]))
+        return clause
+
+    def _get_samples_counts(self, states):
+        SampleSummary = Pool().get('lims.board.sample_summary')
+        if self.date_from or self.date_to or self.parties or self.analysis:
+            return SampleSummary.count_samples(states,
+                self._get_samples_clause())
+        return SampleSummary.get_counts(states,
+            [d.id for d in self.departments])
+
+
+class BoardGeneral(BoardSamplesMixin, ModelSQL, ModelView):
     'General Dashboard'
     __name__ = 'lims.board.general'
 
@@ -75,18 +104,7 @@ class BoardGeneral(ModelSQL, ModelView):
         Sample = pool.get('lims.sample')
 
         clause = [('state', 'in', SAMPLES_IN_PROGRESS)]
-        if self.date_from:
-            clause.append(('date2', '>=', self.date_from))
-        if self.date_to:
-            clause.append(('date2', '<=', self.date_to))
-        if self.parties:
-            clause.append(('party', 'in', [p.id for p in self.parties]))
-        if self.departments:
-            clause.append(('department', 'in',
-                [d.id for d in self.departments]))
-        if self.analysis:
-            clause.append(('fractions.services.analysis', 'in',
-                [a.id for a in self.analysis]))
+        clause.extend(self._get_samples_clause())
 
         samples = Sample.search(clause + [
             ('fractions.services.urgent', '=', True),
@@ -101,191 +119,87 @@ class BoardGeneral(ModelSQL, ModelView):
         return records
 
     def get_samples_state(self):
-        pool = Pool()
-        Sample = pool.get('lims.sample')
-
-        clause = []
-        if self.date_from:
-            clause.append(('date2', '>=', self.date_from))
-        if self.date_to:
-            clause.append(('date2', '<=', self.date_to))
-        if self.parties:
-            clause.append(('party', 'in', [p.id for p in self.parties]))
-        if self.departments:
-            clause.append(('department', 'in',
-                [d.id for d in self.departments]))
-        if self.analysis:
-            clause.append(('fractions.services.analysis', 'in',
-                [a.id for a in self.analysis]))
-
         records = []
 
+        quantities = dict((state, 0) for state in SAMPLES_IN_PROGRESS)
+        for _, state, _, _, qty in self._get_samples_counts(
+                SAMPLES_IN_PROGRESS):
+            quantities[state] += qty
+
         for state in SAMPLES_IN_PROGRESS:
             record = {
                 's': gettext('lims_board.msg_sample_state_%s' % state),
                 }
-            record['q'] = Sample.search_count(clause + [
-                ('state', '=', state),
-                ])
+            record['q'] = quantities[state]
             records.append(record)
 
         return records
 
     def get_samples_department(self):
         pool = Pool()
-        Sample = pool.get('lims.sample')
         Department = pool.get('company.department')
 
-        clause = [('state', 'in', SAMPLES_IN_PROGRESS)]
-        if self.date_from:
-            clause.append(('date2', '>=', self.date_from))
-        if self.date_to:
-            clause.append(('date2', '<=', self.date_to))
-        if self.parties:
-            clause.append(('party', 'in', [p.id for p in self.parties]))
-        if self.departments:
-            clause.append(('department', 'in',
-                [d.id for d in self.departments]))
-        if self.analysis:
-            clause.append(('fractions.services.analysis', 'in',
-                [a.id for a in self.analysis]))
-
         records = []
 
+        quantities = {}
+        for department, _, _, _, qty in self._get_samples_counts(
+                SAMPLES_IN_PROGRESS):
+            quantities.setdefault(department, 0)
+            quantities[department] += qty
+
         departments = Department.search([], order=[('id', 'ASC')])
         for d in departments:
             record = {'d': d.name}
-            record['q'] = Sample.search_count(clause + [
-                ('department', '=', d.id),
-                ])
+            record['q'] = quantities.get(d.id, 0)
             records.append(record)
 
         return records
 
     def get_samples_report_date(self):
         pool = Pool()
-        Sample = pool.get('lims.sample')
-        Department = pool.get('company.department')
         Date = pool.get('ir.date')
 
-        i = 0
-        dep = {None: ''}
-        departments = Department.search([], order=[('id', 'ASC')],
-            limit=DEPARTMENTS_LIMIT)
-        for d in departments:
-            i += 1
-            dep[d.id] = i
-
-        clause = [('state', 'in', SAMPLES_IN_PROGRESS)]
-        if self.date_from:
-            clause.append(('date2', '>=', self.date_from))
-        if self.date_to:
-            clause.append(('date2', '<=', self.date_to))
-        if self.parties:
-            clause.append(('party', 'in', [p.id for p in self.parties]))
-        if self.departments:
-            clause.append(('department', 'in',
-                [d.id for d in self.departments]))
-        if self.analysis:
-            clause.append(('fractions.services.analysis', 'in',
-                [a.id for a in self.analysis]))
-
-        records = []
-        today = Date.today()
-
-        # < -4 d
-        report_date = today - relativedelta(days=4)
-        record = {'t': '< -4 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('report_date', '<=', report_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # -3 d
-        report_date = today - relativedelta(days=3)
-        record = {'t': '-3 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('report_date', '=', report_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # -2 d
-        report_date = today - relativedelta(days=2)
-        record = {'t': '-2 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('report_date', '=', report_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # -1 d
-        report_date = today - relativedelta(days=1)
-        record = {'t': gettext('lims_board.msg_yesterday')}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('report_date', '=', report_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # t
-        record = {'t': gettext('lims_board.msg_today')}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('report_date', '=', today),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # +1 d
-        report_date = today + relativedelta(days=1)
-        record = {'t': gettext('lims_board.msg_tomorrow')}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('report_date', '=', report_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # +2 d
-        report_date = today + relativedelta(days=2)
-        record = {'t': '+2 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('report_date', '=', report_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # +3 d
-        report_date = today + relativedelta(days=3)
-        record = {'t': '+3 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('report_date', '=', report_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # > +4 d
-        report_date = today + relativedelta(days=4)
-        record = {'t': '> +4 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ['OR',
-                    ('report_date', '=', None),
-                    ('report_date', '>=', report_date),
-                    ],
-                ('department', '=', d_id),
-                ])
+        counts = [(department, report_date, qty)
+            for department, _, report_date, _, qty in
+            self._get_samples_counts(SAMPLES_IN_PROGRESS)]
+        return get_date_bucket_records(counts, Date.today())
+
+
+def get_date_bucket_records(counts, today):
+    """ Build the per-department date bucket records of the dashboards
+        from a list of (department, date, quantity)
+    """
+    Department = Pool().get('company.department')
+
+    i = 0
+    dep = {None: ''}
+    departments = Department.search([], order=[('id', 'ASC')],
+        limit=DEPARTMENTS_LIMIT)
+    for d in departments:
+        i += 1
+        dep[d.id] = i
+
+    labels = ['< -4 d', '-3 d', '-2 d',
+        gettext('lims_board.msg_yesterday'),
+        gettext('lims_board.msg_today'),
+        gettext('lims_board.msg_tomorrow'),
+        '+2 d', '+3 d', '> +4 d']
+    records = []
+    for label in labels:
+        record = {'t': label}
+        for d_it in dep.values():
+            record['q%s' % d_it] = 0
         records.append(record)
 
-        return records
+    for department, date, qty in counts:
+        if department not in dep:
+            continue
+        if date is None:
+            bucket = 8
+        else:
+            bucket = min(max((date - today).days, -4), 4) + 4
+        records[bucket]['q%s' % dep[department]] += qty
+    return records
 
 
 class BoardGeneralSampleState(ModelView):
@@ -445,7 +359,7 @@ class BoardLaboratorySampleReportDate(ModelView):
         return res
 
 
-class BoardLaboratory(ModelSQL, ModelView):
+class BoardLaboratory(BoardSamplesMixin, ModelSQL, ModelView):
     'Laboratory Dashboard'
     __name__ = 'lims.board.laboratory'
 
@@ -496,18 +410,7 @@ class BoardLaboratory(ModelSQL, ModelView):
         Sample = pool.get('lims.sample')
 
         clause = [('state', 'in', SAMPLES_IN_LABORATORY)]
-        if self.date_from:
-            clause.append(('date2', '>=', self.date_from))
-        if self.date_to:
-            clause.append(('date2', '<=', self.date_to))
-        if self.parties:
-            clause.append(('party', 'in', [p.id for p in self.parties]))
-        if self.departments:
-            clause.append(('department', 'in',
-                [d.id for d in self.departments]))
-        if self.analysis:
-            clause.append(('fractions.services.analysis', 'in',
-                [a.id for a in self.analysis]))
+        clause.extend(self._get_samples_clause())
 
         samples = Sample.search(clause + [
             ('fractions.services.urgent', '=', True),
@@ -523,128 +426,12 @@ class BoardLaboratory(ModelSQL, ModelView):
 
     def get_samples_laboratory_date(self):
         pool = Pool()
-        Sample = pool.get('lims.sample')
-        Department = pool.get('company.department')
         Date = pool.get('ir.date')
 
-        i = 0
-        dep = {None: ''}
-        departments = Department.search([], order=[('id', 'ASC')],
-            limit=DEPARTMENTS_LIMIT)
-        for d in departments:
-            i += 1
-            dep[d.id] = i
-
-        clause = [('state', 'in', SAMPLES_IN_LABORATORY)]
-        if self.date_from:
-            clause.append(('date2', '>=', self.date_from))
-        if self.date_to:
-            clause.append(('date2', '<=', self.date_to))
-        if self.parties:
-            clause.append(('party', 'in', [p.id for p in self.parties]))
-        if self.departments:
-            clause.append(('department', 'in',
-                [d.id for d in self.departments]))
-        if self.analysis:
-            clause.append(('fractions.services.analysis', 'in',
-                [a.id for a in self.analysis]))
-
-        records = []
-        today = Date.today()
-
-        # < -4 d
-        laboratory_date = today - relativedelta(days=4)
-        record = {'t': '< -4 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('laboratory_date', '<=', laboratory_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # -3 d
-        laboratory_date = today - relativedelta(days=3)
-        record = {'t': '-3 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('laboratory_date', '=', laboratory_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # -2 d
-        laboratory_date = today - relativedelta(days=2)
-        record = {'t': '-2 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('laboratory_date', '=', laboratory_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # -1 d
-        laboratory_date = today - relativedelta(days=1)
-        record = {'t': gettext('lims_board.msg_yesterday')}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('laboratory_date', '=', laboratory_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # t
-        record = {'t': gettext('lims_board.msg_today')}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('laboratory_date', '=', today),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # +1 d
-        laboratory_date = today + relativedelta(days=1)
-        record = {'t': gettext('lims_board.msg_tomorrow')}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('laboratory_date', '=', laboratory_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # +2 d
-        laboratory_date = today + relativedelta(days=2)
-        record = {'t': '+2 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('laboratory_date', '=', laboratory_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # +3 d
-        laboratory_date = today + relativedelta(days=3)
-        record = {'t': '+3 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ('laboratory_date', '=', laboratory_date),
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        # > +4 d
-        laboratory_date = today + relativedelta(days=4)
-        record = {'t': '> +4 d'}
-        for d_id, d_it in dep.items():
-            record['q%s' % d_it] = Sample.search_count(clause + [
-                ['OR',
-                    ('laboratory_date', '=', None),
-                    ('laboratory_date', '>=', laboratory_date),
-                    ],
-                ('department', '=', d_id),
-                ])
-        records.append(record)
-
-        return records
+        counts = [(department, laboratory_date, qty)
+            for department, _, _, laboratory_date, qty in
+            self._get_samples_counts(SAMPLES_IN_LABORATORY)]
+        return get_date_bucket_records(counts, Date.today())
 
 
 class BoardLaboratorySampleLaboratoryDate(ModelView):
@@ -786,3 +573,236 @@ class BoardLaboratorySampleLaboratoryDate(ModelView):
             'fields': definition,
             }
         return res
+
+
+class BoardSampleSummary(ModelSQL):
+    'Dashboard - Samples summary'
+    __name__ = 'lims.board.sample_summary'
+
+    department = fields.Many2One('company.department', 'Department',
+        select=True)
+    state = fields.Char('State', select=True)
+    report_date = fields.Date('Date agreed for result')
+    laboratory_date = fields.Date('Laboratory deadline')
+    quantity = fields.Integer('Samples Qty.')
+
+    # The keys are nullable, so they are made unique through an expression
+    # index which ON CONFLICT must repeat
+    _summary_key = ('COALESCE(department, 0), state, '
+        'COALESCE(report_date, DATE \'1900-01-01\'), '
+        'COALESCE(laboratory_date, DATE \'1900-01-01\')')
+
+    @classmethod
+    def __register__(cls, module_name):
+        cursor = Transaction().connection.cursor()
+        index = cls._table + '_key_index'
+        super().__register__(module_name)
+
+        cursor.execute('SELECT 1 FROM pg_indexes '
+            'WHERE indexname = %s', (index,))
+        if not cursor.fetchone():
+            # Previous versions could store a key more than once
+            cursor.execute('DELETE FROM "' + cls._table + '"')
+            cursor.execute('CREATE UNIQUE INDEX "' + index + '" '
+                'ON "' + cls._table + '" (' + cls._summary_key + ')')
+            cls.refresh()
+
+    @classmethod
+    def _get_upsert(cls):
+        return ('ON CONFLICT (' + cls._summary_key + ') DO UPDATE '
+            'SET quantity = EXCLUDED.quantity, '
+                'write_uid = EXCLUDED.create_uid, '
+                'write_date = EXCLUDED.create_date')
+
+    @classmethod
+    def _get_summary_query(cls):
+        ProductType = Pool().get('lims.product.type')
+        Sample = Pool().get('lims.sample')
+        return ('SELECT pt.department, s.state, s.report_date, '
+                's.laboratory_date, COUNT(*) '
+            'FROM "' + Sample._table + '" s '
+                'LEFT JOIN "' + ProductType._table + '" pt '
+                'ON pt.id = s.product_type ')
+
+    @classmethod
+    def refresh(cls):
+        'Rebuild the whole summary'
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        cursor.execute('DELETE FROM "' + cls._table + '"')
+        cursor.execute('INSERT INTO "' + cls._table + '" '
+                '(create_uid, create_date, department, state, report_date, '
+                'laboratory_date, quantity) '
+            'SELECT %s, CURRENT_TIMESTAMP, q.* FROM (' +
+                cls._get_summary_query() +
+                'WHERE s.state IN %s '
+                'GROUP BY pt.department, s.state, s.report_date, '
+                    's.laboratory_date) AS q ' +
+            cls._get_upsert(),
+            (transaction.user, tuple(SAMPLES_IN_PROGRESS)))
+
+    @classmethod
+    def get_keys(cls, sample_ids):
+        'Return the summary keys the samples currently count in'
+        cursor = Transaction().connection.cursor()
+        ProductType = Pool().get('lims.product.type')
+        Sample = Pool().get('lims.sample')
+
+        keys = set()
+        for sub_ids in grouped_slice(sample_ids):
+            cursor.execute('SELECT DISTINCT pt.department, s.state, '
+                    's.report_date, s.laboratory_date '
+                'FROM "' + Sample._table + '" s '
+                    'LEFT JOIN "' + ProductType._table + '" pt '
+                    'ON pt.id = s.product_type '
+                'WHERE s.id IN %s '
+                    'AND s.state IN %s',
+                (tuple(sub_ids), tuple(SAMPLES_IN_PROGRESS)))
+            keys.update(cursor.fetchall())
+        return keys
+
+    @classmethod
+    def update_keys(cls, keys):
+        '''
+        Recompute the counters of the given summary keys. A key inserted
+        by a concurrent transaction makes the insert conflict, so a key
+        is never counted twice.
+        '''
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        keys = list(keys)
+        for sub_keys in grouped_slice(keys):
+            sub_keys = list(sub_keys)
+            values = ('(VALUES ' + ', '.join(
+                    ['(%s::integer, %s::varchar, %s::date, %s::date)'] *
+                    len(sub_keys)) +
+                ') AS k (department, state, report_date, laboratory_date)')
+            params = [x for key in sub_keys for x in key]
+            cursor.execute('DELETE FROM "' + cls._table + '" t '
+                'USING ' + values + ' '
+                'WHERE t.department IS NOT DISTINCT FROM k.department '
+                    'AND t.state = k.state '
+                    'AND t.report_date IS NOT DISTINCT FROM k.report_date '
+                    'AND t.laboratory_date IS NOT DISTINCT FROM '
+                        'k.laboratory_date',
+                params)
+            cursor.execute('INSERT INTO "' + cls._table + '" '
+                    '(create_uid, create_date, department, state, '
+                    'report_date, laboratory_date, quantity) '
+                'SELECT %s, CURRENT_TIMESTAMP, q.* FROM (' +
+                    cls._get_summary_query() +
+                    'INNER JOIN ' + values + ' '
+                    'ON pt.department IS NOT DISTINCT FROM k.department '
+                        'AND s.state = k.state '
+                        'AND s.report_date IS NOT DISTINCT FROM '
+                            'k.report_date '
+                        'AND s.laboratory_date IS NOT DISTINCT FROM '
+                            'k.laboratory_date '
+                    'GROUP BY pt.department, s.state, s.report_date, '
+                        's.laboratory_date) AS q ' +
+                cls._get_upsert(),
+                [transaction.user] + params)
+
+    @classmethod
+    def get_counts(cls, states, departments=None):
+        '''
+        Return the precomputed counters as a list of
+        (department, state, report_date, laboratory_date, quantity)
+        '''
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        where = table.state.in_(states)
+        if departments:
+            where &= table.department.in_(departments)
+        cursor.execute(*table.select(table.department, table.state,
+                table.report_date, table.laboratory_date,
+                Sum(table.quantity),
+                where=where,
+                group_by=[table.department, table.state,
+                    table.report_date, table.laboratory_date]))
+        return cursor.fetchall()
+
+    @classmethod
+    def count_samples(cls, states, clause):
+        '''
+        Same result as get_counts but computed from the samples matching
+        clause, for filters the summary is not keyed by
+        '''
+        cursor = Transaction().connection.cursor()
+        pool = Pool()
+        Sample = pool.get('lims.sample')
+        ProductType = pool.get('lims.product.type')
+
+        sample = Sample.__table__()
+        product_type = ProductType.__table__()
+        query = Sample.search(clause + [('state', 'in', states)], order=[],
+            query=True)
+        cursor.execute(*sample.join(product_type, 'LEFT',
+                condition=product_type.id == sample.product_type
+                ).select(product_type.department, sample.state,
+                sample.report_date, sample.laboratory_date,
+                Count(Literal('*')),
+                where=sample.id.in_(query),
+                group_by=[product_type.department, sample.state,
+                    sample.report_date, sample.laboratory_date]))
+        return cursor.fetchall()
+
+
+class Sample(metaclass=PoolMeta):
+    __name__ = 'lims.sample'
+
+    _board_summary_fields = {'state', 'report_date', 'laboratory_date',
+        'product_type'}
+
+    @classmethod
+    def create(cls, vlist):
+        SampleSummary = Pool().get('lims.board.sample_summary')
+        samples = super().create(vlist)
+        SampleSummary.update_keys(SampleSummary.get_keys(
+            [s.id for s in samples]))
+        return samples
+
+    @classmethod
+    def write(cls, *args):
+        SampleSummary = Pool().get('lims.board.sample_summary')
+        actions = iter(args)
+        sample_ids = set()
+        for samples, vals in zip(actions, actions):
+            if cls._board_summary_fields & set(vals.keys()):
+                sample_ids.update(s.id for s in samples)
+        sample_ids = list(sample_ids)
+        keys = SampleSummary.get_keys(sample_ids)
+        super().write(*args)
+        if sample_ids:
+            keys |= SampleSummary.get_keys(sample_ids)
+            SampleSummary.update_keys(keys)
+
+    @classmethod
+    def delete(cls, samples):
+        SampleSummary = Pool().get('lims.board.sample_summary')
+        keys = SampleSummary.get_keys([s.id for s in samples])
+        super().delete(samples)
+        SampleSummary.update_keys(keys)
+
+    @classmethod
+    def update_samples_state(cls, sample_ids):
+        SampleSummary = Pool().get('lims.board.sample_summary')
+        keys = SampleSummary.get_keys(sample_ids)
+        super().update_samples_state(sample_ids)
+        keys |= SampleSummary.get_keys(sample_ids)
+        SampleSummary.update_keys(keys)
+
+
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.method.selection.extend([
+            ('lims.board.sample_summary|refresh',
+                'Refresh Dashboards Summary'),
+            ])
@@ -14,10 +14,10 @@ from trytond.wizard import Wizard, StateView, StateTransition, Button
 from trytond.pool import Pool, PoolMeta
 from trytond.pyson import Eval, Bool
 from trytond.transaction import Transaction
-from trytond.tools import get_smtp_server
 from trytond.config import config as tconfig
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
+from trytond.modules.lims.mail import SMTPTransport, send_mail
 
 logger = logging.getLogger(__name__)
 
@@ -216,7 +216,7 @@ class ResultsReport(metaclass=PoolMeta):
         session_id, _, _ = SendResultsReport.create()
         send_results_report = SendResultsReport(session_id)
         with Transaction().set_context(active_ids=[results_report.id
-                for results_report in results_reports]):
+                for results_report in results_reports]), SMTPTransport():
             send_results_report.transition_send()
 
         logger.info('Cron - Send Results Report: END')
@@ -782,17 +782,12 @@ class SendResultsReport(Wizard):
     def _send_msg(self, from_addr, to_addrs, msg):
         to_addrs = list(set(to_addrs))
         success = False
-        server = None
         try:
-            server = get_smtp_server()
-            server.sendmail(from_addr, to_addrs, msg.as_string())
-            server.quit()
+            send_mail(from_addr, to_addrs, msg.as_string())
             success = True
         except Exception as e:
             logger.error('Send Results Report: Unable to deliver mail')
             logger.error(str(e))
-            if server is not None:
-                server.quit()
         return success
 
     def default_failed(self, fields):
@@ -7,6 +7,7 @@ from trytond.wizard import Wizard, StateAction
 from trytond.pool import Pool, PoolMeta
 from trytond.pyson import PYSONEncoder, Eval, If
 from trytond.transaction import Transaction
+from trytond.tools import grouped_slice
 from trytond.i18n import gettext
 
 
@@ -670,15 +671,16 @@ class ResultsReportVersionDetailSample(metaclass=PoolMeta):
     @classmethod
     def create(cls, vlist):
         samples = super().create(vlist)
+        default_precedents = cls.get_default_precedents(
+            [s for s in samples if not s.precedent1])
         for sample in samples:
-            if not sample.precedent1:
-                precedents = cls.get_default_precedents(sample)
-                if not precedents:
-                    continue
-                for i in range(0, min(3, len(precedents))):
-                    setattr(sample, 'precedent%s' % str(i + 1), precedents[i])
-                sample.save()
-                cls.update_precedent_lines(sample)
+            precedents = default_precedents.get(sample.id)
+            if not precedents:
+                continue
+            for i in range(0, min(3, len(precedents))):
+                setattr(sample, 'precedent%s' % str(i + 1), precedents[i])
+            sample.save()
+            cls.update_precedent_lines(sample)
         return samples
 
     @classmethod
@@ -699,27 +701,118 @@ class ResultsReportVersionDetailSample(metaclass=PoolMeta):
                 for sample in samples:
                     cls.update_precedent_lines(sample)
 
-    @staticmethod
-    def get_default_precedents(sample):
+    @classmethod
+    def get_default_precedents(cls, samples):
+        '''
+        Return the last three notebooks of the component and invoice party
+        of each sample, as a dict {sample id: [notebooks]}
+        '''
+        cursor = Transaction().connection.cursor()
         pool = Pool()
         Notebook = pool.get('lims.notebook')
-        if not sample.component:
-            return []
-        precedents = Notebook.search([
-            ('id', '!=', sample.notebook.id),
-            ('component', '=', sample.component),
-            ('fraction.sample.state', '!=', 'annulled'),
-            ('invoice_party', '=', sample.notebook.invoice_party),
-            ], order=[
-            ('fraction.sample.number', 'DESC'),
-            ], limit=3)
-        return precedents
+        Fraction = pool.get('lims.fraction')
+        Sample = pool.get('lims.sample')
+        Entry = pool.get('lims.entry')
+
+        result = {}
+        samples = [s for s in samples if s.component]
+        if not samples:
+            return result
+
+        # Samples of the same report are excluded later, so their count is
+        # added to the rank limit
+        component_ids = list(set(s.component.id for s in samples))
+        candidates = {}
+        for sub_components in grouped_slice(component_ids):
+            sub_components = list(sub_components)
+            cursor.execute('SELECT id, component, invoice_party FROM ('
+                    'SELECT n.id, s.component, e.invoice_party, s.number, '
+                        'ROW_NUMBER() OVER ('
+                            'PARTITION BY s.component, e.invoice_party '
+                            'ORDER BY s.number DESC) AS rank '
+                    'FROM "' + Notebook._table + '" n '
+                        'INNER JOIN "' + Fraction._table + '" f '
+                        'ON f.id = n.fraction '
+                        'INNER JOIN "' + Sample._table + '" s '
+                        'ON s.id = f.sample '
+                        'INNER JOIN "' + Entry._table + '" e '
+                        'ON e.id = s.entry '
+                    'WHERE s.component IN (' +
+                        ', '.join(['%s'] * len(sub_components)) + ') '
+                        'AND s.state != \'annulled\') p '
+                'WHERE rank <= %s '
+                'ORDER BY component, invoice_party, rank',
+                sub_components + [3 + len(samples)])
+            for notebook_id, component_id, party_id in cursor.fetchall():
+                candidates.setdefault((component_id, party_id), []).append(
+                    notebook_id)
+
+        for sample in samples:
+            party = sample.notebook.invoice_party
+            notebook_ids = candidates.get(
+                (sample.component.id, party and party.id), [])
+            result[sample.id] = Notebook.browse([n for n in notebook_ids
+                    if n != sample.notebook.id][:3])
+        return result
+
+    @classmethod
+    def get_precedent_lines(cls, notebook_ids, analysis_ids=None):
+        '''
+        Return the accepted lines of the notebooks as a dict
+        {(notebook id, analysis id): [(line id, method id, equivalence
+        code)]}, with the first line of each method, ordered as the
+        notebook lines are
+        '''
+        cursor = Transaction().connection.cursor()
+        pool = Pool()
+        NotebookLine = pool.get('lims.notebook.line')
+        Analysis = pool.get('lims.analysis')
+        LabMethod = pool.get('lims.lab.method')
+
+        result = {}
+        analysis_clause = ''
+        analysis_params = []
+        if analysis_ids is not None:
+            if not analysis_ids:
+                return result
+            analysis_params = list(analysis_ids)
+            analysis_clause = ('AND nl.analysis IN (' +
+                ', '.join(['%s'] * len(analysis_params)) + ') ')
+
+        for sub_notebooks in grouped_slice(list(notebook_ids)):
+            sub_notebooks = list(sub_notebooks)
+            cursor.execute('SELECT id, notebook, analysis, method, '
+                    'equivalence_code '
+                'FROM ('
+                    'SELECT nl.id, nl.notebook, nl.analysis, nl.method, '
+                        'm.equivalence_code, nl.repetition, '
+                        'a."order" AS analysis_order, '
+                        'ROW_NUMBER() OVER ('
+                            'PARTITION BY nl.notebook, nl.analysis, '
+                                'nl.method '
+                            'ORDER BY nl.repetition, nl.id) AS rank '
+                    'FROM "' + NotebookLine._table + '" nl '
+                        'INNER JOIN "' + Analysis._table + '" a '
+                        'ON a.id = nl.analysis '
+                        'LEFT JOIN "' + LabMethod._table + '" m '
+                        'ON m.id = nl.method '
+                    'WHERE nl.notebook IN (' +
+                        ', '.join(['%s'] * len(sub_notebooks)) + ') '
+                        'AND nl.accepted = TRUE ' +
+                        analysis_clause + ') l '
+                'WHERE rank = 1 '
+                'ORDER BY notebook, analysis_order, repetition, id',
+                sub_notebooks + analysis_params)
+            for line_id, notebook_id, analysis_id, method_id, code in (
+                    cursor.fetchall()):
+                result.setdefault((notebook_id, analysis_id), []).append(
+                    (line_id, method_id, code))
+        return result
 
     @classmethod
     def update_precedent_lines(cls, sample):
         pool = Pool()
         ResultsLine = pool.get('lims.results_report.version.detail.line')
-        NotebookLine = pool.get('lims.notebook.line')
 
         precedent_lines = ResultsLine.search([
             ('detail_sample', '=', sample.id),
@@ -731,24 +824,24 @@ class ResultsReportVersionDetailSample(metaclass=PoolMeta):
         result_lines = ResultsLine.search([
             ('detail_sample', '=', sample.id),
             ])
-        analysis = [rl.notebook_line.analysis.id for rl in result_lines]
+        analysis = set(rl.notebook_line.analysis.id for rl in result_lines)
+
+        precedents = [p.id for p in (sample.precedent1, sample.precedent2,
+                sample.precedent3) if p]
+        if not precedents:
+            return
+        lines = cls.get_precedent_lines(precedents)
 
         lines_to_create = []
-        for precedent in [sample.precedent1, sample.precedent2,
-                sample.precedent3]:
-            if not precedent:
-                continue
-            precedent_lines = NotebookLine.search([
-                ('notebook', '=', precedent),
-                ('analysis', 'not in', analysis),
-                ('accepted', '=', True),
-                ])
-            for line in precedent_lines:
+        for precedent in precedents:
+            for notebook_id, analysis_id in lines:
+                if notebook_id != precedent or analysis_id in analysis:
+                    continue
                 lines_to_create.append({
                     'detail_sample': sample.id,
-                    'precedent_analysis': line.analysis.id,
+                    'precedent_analysis': analysis_id,
                     })
-                analysis.append(line.analysis.id)
+                analysis.add(analysis_id)
 
         if lines_to_create:
             ResultsLine.create(lines_to_create)
@@ -795,63 +888,58 @@ class ResultsReportVersionDetailLine(metaclass=PoolMeta):
 
     @classmethod
     def get_precedent_result(cls, details, names):
+        pool = Pool()
+        ResultsSample = pool.get('lims.results_report.version.detail.sample')
+        NotebookLine = pool.get('lims.notebook.line')
+
         result = {}
         for name in names:
-            result[name] = {}
-            if name == 'precedent1_result':
-                for d in details:
-                    result[name][d.id] = cls._get_precedent_result(
-                        d.detail_sample.precedent1, d)
-            elif name == 'precedent2_result':
-                for d in details:
-                    result[name][d.id] = cls._get_precedent_result(
-                        d.detail_sample.precedent2, d)
-            elif name == 'precedent3_result':
-                for d in details:
-                    result[name][d.id] = cls._get_precedent_result(
-                        d.detail_sample.precedent3, d)
-            elif name == 'precedent4_result':
-                for d in details:
-                    result[name][d.id] = cls._get_precedent_result(
-                        d.detail_sample.precedent4, d)
-            elif name == 'precedent5_result':
-                for d in details:
-                    result[name][d.id] = cls._get_precedent_result(
-                        d.detail_sample.precedent5, d)
-            elif name == 'precedent6_result':
-                for d in details:
-                    result[name][d.id] = cls._get_precedent_result(
-                        d.detail_sample.precedent6, d)
-            elif name == 'precedent7_result':
-                for d in details:
-                    result[name][d.id] = cls._get_precedent_result(
-                        d.detail_sample.precedent7, d)
-            else:  # name == 'precedent8_result':
-                for d in details:
-                    result[name][d.id] = cls._get_precedent_result(
-                        d.detail_sample.precedent8, d)
+            result[name] = dict((d.id, '') for d in details)
+
+        precedents = {}
+        notebook_ids, analysis_ids = set(), set()
+        for d in details:
+            if not d.notebook_line:
+                continue
+            for name in names:
+                precedent = getattr(d.detail_sample,
+                    name[:-len('_result')])
+                if not precedent:
+                    continue
+                precedents[(d.id, name)] = precedent.id
+                notebook_ids.add(precedent.id)
+                analysis_ids.add(d.analysis.id)
+        if not precedents:
+            return result
+
+        lines = ResultsSample.get_precedent_lines(notebook_ids, analysis_ids)
+        line_ids = {}
+        for d in details:
+            for name in names:
+                precedent = precedents.get((d.id, name))
+                if not precedent:
+                    continue
+                line_id = cls._get_precedent_line(
+                    lines.get((precedent, d.analysis.id), []), d.method)
+                if line_id:
+                    line_ids[(d.id, name)] = line_id
+
+        formated_results = dict((l['id'], l['formated_result'])
+            for l in NotebookLine.read(list(set(line_ids.values())),
+                ['formated_result']))
+        for (detail_id, name), line_id in line_ids.items():
+            result[name][detail_id] = formated_results[line_id]
         return result
 
-    @classmethod
-    def _get_precedent_result(cls, precedent, line):
-        pool = Pool()
-        NotebookLine = pool.get('lims.notebook.line')
-        if not precedent:
-            return ''
-        if not line.notebook_line:
-            return ''
-        precedent_line = NotebookLine.search([
-            ('notebook', '=', precedent),
-            ('analysis', '=', line.analysis),
-            ['OR', ('method', '=', line.method), [
-                ('method.equivalence_code', 'not in', [None, '']),
-                ('method.equivalence_code', '=', line.method.equivalence_code),
-                ]],
-            ('accepted', '=', True),
-            ])
-        if not precedent_line:
-            return ''
-        return precedent_line[0].formated_result
+    @staticmethod
+    def _get_precedent_line(lines, method):
+        equivalence_code = method and method.equivalence_code
+        for line_id, method_id, code in lines:
+            if method_id == (method and method.id):
+                return line_id
+            if equivalence_code and code == equivalence_code:
+                return line_id
+        return None
 
 
 class OpenResultsDetailPrecedent(Wizard):
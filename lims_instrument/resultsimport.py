@@ -13,6 +13,7 @@ from trytond.model import ModelView, ModelSQL, fields, Unique
 from trytond.wizard import Wizard, StateView, StateTransition, Button
 from trytond.pool import Pool, PoolMeta
 from trytond.transaction import Transaction
+from trytond.tools import grouped_slice
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
 
@@ -301,84 +302,150 @@ class NotebookLoadResultsFile(Wizard):
             ])
 
     def transition_collect(self):
-        cursor = Transaction().connection.cursor()
         pool = Pool()
-        Fraction = pool.get('lims.fraction')
-        Notebook = pool.get('lims.notebook')
         NotebookLine = pool.get('lims.notebook.line')
-        Analysis = pool.get('lims.analysis')
 
-        lines = []
+        files_results = []
         for fline in [str(item).zfill(2) for item in range(1, 61)]:
             file_ = getattr(self.start, 'infile_%s' % fline)
             if not file_:
                 continue
             self.start.results_importer.parse(file_)
             raw_results = self.start.results_importer.rawresults
-            fractions_numbers = list(raw_results.keys())
-            if not fractions_numbers:
-                continue
-
-            numbers = '\', \''.join(str(n) for n in fractions_numbers)
-            cursor.execute('SELECT id, number '
-                'FROM "' + Fraction._table + '" '
-                'WHERE number IN (\'' + numbers + '\') '
-                'ORDER BY number ASC')
-
-            for f in cursor.fetchall():
-                cursor.execute('SELECT id '
-                    'FROM "' + Notebook._table + '" '
-                    'WHERE fraction = %s '
-                    'LIMIT 1', (f[0],))
-                notebook = cursor.fetchone()
-                if not notebook:
-                    continue
-
-                for analysis in list(raw_results[f[1]].keys()):
-                    cursor.execute('SELECT id '
-                        'FROM "' + Analysis._table + '" '
-                        'WHERE code = %s '
-                            'AND automatic_acquisition = TRUE '
-                        'LIMIT 1', (analysis,))
-                    if not cursor.fetchone():
-                        continue
-
-                    for rep in list(raw_results[f[1]][analysis].keys()):
-                        clause = [
-                            ('notebook', '=', notebook[0]),
-                            ('analysis', '=', analysis),
-                            ('repetition', '=', rep),
-                            ('start_date', '!=', None),
-                            ('result', 'in', [None, '']),
-                            ('converted_result', 'in', [None, '']),
-                            ('literal_result', 'in', [None, '']),
-                            ['OR', ('result_modifier', '=', None),
-                                ('result_modifier.code', 'not in',
-                                ['d', 'nd', 'pos', 'neg', 'ni', 'abs',
-                                    'pre', 'na'])],
-                            ['OR', ('converted_result_modifier', '=', None),
-                                ('converted_result_modifier.code', 'not in',
-                                ['d', 'nd', 'pos', 'neg', 'ni', 'abs',
-                                    'pre'])],
-                            ]
-                        line = NotebookLine.search(clause, limit=1)
+            if raw_results:
+                files_results.append(raw_results)
+        if not files_results:
+            return 'empty'
+
+        keys = set()
+        device_codes = set()
+        for raw_results in files_results:
+            for fraction, analyses in raw_results.items():
+                for analysis, repetitions in analyses.items():
+                    for rep, data in repetitions.items():
+                        keys.add((str(fraction), analysis, rep))
+                        if data.get('device'):
+                            device_codes.add(data['device'])
+        notebook_lines = self._get_import_lines(keys)
+        devices = self._get_import_devices(device_codes)
+
+        # Later files override the results of previous ones
+        lines, to_write = {}, {}
+        for raw_results in files_results:
+            for fraction, analyses in raw_results.items():
+                for analysis, repetitions in analyses.items():
+                    for rep, data in repetitions.items():
+                        line = notebook_lines.get(
+                            (str(fraction), analysis, rep))
                         if not line:
                             continue
-                        data = raw_results[f[1]][analysis][rep]
-                        res = self.get_results(line[0], data)
+                        res = self.get_results(line, data, devices)
                         if res:
-                            NotebookLine.write([line[0]], res)
-                            lines.append(line[0])
-
-        if lines:
-            self.result.result_lines = [l.id for l in lines]
-            return 'result'
-        return 'empty'
+                            lines[line.id] = line
+                            to_write[line.id] = res
+
+        if not lines:
+            return 'empty'
+        grouped = {}
+        for line_id, res in to_write.items():
+            grouped.setdefault(tuple(sorted(res.items())), []).append(
+                lines[line_id])
+        args = []
+        for values, records in grouped.items():
+            args.extend((records, dict(values)))
+        NotebookLine.write(*args)
+
+        self.result.result_lines = list(lines.keys())
+        return 'result'
+
+    def _get_import_lines(self, keys):
+        '''
+        Return the notebook lines that can receive an imported result, as
+        a dict {(fraction number, analysis code, repetition): line}
+        '''
+        cursor = Transaction().connection.cursor()
+        pool = Pool()
+        Fraction = pool.get('lims.fraction')
+        Notebook = pool.get('lims.notebook')
+        NotebookLine = pool.get('lims.notebook.line')
+        Analysis = pool.get('lims.analysis')
 
-    def get_results(self, line, data):
+        result = {}
+        fractions_numbers = list(set(k[0] for k in keys))
+        analysis_codes = list(set(k[1] for k in keys))
+        repetitions = list(set(k[2] for k in keys))
+
+        notebooks = {}
+        for sub_numbers in grouped_slice(fractions_numbers):
+            sub_numbers = list(sub_numbers)
+            cursor.execute('SELECT f.number, MIN(n.id) '
+                'FROM "' + Fraction._table + '" f '
+                    'INNER JOIN "' + Notebook._table + '" n '
+                    'ON n.fraction = f.id '
+                'WHERE f.number IN (' +
+                    ', '.join(['%s'] * len(sub_numbers)) + ') '
+                'GROUP BY f.number', sub_numbers)
+            for number, notebook_id in cursor.fetchall():
+                notebooks[notebook_id] = number
+        if not notebooks:
+            return result
+
+        analyses = {}
+        for sub_codes in grouped_slice(analysis_codes):
+            sub_codes = list(sub_codes)
+            cursor.execute('SELECT id, code '
+                'FROM "' + Analysis._table + '" '
+                'WHERE code IN (' +
+                    ', '.join(['%s'] * len(sub_codes)) + ') '
+                    'AND automatic_acquisition = TRUE', sub_codes)
+            for analysis_id, code in cursor.fetchall():
+                analyses[analysis_id] = code
+        if not analyses:
+            return result
+
+        for sub_notebooks in grouped_slice(list(notebooks.keys())):
+            clause = [
+                ('notebook', 'in', list(sub_notebooks)),
+                ('analysis', 'in', list(analyses.keys())),
+                ('repetition', 'in', repetitions),
+                ('start_date', '!=', None),
+                ('result', 'in', [None, '']),
+                ('converted_result', 'in', [None, '']),
+                ('literal_result', 'in', [None, '']),
+                ['OR', ('result_modifier', '=', None),
+                    ('result_modifier.code', 'not in',
+                    ['d', 'nd', 'pos', 'neg', 'ni', 'abs',
+                        'pre', 'na'])],
+                ['OR', ('converted_result_modifier', '=', None),
+                    ('converted_result_modifier.code', 'not in',
+                    ['d', 'nd', 'pos', 'neg', 'ni', 'abs',
+                        'pre'])],
+                ]
+            for line in NotebookLine.search(clause):
+                key = (notebooks[line.notebook.id],
+                    analyses[line.analysis.id], line.repetition)
+                if key in keys and key not in result:
+                    result[key] = line
+        return result
+
+    def _get_import_devices(self, codes):
+        '''
+        Return the devices ids of the imported results by code
+        '''
         pool = Pool()
         Device = pool.get('lims.lab.device')
 
+        result = {}
+        for sub_codes in grouped_slice(list(codes)):
+            for device in Device.search([('code', 'in', list(sub_codes))]):
+                result.setdefault(device.code, device.id)
+        return result
+
+    def get_results(self, line, data, devices=None):
+        if devices is None:
+            devices = self._get_import_devices(
+                [data['device']] if data.get('device') else [])
+
         res = {}
         if 'result' in data or 'literal_result' in data:
             if 'result' in data:
@@ -394,10 +461,8 @@ class NotebookLoadResultsFile(Wizard):
             if 'chromatogram' in data:
                 res['imported_chromatogram'] = data['chromatogram']
             device = data['device'] if 'device' in data else None
-            if device:
-                dev = Device.search([('code', '=', device)])
-                if dev:
-                    res['imported_device'] = dev[0].id
+            if device and device in devices:
+                res['imported_device'] = devices[device]
             if 'dilution_factor' in data:
                 res['imported_dilution_factor'] = data['dilution_factor']
             if 'rm_correction_formula' in data:
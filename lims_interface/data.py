@@ -24,7 +24,8 @@ from trytond.cache import LRUDictTransaction
 from trytond.model.model import record as model_record
 from trytond.model.modelstorage import cache_size as model_cache_size
 from trytond.model.modelsql import convert_from
-from .interface import FIELD_TYPE_TRYTON, FIELD_TYPE_CAST
+from .interface import FIELD_TYPE_TRYTON, FIELD_TYPE_CAST, \
+    FIELD_TYPE_SQL
 
 
 ALLOWED_RESULT_TYPES = (str, int, float, Decimal, datetime.time,
@@ -691,45 +692,95 @@ class Data(ModelSQL, ModelView):
         sql_table = cls.get_sql_table()
         cursor = Transaction().connection.cursor()
 
-        ids = []
-        for record in vlist:
-            fields = []
-            values = []
-            for key, value in record.items():
-                fields.append(SqlColumn(sql_table, key))
-                values.append(value)
-
-            query = sql_table.insert(fields, values=[values],
-                returning=[sql_table.id])
-            cursor.execute(*query)
-            ids.append(cursor.fetchone()[0])
+        # rows with the same columns are inserted with one statement
+        ids = [None] * len(vlist)
+        groups = defaultdict(list)
+        for index, record in enumerate(vlist):
+            groups[tuple(record.keys())].append(index)
+        for keys, indexes in groups.items():
+            fields = [SqlColumn(sql_table, key) for key in keys]
+            for sub_indexes in grouped_slice(indexes):
+                sub_indexes = list(sub_indexes)
+                query = sql_table.insert(fields,
+                    values=[[vlist[i][key] for key in keys]
+                        for i in sub_indexes],
+                    returning=[sql_table.id])
+                cursor.execute(*query)
+                for index, (id_,) in zip(sub_indexes, cursor.fetchall()):
+                    ids[index] = id_
         records = cls.browse(ids)
         cls.update_formulas(records)
         return records
 
     @classmethod
     def write(cls, *args):
-        sql_table = cls.get_sql_table()
-        cursor = Transaction().connection.cursor()
-
         all_records = []
+        rows = []
         actions = iter(args)
         for records, vals in zip(actions, actions):
             all_records += records
-            fields = []
-            values = []
-            for key, value in vals.items():
-                fields.append(SqlColumn(sql_table, key))
-                values.append(value)
-
-            query = sql_table.update(fields, values,
-                where=sql_table.id.in_([x.id for x in records]))
-            cursor.execute(*query)
+            rows.extend((r.id, vals) for r in records)
+        cls._update_rows(cls.get_table(), rows)
         cls.update_formulas(all_records)
 
     @classmethod
-    def update_formulas(cls, records=None):
+    def _get_column_types(cls, table):
+        'Return the SQL type of each column of the interface table'
+        database = Transaction().database
+        types = {
+            'id': fields.Integer._sql_type,
+            'create_uid': fields.Integer._sql_type,
+            'write_uid': fields.Integer._sql_type,
+            'create_date': fields.Timestamp._sql_type,
+            'write_date': fields.Timestamp._sql_type,
+            'compilation': fields.Integer._sql_type,
+            'annulled': fields.Boolean._sql_type,
+            'notebook_line': fields.Integer._sql_type,
+            }
+        for field in table.fields_:
+            types[field.name] = FIELD_TYPE_SQL[field.type]
+        return dict((name, database.sql_type(type_).base)
+            for name, type_ in types.items())
+
+    @classmethod
+    def _update_rows(cls, table, rows):
+        '''
+        Update the rows of the interface table from a list of (id, values)
+        pairs. Rows with the same columns are updated with one statement
+        joined to their values.
+        '''
         cursor = Transaction().connection.cursor()
+        if table:
+            table_name = table.name
+            types = cls._get_column_types(table)
+        else:
+            table_name = cls._table
+            types = {}
+
+        groups = defaultdict(list)
+        for id_, vals in rows:
+            if vals:
+                groups[tuple(vals.keys())].append((id_, vals))
+        for keys, group in groups.items():
+            columns = ['id'] + list(keys)
+            placeholders = '(%s)' % ', '.join(
+                'CAST(%%s AS %s)' % types[c] if c in types else '%s'
+                for c in columns)
+            for sub_group in grouped_slice(group):
+                sub_group = list(sub_group)
+                params = []
+                for id_, vals in sub_group:
+                    params.append(id_)
+                    params.extend(vals[key] for key in keys)
+                cursor.execute('UPDATE "' + table_name + '" AS t SET ' +
+                    ', '.join('"%s" = v."%s"' % (k, k) for k in keys) +
+                    ' FROM (VALUES ' +
+                    ', '.join([placeholders] * len(sub_group)) +
+                    ') AS v (' + ', '.join('"%s"' % c for c in columns) +
+                    ') WHERE t.id = v.id', params)
+
+    @classmethod
+    def update_formulas(cls, records=None):
         pool = Pool()
         Compilation = Pool().get('lims.interface.compilation')
         TableField = pool.get('lims.interface.table.field')
@@ -741,10 +792,8 @@ class Data(ModelSQL, ModelView):
             compilation = Compilation(compilation_id)
             table = compilation.table
             interface = compilation.interface
-            sql_table = SqlTable(table.name)
         else:
             table = cls.get_table()
-            sql_table = cls.get_sql_table()
             interface = cls.get_interface()
 
         formula_fields = []
@@ -752,12 +801,16 @@ class Data(ModelSQL, ModelView):
             ('table', '=', table),
             ('formula', 'not in', [None, '']),
             ])
-        for field in fields:
-            col = Column.search([
+        if not fields:
+            return
+        evaluation_order = {}
+        for col in Column.search([
                 ('interface', '=', interface),
-                ('alias', '=', field.name),
-                ])
-            order = col and col[0].evaluation_order or 0
+                ('alias', 'in', [f.name for f in fields]),
+                ]):
+            evaluation_order.setdefault(col.alias, col.evaluation_order)
+        for field in fields:
+            order = evaluation_order.get(field.name) or 0
             formula_fields.append({
                 'order': order,
                 'field': field,
@@ -768,10 +821,10 @@ class Data(ModelSQL, ModelView):
 
         if not records:
             records = cls.search([])
+        rows = []
         for record in records:
             vals = {}
-            fields = []
-            values = []
+            values = {}
             for field in formula_fields:
                 for x in (field['field'].inputs or '').split():
                     if x not in vals:
@@ -780,15 +833,10 @@ class Data(ModelSQL, ModelView):
                 value = record.get_formula_value(field['field'], vals)
                 if value is None:
                     continue
-                fields.append(SqlColumn(sql_table, field_name))
-                values.append(value)
+                values[field_name] = value
                 vals[field_name] = value
-
-            if not values:
-                continue
-            query = sql_table.update(fields, values,
-                where=(sql_table.id == record.id))
-            cursor.execute(*query)
+            rows.append((record.id, values))
+        cls._update_rows(table, rows)
 
     def get_formula_value(self, field, vals={}):
         ast = field.get_ast()
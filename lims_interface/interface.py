@@ -16,7 +16,7 @@ from openpyxl import load_workbook
 from decimal import Decimal
 from datetime import datetime, date, time
 from dateutil import relativedelta
-from itertools import chain
+from itertools import chain, islice
 from collections import defaultdict
 
 from trytond.config import config
@@ -29,6 +29,7 @@ from trytond.pyson import PYSONDecoder, PYSONEncoder, Eval, Bool, Not, And, Or
 from trytond.transaction import Transaction
 from trytond.i18n import gettext
 from trytond.exceptions import UserError
+from trytond.modules.lims.formula_cache import compile_formula
 from .function import custom_functions
 
 FUNCTIONS = formulas.get_functions()
@@ -76,6 +77,8 @@ VALID_NEXT_SYMBOLS = '_0123456789'
 VALID_SYMBOLS = VALID_FIRST_SYMBOLS + VALID_NEXT_SYMBOLS
 
 BLOCKSIZE = 65536
+COLLECT_CHUNK_SIZE = config.getint('lims_interface', 'collect_chunk_size',
+    default=1000)
 
 if config.getboolean('lims_interface', 'filestore', default=False):
     file_id = 'origin_file_id'
@@ -106,6 +109,15 @@ def convert_to_symbol(text):
     return symbol
 
 
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def str2date(value, lang=None):
     Lang = Pool().get('ir.lang')
     if lang is None:
@@ -398,8 +410,7 @@ class Interface(Workflow, ModelSQL, ModelView):
                 return None
             formula = _clean_v_function(formula)
             formula = _clean_iter_function(formula)
-            parser = formulas.Parser()
-            ast = parser.ast(formula)[1].compile()
+            ast = compile_formula(formula)
             return (' '.join([x for x in ast.inputs])).lower()
 
         for interface in interfaces:
@@ -1680,14 +1691,8 @@ class Compilation(Workflow, ModelSQL, ModelView):
     def collect_csv(self, create_new_lines=True):
         pool = Pool()
         Origin = pool.get('lims.interface.compilation.origin')
-        Data = pool.get('lims.interface.data')
-        NotebookLine = pool.get('lims.notebook.line')
-
-        data_create = []
-        data_write = []
 
         schema, formula_fields = self._get_schema()
-        schema_keys = list(schema.keys())
         separator = {
             'comma': ',',
             'colon': ':',
@@ -1702,220 +1707,369 @@ class Compilation(Workflow, ModelSQL, ModelView):
         with Transaction().set_context(
                 lims_interface_table=self.table):
             imported_files = []
+            created_ids = set()
             for origin in self.origins:
                 if origin.imported:
                     continue
-                filedata = io.BytesIO(origin.origin_file)
-                wrapper = io.TextIOWrapper(filedata, encoding=encoding)
-                try:
-                    str_data = io.StringIO(wrapper.read())
-                except UnicodeDecodeError:
-                    raise UserError(gettext(
-                        'lims_interface.invalid_interface_charset'))
-                reader = csv.reader(str_data, delimiter=delimiter)
-                count = 0
-                for row in reader:
-                    if count < first_row:
-                        count += 1
-                        continue
-                    if len(row) == 0:
-                        continue
-                    line = {'compilation': self.id}
-                    for k in schema_keys:
-                        value = None
-                        default_value = schema[k]['default_value']
-                        if default_value not in (None, ''):
-                            if not create_new_lines:
-                                continue
-                            if default_value.startswith('='):
-                                continue
-                            value = default_value
-                        else:
-                            col = schema[k]['col']
-                            if (not row[col - 1] or
-                                    not str(row[col - 1]).strip()):
-                                line[k] = None
-                                continue
-                            value = row[col - 1]
-
-                        if schema[k]['type'] == 'integer':
-                            line[k] = int(value)
-                        elif schema[k]['type'] == 'float':
-                            line[k] = float(value)
-                        elif schema[k]['type'] == 'numeric':
-                            line[k] = Decimal(str(value))
-                        elif schema[k]['type'] == 'boolean':
-                            line[k] = bool(value)
-                        elif schema[k]['type'] == 'date':
-                            line[k] = str2date(value, self.interface.language)
-                        elif (schema[k]['type'] == 'many2one' and
-                                default_value):
-                            resource = get_model_resource(
-                                schema[k]['model_name'], value,
-                                schema[k]['field_name'])
-                            line[k] = resource[0].id
-                        else:
-                            line[k] = str(value)
-
-                    f_fields = sorted(formula_fields.items(),
-                        key=lambda x: x[1]['evaluation_order'])
-                    for field in f_fields:
-                        line[field[0]] = self._get_formula_value(field, line)
-
-                    line['notebook_line'] = self._get_notebook_line(line)
-                    if (line['notebook_line']):
-                        nl = NotebookLine(line['notebook_line'])
-                        for k in schema_keys:
-                            default_value = schema[k]['default_value']
-                            if (default_value not in (None, '') and
-                                    default_value.startswith('=')):
-                                path = default_value[1:].split('.')
-                                field = path.pop(0)
-                                try:
-                                    value = getattr(nl, field)
-                                    while path:
-                                        field = path.pop(0)
-                                        value = getattr(value, field)
-                                except AttributeError:
-                                    value = None
-                                line[k] = value
-                    line_id = self._get_compilation_line_id(line)
-                    if line_id:
-                        line['id'] = line_id
-                        data_write.append(line)
-                    else:
-                        data_create.append(line)
-                    count += 1
+                filedata = io.TextIOWrapper(io.BytesIO(origin.origin_file),
+                    encoding=encoding, newline='')
+                reader = csv.reader(filedata, delimiter=delimiter)
+                lines = self._read_csv_lines(reader, schema, first_row,
+                    create_new_lines)
+                self._collect_lines(lines, schema, formula_fields,
+                    create_new_lines, created_ids)
                 imported_files.append(origin)
 
             if imported_files:
                 Origin.write(imported_files, {'imported': True})
 
-            if data_create and create_new_lines:
-                Data.create(data_create)
-            for data in data_write:
-                data_line = Data(data['id'])
-                del data['id']
-                del data['notebook_line']
-                del data['compilation']
-                Data.write([data_line], data)
+    def _read_csv_lines(self, reader, schema, first_row,
+            create_new_lines=True):
+        count = 0
+        try:
+            for row in reader:
+                if count < first_row:
+                    count += 1
+                    continue
+                if len(row) == 0:
+                    continue
+                line = {'compilation': self.id}
+                for k in schema:
+                    value = None
+                    default_value = schema[k]['default_value']
+                    if default_value not in (None, ''):
+                        if not create_new_lines:
+                            continue
+                        if default_value.startswith('='):
+                            continue
+                        value = default_value
+                    else:
+                        col = schema[k]['col']
+                        if (not row[col - 1] or
+                                not str(row[col - 1]).strip()):
+                            line[k] = None
+                            continue
+                        value = row[col - 1]
+
+                    if schema[k]['type'] == 'integer':
+                        line[k] = int(value)
+                    elif schema[k]['type'] == 'float':
+                        line[k] = float(value)
+                    elif schema[k]['type'] == 'numeric':
+                        line[k] = Decimal(str(value))
+                    elif schema[k]['type'] == 'boolean':
+                        line[k] = bool(value)
+                    elif schema[k]['type'] == 'date':
+                        line[k] = str2date(value, self.interface.language)
+                    elif (schema[k]['type'] == 'many2one' and
+                            default_value):
+                        resource = get_model_resource(
+                            schema[k]['model_name'], value,
+                            schema[k]['field_name'])
+                        line[k] = resource[0].id
+                    else:
+                        line[k] = str(value)
+                count += 1
+                yield line
+        except UnicodeDecodeError:
+            raise UserError(gettext(
+                'lims_interface.invalid_interface_charset'))
 
     def collect_excel(self, create_new_lines=True):
         pool = Pool()
         Origin = pool.get('lims.interface.compilation.origin')
-        Data = pool.get('lims.interface.data')
-        NotebookLine = pool.get('lims.notebook.line')
-
-        data_create = []
-        data_write = []
 
         schema, formula_fields = self._get_schema()
-        schema_keys = list(schema.keys())
         first_row = self.interface.first_row
         with Transaction().set_context(
                 lims_interface_table=self.table):
             imported_files = []
+            created_ids = set()
             for origin in self.origins:
                 if origin.imported:
                     continue
                 filedata = io.BytesIO(origin.origin_file)
-                book = load_workbook(filename=filedata, data_only=True)
+                book = load_workbook(filename=filedata, read_only=True,
+                    data_only=True)
                 sheet = book.active
-                max_row = sheet.max_row + 1
-                if first_row <= max_row:
-                    for i in range(first_row, max_row):
-                        line = {'compilation': self.id}
-                        for k in schema_keys:
-                            value = None
-                            default_value = schema[k]['default_value']
-                            if default_value not in (None, ''):
-                                if not create_new_lines:
-                                    continue
-                                if default_value.startswith('='):
-                                    continue
-                                value = default_value
-                            else:
-                                col = schema[k]['col']
-                                row = i
-                                if schema[k]['singleton']:
-                                    row = schema[k]['row']
-                                value = sheet.cell(row=row, column=col).value
-                                if value is None:
-                                    line[k] = None
-                                    continue
-
-                            if schema[k]['type'] == 'integer':
-                                line[k] = int(value)
-                            elif schema[k]['type'] == 'float':
-                                line[k] = float(value)
-                            elif schema[k]['type'] == 'numeric':
-                                line[k] = Decimal(str(value))
-                            elif schema[k]['type'] == 'boolean':
-                                line[k] = bool(value)
-                            elif schema[k]['type'] == 'date':
-                                if default_value:
-                                    line[k] = str2date(
-                                        value, self.interface.language)
-                                else:
-                                    if isinstance(value, datetime):
-                                        line[k] = value
-                                    else:
-                                        line[k] = None
-                            elif (schema[k]['type'] == 'many2one' and
-                                    default_value):
-                                resource = get_model_resource(
-                                    schema[k]['model_name'], value,
-                                    schema[k]['field_name'])
-                                line[k] = resource[0].id
-                            else:
-                                line[k] = str(value)
-
-                        f_fields = sorted(formula_fields.items(),
-                            key=lambda x: x[1]['evaluation_order'])
-                        for field in f_fields:
-                            line[field[0]] = self._get_formula_value(
-                                field, line)
-
-                        line['notebook_line'] = self._get_notebook_line(line)
-                        if (line['notebook_line']):
-                            nl = NotebookLine(line['notebook_line'])
-                            for k in schema_keys:
-                                default_value = schema[k]['default_value']
-                                if (default_value not in (None, '') and
-                                        default_value.startswith('=')):
-                                    path = default_value[1:].split('.')
-                                    field = path.pop(0)
-                                    try:
-                                        value = getattr(nl, field)
-                                        while path:
-                                            field = path.pop(0)
-                                            value = getattr(value, field)
-                                    except AttributeError:
-                                        value = None
-                                    line[k] = value
-                        line_id = self._get_compilation_line_id(line)
-                        if line_id:
-                            line['id'] = line_id
-                            data_write.append(line)
-                        else:
-                            data_create.append(line)
+                lines = self._read_excel_lines(sheet, schema, first_row,
+                    create_new_lines)
+                self._collect_lines(lines, schema, formula_fields,
+                    create_new_lines, created_ids)
+                book.close()
                 imported_files.append(origin)
 
             if imported_files:
                 Origin.write(imported_files, {'imported': True})
 
-            if data_create and create_new_lines:
-                Data.create(data_create)
-            for data in data_write:
-                data_line = Data(data['id'])
-                del data['id']
-                del data['notebook_line']
-                del data['compilation']
-                Data.write([data_line], data)
+    def _read_excel_lines(self, sheet, schema, first_row,
+            create_new_lines=True):
+        singletons = {}
+        for k in schema:
+            if (schema[k]['default_value'] in (None, '') and
+                    schema[k]['singleton']):
+                singletons[k] = sheet.cell(row=schema[k]['row'],
+                    column=schema[k]['col']).value
+
+        for row in sheet.iter_rows(min_row=first_row, values_only=True):
+            line = {'compilation': self.id}
+            for k in schema:
+                value = None
+                default_value = schema[k]['default_value']
+                if default_value not in (None, ''):
+                    if not create_new_lines:
+                        continue
+                    if default_value.startswith('='):
+                        continue
+                    value = default_value
+                else:
+                    col = schema[k]['col']
+                    if schema[k]['singleton']:
+                        value = singletons[k]
+                    elif col <= len(row):
+                        value = row[col - 1]
+                    if value is None:
+                        line[k] = None
+                        continue
+
+                if schema[k]['type'] == 'integer':
+                    line[k] = int(value)
+                elif schema[k]['type'] == 'float':
+                    line[k] = float(value)
+                elif schema[k]['type'] == 'numeric':
+                    line[k] = Decimal(str(value))
+                elif schema[k]['type'] == 'boolean':
+                    line[k] = bool(value)
+                elif schema[k]['type'] == 'date':
+                    if default_value:
+                        line[k] = str2date(
+                            value, self.interface.language)
+                    else:
+                        if isinstance(value, datetime):
+                            line[k] = value
+                        else:
+                            line[k] = None
+                elif (schema[k]['type'] == 'many2one' and
+                        default_value):
+                    resource = get_model_resource(
+                        schema[k]['model_name'], value,
+                        schema[k]['field_name'])
+                    line[k] = resource[0].id
+                else:
+                    line[k] = str(value)
+            yield line
 
     def collect_txt(self, create_new_lines=True):
         return
 
+    def _collect_lines(self, lines, schema, formula_fields,
+            create_new_lines=True, created_ids=None):
+        '''
+        Store the parsed lines in chunks of COLLECT_CHUNK_SIZE rows: the
+        notebook lines and the existing compilation rows of each chunk are
+        resolved with one query each, and new and updated rows are written
+        with one create and one write call.
+        '''
+        pool = Pool()
+        Data = pool.get('lims.interface.data')
+
+        if created_ids is None:
+            created_ids = set()
+        f_fields = sorted(formula_fields.items(),
+            key=lambda x: x[1]['evaluation_order'])
+        for chunk in iter_chunks(lines, COLLECT_CHUNK_SIZE):
+            for line in chunk:
+                for field in f_fields:
+                    line[field[0]] = self._get_formula_value(field, line)
+            self._set_notebook_lines(chunk, schema)
+
+            data_create = []
+            data_write = []
+            line_ids = self._get_compilation_line_ids(chunk, created_ids)
+            for line, line_id in zip(chunk, line_ids):
+                if line_id:
+                    data = line.copy()
+                    del data['notebook_line']
+                    del data['compilation']
+                    data_write.extend(([Data(line_id)], data))
+                else:
+                    data_create.append(line)
+
+            if data_create and create_new_lines:
+                created_ids.update(r.id for r in Data.create(data_create))
+            if data_write:
+                Data.write(*data_write)
+
+    def _set_notebook_lines(self, lines, schema):
+        pool = Pool()
+        NotebookLine = pool.get('lims.notebook.line')
+
+        nl_ids = self._get_notebook_lines(lines)
+        notebook_lines = dict((nl.id, nl)
+            for nl in NotebookLine.browse([x for x in nl_ids if x]))
+        for line, nl_id in zip(lines, nl_ids):
+            line['notebook_line'] = nl_id
+            if not nl_id:
+                continue
+            nl = notebook_lines[nl_id]
+            for k in schema:
+                default_value = schema[k]['default_value']
+                if (default_value not in (None, '') and
+                        default_value.startswith('=')):
+                    path = default_value[1:].split('.')
+                    field = path.pop(0)
+                    try:
+                        value = getattr(nl, field)
+                        while path:
+                            field = path.pop(0)
+                            value = getattr(value, field)
+                    except AttributeError:
+                        value = None
+                    line[k] = value
+
+    def _get_line_key(self, line):
+        fraction_field = self.interface.fraction_field
+        analysis_field = self.interface.analysis_field
+        repetition_field = self.interface.repetition_field
+        if not fraction_field or not analysis_field or not repetition_field:
+            return None
+
+        fraction_value = line.get(fraction_field.alias)
+        analysis_value = line.get(analysis_field.alias)
+        repetition_value = line.get(repetition_field.alias)
+        if (fraction_value is None or
+                analysis_value is None or
+                repetition_value is None):
+            return None
+
+        method_value = None
+        method_field = self.interface.method_field
+        if method_field:
+            method_value = line.get(method_field.alias)
+        return (fraction_value, analysis_value, repetition_value,
+            method_value)
+
+    def _get_notebook_line_key(self, line):
+        '''
+        Return the key of line converted to the types of the notebook line
+        fields: the fraction number as text and the repetition as integer
+        '''
+        key = self._get_line_key(line)
+        if not key:
+            return None
+        fraction_value, analysis_value, repetition_value, method_value = key
+        try:
+            repetition_value = int(repetition_value)
+        except (TypeError, ValueError):
+            return None
+        return (str(fraction_value), analysis_value, repetition_value,
+            method_value)
+
+    def _get_notebook_lines(self, lines):
+        '''
+        Return the notebook line id of each line, resolved with one
+        search
+        '''
+        pool = Pool()
+        NotebookLine = pool.get('lims.notebook.line')
+
+        keys = [self._get_notebook_line_key(line) for line in lines]
+        valid_keys = [k for k in keys if k]
+        if not valid_keys:
+            return [None] * len(lines)
+
+        candidates = defaultdict(list)
+        for nl in NotebookLine.search([
+                ('notebook.fraction.number', 'in',
+                    list(set(k[0] for k in valid_keys))),
+                ('analysis.code', 'in',
+                    list(set(k[1].split(' - ')[0] for k in valid_keys))),
+                ('analysis.automatic_acquisition', '=', True),
+                ('repetition', 'in', list(set(k[2] for k in valid_keys))),
+                ('annulled', '=', False),
+                ]):
+            candidates[(nl.notebook.fraction.number, nl.analysis.code,
+                nl.repetition)].append(nl)
+
+        res = []
+        for key in keys:
+            nl_id = None
+            if key:
+                fraction_value, analysis_value, repetition_value, \
+                    method_value = key
+                for nl in candidates[(fraction_value,
+                        analysis_value.split(' - ')[0], repetition_value)]:
+                    if (method_value is not None and (not nl.method or
+                            nl.method.code != method_value.split(' - ')[0])):
+                        continue
+                    nl_id = nl.id
+                    break
+            res.append(nl_id)
+        return res
+
+    def _get_compilation_line_ids(self, lines, exclude_ids=None):
+        '''
+        Return the id of the existing compilation row of each line,
+        resolved with one search for the rows linked to a notebook line
+        and one for the others
+        '''
+        pool = Pool()
+        Data = pool.get('lims.interface.data')
+
+        exclude_ids = exclude_ids or set()
+        by_notebook_line = {}
+        nl_ids = [line['notebook_line'] for line in lines
+            if line.get('notebook_line')]
+        if nl_ids:
+            for data in Data.search([
+                    ('compilation', '=', self.id),
+                    ('notebook_line', 'in', list(set(nl_ids))),
+                    ]):
+                if data.id in exclude_ids:
+                    continue
+                by_notebook_line.setdefault(data.notebook_line.id, data.id)
+
+        by_key = defaultdict(list)
+        keys = [not line.get('notebook_line') and self._get_line_key(line)
+            or None for line in lines]
+        valid_keys = [k for k in keys if k]
+        if valid_keys:
+            fraction_alias = self.interface.fraction_field.alias
+            analysis_alias = self.interface.analysis_field.alias
+            repetition_alias = self.interface.repetition_field.alias
+            method_field = self.interface.method_field
+            for data in Data.search([
+                    ('compilation', '=', self.id),
+                    (fraction_alias, 'in',
+                        list(set(k[0] for k in valid_keys))),
+                    (analysis_alias, 'in',
+                        list(set(k[1] for k in valid_keys))),
+                    (repetition_alias, 'in',
+                        list(set(k[2] for k in valid_keys))),
+                    ]):
+                if data.id in exclude_ids:
+                    continue
+                method_value = (method_field and
+                    getattr(data, method_field.alias) or None)
+                by_key[(getattr(data, fraction_alias),
+                    getattr(data, analysis_alias),
+                    getattr(data, repetition_alias))].append(
+                        (method_value, data.id))
+
+        res = []
+        for line, key in zip(lines, keys):
+            line_id = None
+            if line.get('notebook_line'):
+                line_id = by_notebook_line.get(line['notebook_line'])
+            elif key:
+                for method_value, data_id in by_key[key[:3]]:
+                    if key[3] is not None and method_value != key[3]:
+                        continue
+                    line_id = data_id
+                    break
+            res.append(line_id)
+        return res
+
     def _get_schema(self):
         schema = {}
         formula_fields = {}
@@ -1957,8 +2111,7 @@ class Compilation(Workflow, ModelSQL, ModelView):
         return schema, formula_fields
 
     def _get_formula_value(self, field, line):
-        parser = formulas.Parser()
-        ast = parser.ast(field[1]['formula'])[1].compile()
+        ast = compile_formula(field[1]['formula'])
         inputs = (' '.join([x for x in ast.inputs])).lower().split()
         inputs = [line[x] for x in inputs]
         try:
@@ -1978,81 +2131,6 @@ class Compilation(Workflow, ModelSQL, ModelView):
                     value = None
         return value
 
-    def _get_notebook_line(self, line):
-        pool = Pool()
-        NotebookLine = pool.get('lims.notebook.line')
-
-        fraction_field = self.interface.fraction_field
-        analysis_field = self.interface.analysis_field
-        repetition_field = self.interface.repetition_field
-        if not fraction_field or not analysis_field or not repetition_field:
-            return None
-
-        fraction_value = line.get(fraction_field.alias)
-        analysis_value = line.get(analysis_field.alias)
-        repetition_value = line.get(repetition_field.alias)
-        if (fraction_value is None or
-                analysis_value is None or
-                repetition_value is None):
-            return None
-
-        clause = [
-            ('notebook.fraction.number', '=', fraction_value),
-            ('analysis.code', '=', analysis_value.split(' - ')[0]),
-            ('analysis.automatic_acquisition', '=', True),
-            ('repetition', '=', repetition_value),
-            ('annulled', '=', False),
-            ]
-        method_field = self.interface.method_field
-        if method_field:
-            method_value = line.get(method_field.alias)
-            if method_value is not None:
-                clause.append(
-                    ('method.code', '=', method_value.split(' - ')[0]))
-
-        nb_line = NotebookLine.search(clause)
-        if nb_line:
-            return nb_line[0].id
-        return None
-
-    def _get_compilation_line_id(self, line):
-        pool = Pool()
-        Data = pool.get('lims.interface.data')
-
-        clause = [('compilation', '=', line['compilation'])]
-        if line.get('notebook_line'):
-            clause.append(('notebook_line', '=', line['notebook_line']))
-
-        else:
-            sub_clause = [('id', '=', -1)]
-            fraction_field = self.interface.fraction_field
-            analysis_field = self.interface.analysis_field
-            repetition_field = self.interface.repetition_field
-            if fraction_field and analysis_field and repetition_field:
-
-                fraction_value = line.get(fraction_field.alias)
-                analysis_value = line.get(analysis_field.alias)
-                repetition_value = line.get(repetition_field.alias)
-
-                if (fraction_value is not None and
-                        analysis_value is not None and
-                        repetition_value is not None):
-                    sub_clause = [
-                        (fraction_field.alias, '=', fraction_value),
-                        (analysis_field.alias, '=', analysis_value),
-                        (repetition_field.alias, '=', repetition_value),
-                        ]
-                    method_field = self.interface.method_field
-                    if method_field:
-                        method_value = line.get(method_field.alias)
-                        if method_value is not None:
-                            sub_clause.append(
-                                (method_field.alias, '=', method_value))
-
-            clause.extend(sub_clause)
-        line = Data.search(clause)
-        return line and line[0].id or None
-
     @classmethod
     @ModelView.button
     @Workflow.transition('validated')
@@ -2,11 +2,10 @@
 # This file is part of lims_interface module for Tryton.
 # The COPYRIGHT file at the top level of this repository contains
 # the full copyright notices and license terms.
-import formulas
-
 from trytond import backend
 from trytond.model import ModelSQL, ModelView, fields
 from trytond.transaction import Transaction
+from trytond.modules.lims.formula_cache import compile_formula
 from .interface import FIELD_TYPE_SQL, FIELD_TYPE_SELECTION
 
 
@@ -106,9 +105,7 @@ class TableField(ModelSQL, ModelView):
     group_col = fields.Integer('Group Col')
 
     def get_ast(self):
-        parser = formulas.Parser()
-        ast = parser.ast(self.formula)[1].compile()
-        return ast
+        return compile_formula(self.formula)
 
 
 class TableGroupedField(ModelSQL, ModelView):
@@ -138,14 +135,11 @@ class TableGroupedField(ModelSQL, ModelView):
     def get_inputs(self, name=None):
         if not self.formula:
             return
-        parser = formulas.Parser()
-        ast = parser.ast(self.formula)[1].compile()
+        ast = compile_formula(self.formula)
         return (' '.join([x for x in ast.inputs])).lower()
 
     def get_ast(self):
-        parser = formulas.Parser()
-        ast = parser.ast(self.formula)[1].compile()
-        return ast
+        return compile_formula(self.formula)
 
 
 class TableView(ModelSQL, ModelView):
@@ -3,6 +3,8 @@
 # the full copyright notices and license terms.
 import os
 import operator
+import threading
+from hashlib import sha1
 from io import BytesIO
 from decimal import Decimal
 from datetime import date, datetime
@@ -11,7 +13,7 @@ from functools import partial
 from PyPDF2 import PdfFileMerger
 from PyPDF2.utils import PdfReadError
 from jinja2 import contextfilter, Markup
-from jinja2 import Environment, FunctionLoader
+from jinja2 import Environment, FunctionLoader, FileSystemBytecodeCache
 from lxml import html as lxml_html
 from base64 import b64encode
 from babel.support import Translations as BabelTranslations
@@ -22,13 +24,23 @@ from trytond.model import ModelSQL, ModelView, DeactivableMixin, fields
 from trytond.pool import Pool
 from trytond.pyson import Eval, Bool, Or
 from trytond.transaction import Transaction
-from trytond.cache import Cache
+from trytond.cache import Cache, LRUDict
+from trytond.config import config
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
 from trytond.tools import file_open
 from trytond import backend
 from .generator import PdfGenerator
 
+TEMPLATE_CACHE_SIZE = config.getint('lims_report_html', 'template_cache_size',
+    default=400)
+# Jinja uses a private directory in the temporary folder when not set
+BYTECODE_CACHE_DIRECTORY = config.get('lims_report_html', 'bytecode_cache',
+    default=None)
+
+_local = threading.local()
+_bytecode_cache = FileSystemBytecodeCache(BYTECODE_CACHE_DIRECTORY)
+
 
 class ReportTemplate(DeactivableMixin, ModelSQL, ModelView):
     'Report Template'
@@ -537,12 +549,15 @@ class LimsReport:
             env = cls.get_lims_environment()
 
         header = {}
-        report_template = env.from_string(template_string)
+        report_template = cls.get_lims_compiled_template(env, template_string)
         context = cls.get_context(records, header, data=data)
         context.update({
             'report': action,
             'get_image': cls.get_image,
             'operation': cls.operation,
+            # cached templates may hold the globals of a previous render
+            'gettext': env.globals['gettext'],
+            'ngettext': env.globals['ngettext'],
             })
         res = report_template.render(**context)
         res = cls.parse_images(res)
@@ -551,10 +566,23 @@ class LimsReport:
 
     @classmethod
     def get_lims_environment(cls):
-        extensions = ['jinja2.ext.i18n', 'jinja2.ext.autoescape',
-            'jinja2.ext.with_', 'jinja2.ext.loopcontrols', 'jinja2.ext.do']
-        env = Environment(extensions=extensions,
-            loader=FunctionLoader(lambda name: ''))
+        '''
+        Return the environment of the current thread. It is kept between
+        renders so the compiled templates are reused; the filters and
+        translations are bound to the current transaction on each call.
+        '''
+        env = getattr(_local, 'environment', None)
+        if env is None:
+            extensions = ['jinja2.ext.i18n', 'jinja2.ext.autoescape',
+                'jinja2.ext.with_', 'jinja2.ext.loopcontrols',
+                'jinja2.ext.do']
+            sources = LRUDict(TEMPLATE_CACHE_SIZE)
+            env = Environment(extensions=extensions,
+                loader=FunctionLoader(lambda name: sources.get(name, '')),
+                bytecode_cache=_bytecode_cache,
+                cache_size=TEMPLATE_CACHE_SIZE)
+            env.lims_sources = sources
+            _local.environment = env
 
         env.filters.update(cls.get_lims_filters())
 
@@ -563,6 +591,16 @@ class LimsReport:
         env.install_gettext_translations(translations)
         return env
 
+    @classmethod
+    def get_lims_compiled_template(cls, env, template_string):
+        '''
+        Return the template compiled from template_string, cached by the
+        digest of its text
+        '''
+        name = sha1(template_string.encode('utf-8')).hexdigest()
+        env.lims_sources[name] = template_string
+        return env.get_template(name)
+
     @classmethod
     def get_lims_filters(cls):
         Lang = Pool().get('ir.lang')
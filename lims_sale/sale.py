@@ -17,9 +17,9 @@ from trytond.pool import PoolMeta, Pool
 from trytond.pyson import Eval, Bool
 from trytond.transaction import Transaction
 from trytond.config import config
-from trytond.tools import get_smtp_server
 from trytond.exceptions import UserError, UserWarning
 from trytond.i18n import gettext
+from trytond.modules.lims.mail import send_mail
 from trytond.modules.lims_report_html.html_template import LimsReport
 from trytond.modules.sale.exceptions import SaleValidationError
 
@@ -373,9 +373,7 @@ class Sale(metaclass=PoolMeta):
     def send_msg(from_addr, to_addr, msg, task_number):
         success = False
         try:
-            server = get_smtp_server()
-            server.sendmail(from_addr, [to_addr], msg.as_string())
-            server.quit()
+            send_mail(from_addr, [to_addr], msg.as_string())
             success = True
         except Exception:
             logger.error(
@@ -2,6 +2,7 @@
 # The COPYRIGHT file at the top level of this repository contains
 # the full copyright notices and license terms.
 from datetime import datetime
+from itertools import islice
 from dateutil import rrule
 
 from trytond.model import Model, fields
@@ -44,6 +45,15 @@ DETAIL_FREQUENCE_OPTIONS = [
     ('years', 'Years'),
     ]
 
+FREQUENCES = {
+    'minutes': rrule.MINUTELY,
+    'hours': rrule.HOURLY,
+    'days': rrule.DAILY,
+    'weeks': rrule.WEEKLY,
+    'months': rrule.MONTHLY,
+    'years': rrule.YEARLY,
+    }
+
 WEEK_DAYS = [
     (None, ''),
     ('0', 'Monday'),
@@ -136,22 +146,30 @@ class EventCreator(Model):
     @classmethod
     def create_events(cls, records, create_method,
             start_date=None, include_start_date=True):
+        pool = Pool()
+        LabWorkYear = pool.get('lims.lab.workyear')
+
+        workyear = LabWorkYear(LabWorkYear.find())
         events = []
         for record in records:
             if record.finish_selection == 'quantity':
                 if record.frequence_selection == 'workshift':
                     events.extend(cls.create_workshift_fixed_events(
-                        record, create_method, start_date, include_start_date))
+                        record, create_method, start_date, include_start_date,
+                        workyear=workyear))
                 else:
                     events.extend(cls.create_fixed_events(
-                        record, create_method, start_date, include_start_date))
+                        record, create_method, start_date, include_start_date,
+                        workyear=workyear))
             elif record.finish_selection == 'date':
                 if record.frequence_selection == 'workshift':
                     events.extend(cls.create_workshift_events_until_date(
-                        record, create_method, start_date, include_start_date))
+                        record, create_method, start_date, include_start_date,
+                        workyear=workyear))
                 else:
                     events.extend(cls.create_events_until_date(
-                        record, create_method, start_date, include_start_date))
+                        record, create_method, start_date, include_start_date,
+                        workyear=workyear))
             else:
                 raise UserError(gettext(
                     'lims_tools.missing_end_condition'))
@@ -159,45 +177,84 @@ class EventCreator(Model):
         return events
 
     @classmethod
-    def create_fixed_events(cls, record, create_method,
-            start_date=None, include_start_date=True):
+    def iter_dates(cls, record, start_date=None, include_start_date=True,
+            workyear=None):
+        '''
+        Yield lazily the scheduled dates of record.
+
+        A single rule is iterated once: each date is the occurrence that
+        comes detail_frequence occurrences after the previous one, or the
+        latest of them that is not a holiday.
+        '''
         pool = Pool()
         LabWorkYear = pool.get('lims.lab.workyear')
 
-        workyear_id = LabWorkYear.find()
-        workyear = LabWorkYear(workyear_id)
+        if workyear is None:
+            workyear = LabWorkYear(LabWorkYear.find())
 
-        ruleset = rrule.rruleset()
+        exdates = set()
         byweekday = None
         if (record.only_workdays and
                 record.detail_frequence_selection == 'days'):
             # TODO: handle minutes and hours
             min_time = datetime.min.time()
-            for h in workyear.holidays:
-                ruleset.exdate(datetime.combine(h.date, min_time))
+            exdates = set(datetime.combine(h.date, min_time)
+                for h in workyear.holidays)
             byweekday = workyear.workdays
 
-        freq = {
-            'minutes': rrule.MINUTELY,
-            'hours': rrule.HOURLY,
-            'days': rrule.DAILY,
-            'weeks': rrule.WEEKLY,
-            'months': rrule.MONTHLY,
-            'years': rrule.YEARLY,
-            }[record.detail_frequence_selection]
-        count = record.detail_frequence + 1
+        freq = FREQUENCES[record.detail_frequence_selection]
+        step = max(int(record.detail_frequence or 0), 1)
 
         if not start_date:
             start_date = record.start_date
-        date = start_date
+        if include_start_date:
+            yield start_date
+
+        occurrences = iter(rrule.rrule(freq, dtstart=start_date,
+            byweekday=byweekday))
+        # the first occurrence is the current date
+        if next(occurrences, None) is None:
+            return
+        following = []
+        while True:
+            following.extend(islice(occurrences, step - len(following)))
+            window = following[:step]
+            if not window:
+                return
+            for index in range(len(window) - 1, -1, -1):
+                if window[index] not in exdates:
+                    break
+            else:
+                del following[:step]
+                continue
+            del following[:index + 1]
+            yield window[index]
+
+    @classmethod
+    def _get_specific_times(cls, record, workyear):
+        pool = Pool()
+        WorkShift = pool.get('lims.lab.workyear.shift')
 
-        if not include_start_date:
-            ruleset.rrule(rrule.rrule(freq, count=count,
-                dtstart=date, byweekday=byweekday))
-            date = ruleset[-1]
+        workyear_shifts = WorkShift.search([
+            ('workyear', '=', workyear.id),
+            ('shift', 'in', [s for s in record.shifts]),
+            ])
+        specific_times = []
+        for ws in workyear_shifts:
+            if record.shift_time in ['start', 'start_end']:
+                specific_times.append((ws.shift.start_time, ws.shift.id))
+            if record.shift_time in ['end', 'start_end']:
+                specific_times.append((ws.shift.end_time, ws.shift.id))
+        return specific_times
 
+    @classmethod
+    def create_fixed_events(cls, record, create_method,
+            start_date=None, include_start_date=True, workyear=None):
         events = []
-        while len(events) < record.end_repetition:
+        if not record.end_repetition or record.end_repetition <= 0:
+            return events
+        for date in cls.iter_dates(record, start_date, include_start_date,
+                workyear):
             event = {}
             if record.specific_event_time:
                 date = date.replace(
@@ -210,72 +267,30 @@ class EventCreator(Model):
             new_event = create_method(record, event)
             if new_event:
                 events.append(new_event)
-
-            ruleset.rrule(rrule.rrule(freq, count=count,
-                dtstart=date, byweekday=byweekday))
-            date = ruleset[-1]
-
+            if len(events) >= record.end_repetition:
+                break
         return events
 
     @classmethod
     def create_workshift_fixed_events(cls, record, create_method,
-            start_date=None, include_start_date=True):
+            start_date=None, include_start_date=True, workyear=None):
         pool = Pool()
         Company = pool.get('company.company')
         LabWorkYear = pool.get('lims.lab.workyear')
-        WorkShift = pool.get('lims.lab.workyear.shift')
 
-        workyear_id = LabWorkYear.find()
-        workyear = LabWorkYear(workyear_id)
-
-        workyear_shifts = WorkShift.search([
-            ('workyear', '=', workyear_id),
-            ('shift', 'in', [s for s in record.shifts]),
-            ])
-        if not workyear_shifts:
-            return []
+        if workyear is None:
+            workyear = LabWorkYear(LabWorkYear.find())
+        specific_times = cls._get_specific_times(record, workyear)
+        events = []
+        if (not specific_times or not record.end_repetition or
+                record.end_repetition <= 0):
+            return events
 
         company = Company(Transaction().context.get('company'))
         company_timezone = company.get_timezone()
 
-        ruleset = rrule.rruleset()
-        byweekday = None
-        if (record.only_workdays and
-                record.detail_frequence_selection == 'days'):
-            # TODO: handle minutes and hours
-            min_time = datetime.min.time()
-            for h in workyear.holidays:
-                ruleset.exdate(datetime.combine(h.date, min_time))
-            byweekday = workyear.workdays
-
-        freq = {
-            'minutes': rrule.MINUTELY,
-            'hours': rrule.HOURLY,
-            'days': rrule.DAILY,
-            'weeks': rrule.WEEKLY,
-            'months': rrule.MONTHLY,
-            'years': rrule.YEARLY,
-            }[record.detail_frequence_selection]
-        count = record.detail_frequence + 1
-
-        specific_times = []
-        for ws in workyear_shifts:
-            if record.shift_time in ['start', 'start_end']:
-                specific_times.append((ws.shift.start_time, ws.shift.id))
-            if record.shift_time in ['end', 'start_end']:
-                specific_times.append((ws.shift.end_time, ws.shift.id))
-
-        if not start_date:
-            start_date = record.start_date
-        date = start_date
-
-        if not include_start_date:
-            ruleset.rrule(rrule.rrule(freq, count=count,
-                dtstart=date, byweekday=byweekday))
-            date = ruleset[-1]
-
-        events = []
-        while len(events) < record.end_repetition:
+        for date in cls.iter_dates(record, start_date, include_start_date,
+                workyear):
             for specific_time, shift_id in specific_times:
                 event = {}
                 event_date = company_timezone.localize(date.replace(
@@ -290,132 +305,52 @@ class EventCreator(Model):
                 if new_event:
                     events.append(new_event)
                 if len(events) == record.end_repetition:
-                    break
-
-            ruleset.rrule(rrule.rrule(freq, count=count,
-                dtstart=date, byweekday=byweekday))
-            date = ruleset[-1]
-
+                    return events
         return events
 
     @classmethod
     def create_events_until_date(cls, record, create_method,
-            start_date=None, include_start_date=True):
-        pool = Pool()
-        LabWorkYear = pool.get('lims.lab.workyear')
-
-        workyear_id = LabWorkYear.find()
-        workyear = LabWorkYear(workyear_id)
-
-        ruleset = rrule.rruleset()
-        byweekday = None
-        if (record.only_workdays and
-                record.detail_frequence_selection == 'days'):
-            # TODO: handle minutes and hours
-            min_time = datetime.min.time()
-            for h in workyear.holidays:
-                ruleset.exdate(datetime.combine(h.date, min_time))
-            byweekday = workyear.workdays
-
-        freq = {
-            'minutes': rrule.MINUTELY,
-            'hours': rrule.HOURLY,
-            'days': rrule.DAILY,
-            'weeks': rrule.WEEKLY,
-            'months': rrule.MONTHLY,
-            'years': rrule.YEARLY,
-            }[record.detail_frequence_selection]
-        count = record.detail_frequence + 1
-
+            start_date=None, include_start_date=True, workyear=None):
         max_time = datetime.max.time()
         end_date = datetime.combine(record.end_date, max_time)
 
-        if not start_date:
-            start_date = record.start_date
-        date = start_date
-
-        if not include_start_date:
-            ruleset.rrule(rrule.rrule(freq, count=count,
-                dtstart=date, byweekday=byweekday))
-            date = ruleset[-1]
-
         events = []
-        while date < end_date:
+        for date in cls.iter_dates(record, start_date, include_start_date,
+                workyear):
+            if date >= end_date:
+                break
             event = {}
             event['scheduled_date'] = date
             event['week_day'] = date.weekday()
             new_event = create_method(record, event)
             if new_event:
                 events.append(new_event)
-
-            ruleset.rrule(rrule.rrule(freq, count=count,
-                dtstart=date, byweekday=byweekday))
-            date = ruleset[-1]
-
         return events
 
     @classmethod
     def create_workshift_events_until_date(cls, record, create_method,
-            start_date=None, include_start_date=True):
+            start_date=None, include_start_date=True, workyear=None):
         pool = Pool()
         Company = pool.get('company.company')
         LabWorkYear = pool.get('lims.lab.workyear')
-        WorkShift = pool.get('lims.lab.workyear.shift')
 
-        workyear_id = LabWorkYear.find()
-        workyear = LabWorkYear(workyear_id)
-
-        workyear_shifts = WorkShift.search([
-            ('workyear', '=', workyear_id),
-            ('shift', 'in', [s for s in record.shifts]),
-            ])
-        if not workyear_shifts:
+        if workyear is None:
+            workyear = LabWorkYear(LabWorkYear.find())
+        specific_times = cls._get_specific_times(record, workyear)
+        if not specific_times:
             return []
 
         company = Company(Transaction().context.get('company'))
         company_timezone = company.get_timezone()
 
-        ruleset = rrule.rruleset()
-        byweekday = None
-        if (record.only_workdays and
-                record.detail_frequence_selection == 'days'):
-            # TODO: handle minutes and hours
-            min_time = datetime.min.time()
-            for h in workyear.holidays:
-                ruleset.exdate(datetime.combine(h.date, min_time))
-            byweekday = workyear.workdays
-
-        freq = {
-            'minutes': rrule.MINUTELY,
-            'hours': rrule.HOURLY,
-            'days': rrule.DAILY,
-            'weeks': rrule.WEEKLY,
-            'months': rrule.MONTHLY,
-            'years': rrule.YEARLY,
-            }[record.detail_frequence_selection]
-        count = record.detail_frequence + 1
-
-        specific_times = []
-        for ws in workyear_shifts:
-            if record.shift_time in ['start', 'start_end']:
-                specific_times.append((ws.shift.start_time, ws.shift.id))
-            if record.shift_time in ['end', 'start_end']:
-                specific_times.append((ws.shift.end_time, ws.shift.id))
-
         max_time = datetime.max.time()
         end_date = datetime.combine(record.end_date, max_time)
 
-        if not start_date:
-            start_date = record.start_date
-        date = start_date
-
-        if not include_start_date:
-            ruleset.rrule(rrule.rrule(freq, count=count,
-                dtstart=date, byweekday=byweekday))
-            date = ruleset[-1]
-
         events = []
-        while date < end_date:
+        for date in cls.iter_dates(record, start_date, include_start_date,
+                workyear):
+            if date >= end_date:
+                break
             for specific_time, shift_id in specific_times:
                 event = {}
                 event_date = company_timezone.localize(date.replace(
@@ -429,11 +364,6 @@ class EventCreator(Model):
                 new_event = create_method(record, event)
                 if new_event:
                     events.append(new_event)
-
-            ruleset.rrule(rrule.rrule(freq, count=count,
-                dtstart=date, byweekday=byweekday))
-            date = ruleset[-1]
-
         return events
 
 
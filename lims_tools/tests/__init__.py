@@ -0,0 +1,10 @@
+# This file is part of lims_tools module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+
+try:
+    from trytond.modules.lims_tools.tests.test_lims_tools import suite
+except ImportError:
+    from .test_lims_tools import suite
+
+__all__ = ['suite']
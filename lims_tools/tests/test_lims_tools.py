@@ -0,0 +1,158 @@
+# This file is part of lims_tools module for Tryton.
+# The COPYRIGHT file at the top level of this repository contains
+# the full copyright notices and license terms.
+import unittest
+from datetime import date, datetime
+from itertools import islice
+from types import SimpleNamespace
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import ModuleTestCase
+from trytond.tests.test_tryton import activate_module, with_transaction
+from trytond.modules.lims_tools.event_creator import EventCreator
+
+
+class LimsToolsTestCase(ModuleTestCase):
+    'Test lims_tools module'
+    module = 'lims_tools'
+
+
+class EventCreatorTestCase(unittest.TestCase):
+    'Test the scheduled dates of the event creator'
+
+    @classmethod
+    def setUpClass(cls):
+        activate_module('lims_tools')
+
+    def setUp(self):
+        self.workyear = SimpleNamespace(
+            workdays=(0, 1, 2, 3, 4),
+            holidays=[SimpleNamespace(date=date(2021, 1, 6))])
+
+    def get_dates(self, frequence_selection, frequence=1, count=3,
+            start_date=datetime(2021, 1, 4, 8, 0), include_start_date=True,
+            only_workdays=False):
+        record = SimpleNamespace(
+            start_date=start_date,
+            detail_frequence=frequence,
+            detail_frequence_selection=frequence_selection,
+            only_workdays=only_workdays)
+        return list(islice(EventCreator.iter_dates(record,
+                    include_start_date=include_start_date,
+                    workyear=self.workyear), count))
+
+    @with_transaction()
+    def test_minutes(self):
+        'Test dates every minutes'
+        self.assertEqual(self.get_dates('minutes', 15), [
+                datetime(2021, 1, 4, 8, 0),
+                datetime(2021, 1, 4, 8, 15),
+                datetime(2021, 1, 4, 8, 30),
+                ])
+
+    @with_transaction()
+    def test_hours(self):
+        'Test dates every hours'
+        self.assertEqual(self.get_dates('hours', 10), [
+                datetime(2021, 1, 4, 8, 0),
+                datetime(2021, 1, 4, 18, 0),
+                datetime(2021, 1, 5, 4, 0),
+                ])
+
+    @with_transaction()
+    def test_days(self):
+        'Test dates every days'
+        self.assertEqual(self.get_dates('days', 15), [
+                datetime(2021, 1, 4, 8, 0),
+                datetime(2021, 1, 19, 8, 0),
+                datetime(2021, 2, 3, 8, 0),
+                ])
+
+    @with_transaction()
+    def test_weeks(self):
+        'Test dates every weeks'
+        self.assertEqual(self.get_dates('weeks', 2), [
+                datetime(2021, 1, 4, 8, 0),
+                datetime(2021, 1, 18, 8, 0),
+                datetime(2021, 2, 1, 8, 0),
+                ])
+
+    @with_transaction()
+    def test_months(self):
+        'Test dates every months'
+        self.assertEqual(self.get_dates('months', 1), [
+                datetime(2021, 1, 4, 8, 0),
+                datetime(2021, 2, 4, 8, 0),
+                datetime(2021, 3, 4, 8, 0),
+                ])
+        # months without the day of the start date are skipped
+        self.assertEqual(self.get_dates('months', 1,
+                start_date=datetime(2021, 1, 31)), [
+                datetime(2021, 1, 31),
+                datetime(2021, 3, 31),
+                datetime(2021, 5, 31),
+                ])
+
+    @with_transaction()
+    def test_years(self):
+        'Test dates every years'
+        self.assertEqual(self.get_dates('years', 1), [
+                datetime(2021, 1, 4, 8, 0),
+                datetime(2022, 1, 4, 8, 0),
+                datetime(2023, 1, 4, 8, 0),
+                ])
+
+    @with_transaction()
+    def test_frequence_empty(self):
+        'Test an empty frequence is every occurrence'
+        self.assertEqual(self.get_dates('days', 0),
+            self.get_dates('days', 1))
+        self.assertEqual(self.get_dates('days', None),
+            self.get_dates('days', 1))
+
+    @with_transaction()
+    def test_include_start_date(self):
+        'Test the start date is only yielded when included'
+        self.assertEqual(self.get_dates('days', 2,
+                include_start_date=False), [
+                datetime(2021, 1, 6, 8, 0),
+                datetime(2021, 1, 8, 8, 0),
+                datetime(2021, 1, 10, 8, 0),
+                ])
+        self.assertEqual(self.get_dates('days', 2, count=4)[1:],
+            self.get_dates('days', 2, include_start_date=False))
+
+    @with_transaction()
+    def test_only_workdays(self):
+        'Test weekends and holidays are skipped'
+        start_date = datetime(2021, 1, 4)
+        self.assertEqual(self.get_dates('days', 1, count=5,
+                start_date=start_date, only_workdays=True), [
+                datetime(2021, 1, 4),
+                datetime(2021, 1, 5),
+                datetime(2021, 1, 7),
+                datetime(2021, 1, 8),
+                datetime(2021, 1, 11),
+                ])
+        self.assertEqual(self.get_dates('days', 1, count=3,
+                start_date=start_date, include_start_date=False,
+                only_workdays=True), [
+                datetime(2021, 1, 5),
+                datetime(2021, 1, 7),
+                datetime(2021, 1, 8),
+                ])
+        # only the days frequence is restricted to working days
+        self.assertEqual(self.get_dates('weeks', 1, count=2,
+                start_date=datetime(2021, 1, 2), only_workdays=True), [
+                datetime(2021, 1, 2),
+                datetime(2021, 1, 9),
+                ])
+
+
+def suite():
+    suite = trytond.tests.test_tryton.suite()
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+            LimsToolsTestCase))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+            EventCreatorTestCase))
+    return suite